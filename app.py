@@ -2,7 +2,7 @@ from os import environ
 
 from flask import Flask
 
-from extensions.extensions import db, ma, bcrypt, jwt
+from extensions.extensions import db, bcrypt, jwt, cache, async_db, jobs, change_feed, group_commit, profiler, shards, encoder, stats_merger
 from errors.handlers import register_error_handlers
 
 
@@ -13,12 +13,53 @@ def create_app():
     # configs
     app.config["SQLALCHEMY_DATABASE_URI"] = environ.get("DATABASE_URL")
     app.config["JWT_SECRET_KEY"] = environ.get("JWT_SECRET_KEY")
+    # database connections kept per process, should be at least the number of request threads
+    if environ.get("DB_POOL_SIZE"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_size": int(environ["DB_POOL_SIZE"])}
+    # response cache for the auditor reports: "auto" (memory, or sqlite with several gunicorn workers), "memory", "sqlite" or "none"
+    app.config["CACHE_BACKEND"] = environ.get("CACHE_BACKEND", "auto")
+    app.config["CACHE_DEFAULT_TTL"] = int(environ.get("CACHE_DEFAULT_TTL", 60))
+    # worker threads computing background reports
+    app.config["JOB_WORKERS"] = int(environ.get("JOB_WORKERS", 2))
+    # report jobs not heard from in JOB_STALE_AFTER seconds are restarted, checked every JOB_SWEEP_INTERVAL seconds
+    app.config["JOB_SWEEP_INTERVAL"] = float(environ.get("JOB_SWEEP_INTERVAL", 30))
+    app.config["JOB_STALE_AFTER"] = float(environ.get("JOB_STALE_AFTER", 120))
+    app.config["JOB_MAX_ATTEMPTS"] = int(environ.get("JOB_MAX_ATTEMPTS", 3))
+    # transaction change feed: "auto" (LISTEN/NOTIFY on postgreSQL, otherwise in-process), "postgres" or "memory"
+    app.config["CHANGE_FEED_BACKEND"] = environ.get("CHANGE_FEED_BACKEND", "auto")
+    # open change streams per worker process, each holds one of its THREADS request threads
+    app.config["MAX_STREAMS"] = int(environ.get("MAX_STREAMS", 2))
+    # users and accounts with more transactions than this are deleted in the background, this many at a time
+    app.config["PURGE_CHUNK_SIZE"] = int(environ.get("PURGE_CHUNK_SIZE", 5000))
+    # commit concurrent transaction posts together, waiting up to GROUP_COMMIT_WINDOW_MS for up to GROUP_COMMIT_MAX_BATCH
+    app.config["GROUP_COMMIT"] = environ.get("GROUP_COMMIT", "").lower() in ("1", "true", "yes")
+    app.config["GROUP_COMMIT_WINDOW_MS"] = float(environ.get("GROUP_COMMIT_WINDOW_MS", 5))
+    app.config["GROUP_COMMIT_MAX_BATCH"] = int(environ.get("GROUP_COMMIT_MAX_BATCH", 100))
+    # category statistics are buffered by each write and merged every STATS_MERGE_INTERVAL seconds
+    app.config["STATS_MERGE_INTERVAL"] = float(environ.get("STATS_MERGE_INTERVAL", 1))
+    # profile this fraction of requests, plus any request sending "X-Profile: <PROFILE_TOKEN>"
+    app.config["PROFILE_SAMPLE_RATE"] = float(environ.get("PROFILE_SAMPLE_RATE", 0))
+    app.config["PROFILE_TOKEN"] = environ.get("PROFILE_TOKEN")
+    if environ.get("PROFILE_DIR"):
+        app.config["PROFILE_DIR"] = environ["PROFILE_DIR"]
+    # compress responses of at least COMPRESS_MIN_SIZE bytes, with the first of COMPRESS_ALGORITHMS the client accepts
+    app.config["COMPRESS_MIN_SIZE"] = int(environ.get("COMPRESS_MIN_SIZE", 1024))
+    app.config["COMPRESS_ALGORITHMS"] = [name for name in environ.get("COMPRESS_ALGORITHMS", "zstd,gzip").split(",") if name]
+    # extra databases, comma separated, to split accounts and transactions across by user (DATABASE_URL is shard 0)
+    app.config["SHARD_DATABASE_URLS"] = [url for url in environ.get("SHARD_DATABASE_URLS", "").split(",") if url]
 
     # connect libraries with flask app
+    shards.init_app(app, db)
     db.init_app(app)
-    ma.init_app(app)
     bcrypt.init_app(app)
     jwt.init_app(app)
+    cache.init_app(app)
+    jobs.init_app(app)
+    change_feed.init_app(app)
+    group_commit.init_app(app)
+    profiler.init_app(app)
+    encoder.init_app(app)
+    stats_merger.init_app(app)
 
     register_error_handlers(app)
 
@@ -26,6 +67,18 @@ def create_app():
 
     app.register_blueprint(db_commands)
 
+    from commands.bench_commands import bench_commands
+
+    app.register_blueprint(bench_commands)
+
+    from commands.profile_commands import profile_commands
+
+    app.register_blueprint(profile_commands)
+
+    from commands.startup_commands import startup_commands
+
+    app.register_blueprint(startup_commands)
+
     from controllers.auth_controller import auth_bp
 
     app.register_blueprint(auth_bp)
@@ -38,4 +91,132 @@ def create_app():
     
     app.register_blueprint(categories_bp)
 
+    from controllers.report_controller import reports_bp
+
+    app.register_blueprint(reports_bp)
+
+    from controllers.sync_controller import sync_bp
+
+    app.register_blueprint(sync_bp)
+
     return app
+
+
+# Called in each worker process forked from a preloaded app (see gunicorn.conf.py).
+# Connections, locks and threads created before the fork belong to the parent process,
+# so each worker replaces them with its own. workers is the number of worker processes started,
+# threads the request threads of each, which the database pools are sized to unless DB_POOL_SIZE is set.
+def reset_after_fork(app, workers=1, threads=None):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+            if threads and not environ.get("DB_POOL_SIZE"):
+                engine.pool = resized_pool(engine.pool, threads)
+    async_db.reset_after_fork()
+    cache.reset_after_fork(workers)
+    jobs.reset_after_fork()
+    change_feed.reset_after_fork()
+    group_commit.reset_after_fork()
+    shards.reset_after_fork()
+    stats_merger.reset_after_fork()
+    profiler.reset_after_fork()
+
+
+# A new, empty copy of a connection pool holding up to `size` connections, like QueuePool.recreate() with another size.
+def resized_pool(pool, size):
+    from sqlalchemy.pool import QueuePool
+
+    if not isinstance(pool, QueuePool) or pool.size() == size:
+        return pool
+    return QueuePool(
+        pool._creator,
+        pool_size=size,
+        max_overflow=pool._max_overflow,
+        pre_ping=pool._pre_ping,
+        use_lifo=pool._pool.use_lifo,
+        timeout=pool._timeout,
+        recycle=pool._recycle,
+        echo=pool.echo,
+        logging_name=pool._orig_logging_name,
+        reset_on_return=pool._reset_on_return,
+        _dispatch=pool.dispatch,
+        dialect=pool._dialect,
+    )
+
+
+# ASGI entry point for the async serving mode, e.g. uvicorn asgi:app --workers 4
+# The account read endpoints run as async views on an async database engine,
+# every other request is passed through to the Flask app.
+def create_asgi_app(flask_app=None):
+    from asgiref.wsgi import WsgiToAsgi
+
+    from controllers.async_account_controller import match_route
+    from utils.auth_utils import jwt_identity_from_headers
+
+    flask_app = flask_app or create_app()
+    async_db.init_app(flask_app)
+    wsgi_app = WsgiToAsgi(flask_app)
+
+    class AsyncRequest:
+        def __init__(self, headers, body, user_id):
+            self.headers = headers
+            self.body = body
+            self.user_id = user_id
+
+    async def send_json(send, headers, data, status):
+        # Encode and compress like the sync views, so responses match them byte for byte
+        mimetype, body = encoder.encode(flask_app, data, headers.get("accept"))
+        body, encoding = encoder.compress(body, headers.get("accept-encoding"))
+        response_headers = [
+            (b"content-type", mimetype.encode()),
+            (b"content-length", str(len(body)).encode()),
+            (b"vary", b"Accept, Accept-Encoding"),
+        ]
+        if encoding:
+            response_headers.append((b"content-encoding", encoding.encode()))
+        await send({"type": "http.response.start", "status": status, "headers": response_headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await async_db.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def asgi_app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await lifespan(receive, send)
+
+        handler, kwargs = (None, None)
+        # The async engine only knows the default database, so with several shards Flask serves everything
+        if scope["type"] == "http" and shards.count == 1:
+            handler, kwargs = match_route(scope["method"], scope["path"])
+        if handler is None:
+            return await wsgi_app(scope, receive, send)
+
+        # Read the whole request body before handling the request
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+
+        with flask_app.app_context():
+            user_id, error = jwt_identity_from_headers(headers)
+            if error:
+                return await send_json(send, headers, *error)
+            try:
+                data, status = await handler(AsyncRequest(headers, body, user_id), **kwargs)
+            except Exception:
+                flask_app.logger.exception("Exception on %s [%s]", scope["path"], scope["method"])
+                data, status = {"message": "Internal Server Error"}, 500
+            await send_json(send, headers, data, status)
+
+    return asgi_app
+
@@ -0,0 +1,4 @@
+from app import create_asgi_app
+
+# Run the async serving mode with an ASGI server, e.g. uvicorn asgi:app --workers 4
+app = create_asgi_app()
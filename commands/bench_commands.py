@@ -0,0 +1,270 @@
+import asyncio
+import http.client
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import Blueprint, current_app
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from sqlalchemy.util import await_only
+
+from extensions.extensions import db, group_commit
+from extensions.encoding import COMPRESSORS, FORMATS
+
+from models.user import User
+
+bench_commands = Blueprint("bench", __name__)
+
+
+# Print the throughput and latency percentiles of one benchmark run.
+def report(label, latencies, elapsed):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{label:<28} {len(latencies) / elapsed:>9.1f} req/s   "
+        f"p50 {statistics.median(latencies) * 1000:>8.1f} ms   p99 {p99 * 1000:>8.1f} ms"
+    )
+
+
+def token_for(email):
+    user = db.session.scalar(db.select(User).filter_by(email=email))
+    if not user:
+        raise click.ClickException(f"No user with email {email}, run flask db seed first")
+    return create_access_token(identity=str(user.id))
+
+
+# Add a fixed delay to every query, so a local SQLite database behaves like one across the network.
+def simulate_latency(sync_engine, async_engine, latency):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def sync_delay(*args):
+        time.sleep(latency)
+
+    # Async engine events run inside SQLAlchemy's greenlet, so the delay can be awaited
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def async_delay(*args):
+        await_only(asyncio.sleep(latency))
+
+
+# Compare the sync Flask views, limited to a fixed number of worker threads,
+# with the async views of the ASGI app, which handle every request concurrently.
+# Runs against DATABASE_URL, e.g. flask bench async --requests 2000 --concurrency 100
+@bench_commands.cli.command("async")
+@click.option("--requests", "total", default=1000, help="Requests sent per mode.")
+@click.option("--concurrency", default=100, help="Requests in flight at once.")
+@click.option("--threads", default=8, help="Worker threads available to the sync app.")
+@click.option("--path", default="/accounts/", help="Endpoint to request.")
+@click.option("--email", default="audit@email.com", help="User the requests are authenticated as.")
+@click.option("--latency", default=0.0, help="Simulated database round trip in ms, added to every query.")
+def bench_async(total, concurrency, threads, path, email, latency):
+    from app import create_asgi_app
+    from extensions.extensions import async_db
+
+    flask_app = current_app._get_current_object()
+    headers = {"Authorization": f"Bearer {token_for(email)}"}
+    asgi_app = create_asgi_app(flask_app)
+    if latency:
+        simulate_latency(db.engine, async_db.engine, latency / 1000)
+    print(
+        f"{total} x GET {path}, {concurrency} concurrent clients, "
+        f"database: {db.engine.url.get_backend_name()}, added latency: {latency} ms"
+    )
+
+    # Sync: concurrency is capped by the number of worker threads
+    def sync_request(_):
+        started = time.perf_counter()
+        with flask_app.test_client() as client:
+            response = client.get(path, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(threads, concurrency)) as pool:
+        latencies = list(pool.map(sync_request, range(total)))
+    report(f"sync ({threads} threads)", latencies, time.perf_counter() - started)
+
+    # Async: requests go straight into the ASGI app, bounded only by the client concurrency
+    raw_headers = [(key.lower().encode(), value.encode()) for key, value in headers.items()]
+
+    async def async_request(limit):
+        async with limit:
+            started = time.perf_counter()
+            status = {}
+
+            async def receive():
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    status["code"] = message["status"]
+
+            scope = {"type": "http", "method": "GET", "path": path, "headers": raw_headers, "query_string": b""}
+            await asgi_app(scope, receive, send)
+            assert status["code"] == 200, status
+            return time.perf_counter() - started
+
+    async def run_async():
+        limit = asyncio.Semaphore(concurrency)
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(async_request(limit) for _ in range(total)))
+        elapsed = time.perf_counter() - started
+        await async_db.dispose()
+        return latencies, elapsed
+
+    latencies, elapsed = asyncio.run(run_async())
+    report(f"async ({concurrency} concurrent)", latencies, elapsed)
+
+
+# Send requests over one keep-alive connection, run in a separate client process.
+def http_client(args):
+    port, path, headers, count = args
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        assert response.status == 200, response.status
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+    return latencies
+
+
+# Start gunicorn and wait until it answers, returning the process and its startup time.
+def start_server(root_path, port, workers, threads, path, headers):
+    env = dict(os.environ, ACCESS_LOG="")
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+            "--workers", str(workers), "--threads", str(threads), "--bind", f"127.0.0.1:{port}",
+        ],
+        cwd=root_path,
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    while time.perf_counter() - started < 60:
+        try:
+            http_client((port, path, headers, 1))
+            return server, time.perf_counter() - started
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.05)
+    server.kill()
+    raise click.ClickException("The server did not start within 60 seconds")
+
+
+# Compare a single worker process with the preforking launcher (gunicorn.conf.py) over HTTP,
+# reporting the time until the first response and the throughput of each.
+# e.g. flask bench serve --workers 4 --clients 32
+@bench_commands.cli.command("serve")
+@click.option("--workers", default=multiprocessing.cpu_count(), help="Worker processes for the multi-core run.")
+@click.option("--threads", default=4, help="Threads per worker process.")
+@click.option("--requests", "total", default=2000, help="Requests sent per run.")
+@click.option("--clients", default=16, help="Concurrent client processes.")
+@click.option("--path", default="/accounts/", help="Endpoint to request.")
+@click.option("--email", default="user@email.com", help="User the requests are authenticated as.")
+@click.option("--port", default=8099, help="Port the servers listen on while benchmarking.")
+def bench_serve(workers, threads, total, clients, path, email, port):
+    headers = {"Authorization": f"Bearer {token_for(email)}"}
+    print(f"{total} x GET {path}, {clients} client processes, {threads} threads per worker")
+
+    for label, worker_count in (("single process", 1), (f"{workers} workers", workers)):
+        server, startup = start_server(current_app.root_path, port, worker_count, threads, path, headers)
+        try:
+            per_client = max(1, total // clients)
+            started = time.perf_counter()
+            with multiprocessing.Pool(clients) as pool:
+                results = pool.map(http_client, [(port, path, headers, per_client)] * clients)
+            elapsed = time.perf_counter() - started
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{label:<28} startup {startup * 1000:>7.0f} ms")
+        report(label, [latency for result in results for latency in result], elapsed)
+
+
+# Compare committing every transaction post on its own with group commit (see extensions/group_commit.py).
+# Every request adds a transaction to the same account.
+# e.g. flask bench commit --requests 5000 --threads 32
+@bench_commands.cli.command("commit")
+@click.option("--requests", "total", default=2000, help="Transactions posted per mode.")
+@click.option("--threads", default=16, help="Concurrent request threads.")
+@click.option("--account", "account_id", default=2, help="Account the transactions are posted to.")
+@click.option("--email", default="user@email.com", help="User the requests are authenticated as.")
+def bench_commit(total, threads, account_id, email):
+    flask_app = current_app._get_current_object()
+    headers = {"Authorization": f"Bearer {token_for(email)}"}
+    path = f"/accounts/{account_id}/transactions/"
+    print(f"{total} x POST {path}, {threads} threads, database: {db.engine.url.get_backend_name()}")
+
+    def post(_):
+        started = time.perf_counter()
+        with flask_app.test_client() as client:
+            response = client.post(path, json={"amount": -1, "description": "Benchmark"}, headers=headers)
+        assert response.status_code == 201, response.get_data(as_text=True)
+        return time.perf_counter() - started
+
+    enabled = group_commit.enabled
+    try:
+        for label, group in (("commit per request", False), ("group commit", True)):
+            group_commit.enabled = group
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                latencies = list(pool.map(post, range(total)))
+            report(label, latencies, time.perf_counter() - started)
+    finally:
+        group_commit.enabled = enabled
+
+
+# Compare the response formats (see extensions/encoding.py) on real list endpoints: bytes on the wire
+# without compression and with each compressor, and the CPU time to encode and compress one response.
+# e.g. flask db seed --users 1000 && flask bench encoding --repeat 20
+@bench_commands.cli.command("encoding")
+@click.option("--repeat", default=10, help="Encodes timed per format, the average is reported.")
+@click.option("--email", default="audit@email.com", help="User the requests are authenticated as.")
+def bench_encoding(repeat, email):
+    flask_app = current_app._get_current_object()
+    headers = {"Authorization": f"Bearer {token_for(email)}"}
+    requests = [
+        ("GET", "/accounts/", None),
+        ("POST", "/accounts/search", {"query": "a"}),
+        ("GET", "/auth/users", None),
+    ]
+
+    def cpu_ms(fn):
+        started = time.process_time()
+        for _ in range(repeat):
+            result = fn()
+        return result, (time.process_time() - started) * 1000 / repeat
+
+    for method, path, body in requests:
+        with flask_app.test_client() as client:
+            response = client.open(path, method=method, json=body, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        data = response.get_json()
+        print(f"\n{method} {path}, {len(data)} items")
+        print(
+            f"{'format':<32} {'bytes':>10} "
+            + " ".join(f"{name:>10}" for name in COMPRESSORS)
+            + f" {'encode ms':>10} "
+            + " ".join(f"{name + ' ms':>10}" for name in COMPRESSORS)
+        )
+        for mimetype in FORMATS:
+            encoded, encode_ms = cpu_ms(lambda: flask_app.json.encode(data, mimetype))
+            sizes, times = [], []
+            for compress in COMPRESSORS.values():
+                compressed, compress_ms = cpu_ms(lambda: compress(encoded))
+                sizes.append(len(compressed))
+                times.append(compress_ms)
+            print(
+                f"{mimetype:<32} {len(encoded):>10} "
+                + " ".join(f"{size:>10}" for size in sizes)
+                + f" {encode_ms:>10.2f} "
+                + " ".join(f"{ms:>10.2f}" for ms in times)
+            )
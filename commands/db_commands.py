@@ -1,6 +1,9 @@
+import time
+
+import click
 from flask import Blueprint
 
-from extensions.extensions import db, bcrypt
+from extensions.extensions import db, bcrypt, shards
 
 from models.user import User
 
@@ -10,53 +13,71 @@ from models.transaction import Transaction
 
 from models.category import Category
 
+from models.report_job import ReportJob
+
+from models.balance_snapshot import BalanceSnapshot
+
+from models.change_log import ChangeCounter, Tombstone
+
+from models.amount_stats import AmountStats, AmountSketchBin, AmountStatsDelta
+
+from commands.seed_generator import generate
+
+from utils.balance_utils import create_snapshots
+from utils.stats_utils import rebuild_amount_stats
+
 db_commands = Blueprint("db", __name__)
 
 
 @db_commands.cli.command("create")
 def create_tables():
-    db.create_all()
+    # Only the default database, the other shards are created by shards.create_all()
+    db.create_all(bind_key=None)
+    shards.create_all()
     print("Tables created")
 
 
 @db_commands.cli.command("drop")
 def drop_tables():
-    db.drop_all()
+    db.drop_all(bind_key=None)
+    shards.drop_all()
     print("Tables dropped")
 
 
+# Seeds the example users, accounts and transactions.
+# With --users, also generates synthetic data for load testing, e.g:
+# flask db seed --users 100000 --accounts-per-user 3 --transactions-per-account 50
 @db_commands.cli.command("seed")
-def seed_tables():
-    users = [
+@click.option("--users", default=0, help="Number of synthetic users to generate.")
+@click.option("--accounts-per-user", default=2, help="Accounts generated for each synthetic user.")
+@click.option("--transactions-per-account", default=20, help="Transactions generated for each synthetic account.")
+@click.option("--chunk-size", default=10000, help="Rows written per bulk insert.")
+@click.option("--seed", "random_seed", type=int, default=None, help="Random seed for reproducible data.")
+def seed_tables(users, accounts_per_user, transactions_per_account, chunk_size, random_seed):
+    # bcrypt is deliberately slow, so hash the shared seed password only once
+    password_hash = bcrypt.generate_password_hash("123456").decode("utf-8")
+
+    users_list = [
         User(
             username="Admin",
             email="admin@email.com",
-            password_hash=bcrypt.generate_password_hash("123456").decode("utf-8"),
+            password_hash=password_hash,
             role="Admin",
         ),
         User(
             username="User",
             email="user@email.com",
-            password_hash=bcrypt.generate_password_hash("123456").decode("utf-8"),
+            password_hash=password_hash,
             role="User",
         ),
         User(
             username="Auditor",
             email="audit@email.com",
-            password_hash=bcrypt.generate_password_hash("123456").decode("utf-8"),
+            password_hash=password_hash,
             role="Auditor",
         ),
     ]
 
-    db.session.add_all(users)
-
-    accounts = [
-        Account(account_type="Savings", balance=1234.56, user=users[0]),
-        Account(account_type="Credit", balance=10000.00, user=users[1]),
-        Account(account_type="Holiday", balance=9876.54, user=users[2]),
-    ]
-    db.session.add_all(accounts)
-
     categories = [
         Category(
             name="Subscriptions",
@@ -67,17 +88,69 @@ def seed_tables():
             description="Inclusive of Health, Travel, Home and Contents, Pet, and Car insurance",
         ),
     ]
-    db.session.add_all(categories)
-    
-    transactions = [
-        Transaction(account=accounts[0], amount=-45.67, description="Spotify", category=categories[0]),
-        Transaction(account=accounts[1], amount=-123.45, description="Netflix", category=categories[0]),
-        Transaction(account=accounts[1], amount=-234.56, description="Leetcode", category=categories[0]),
-        Transaction(account=accounts[2], amount=-10283, description="Travel Insurance", category=categories[1]),
-    ]
-    db.session.add_all(transactions)
-
 
+    db.session.add_all(users_list)
+    db.session.add_all(categories)
+    # Committed on shard 0, which copies the users and categories to the other shards
     db.session.commit()
 
+    # Each account is written with its transactions to the shard of its user
+    accounts = [
+        (users_list[0], "Savings", 1234.56, [(-45.67, "Spotify", categories[0])]),
+        (users_list[1], "Credit", 10000.00, [(-123.45, "Netflix", categories[0]), (-234.56, "Leetcode", categories[0])]),
+        (users_list[2], "Holiday", 9876.54, [(-10283, "Travel Insurance", categories[1])]),
+    ]
+    for user, account_type, balance, transactions in accounts:
+        with shards.on(shards.for_user(user.id)):
+            account = Account(account_type=account_type, balance=balance, user_id=user.id)
+            db.session.add(account)
+            db.session.add_all(
+                Transaction(account=account, amount=amount, description=description, category_id=category.id)
+                for amount, description, category in transactions
+            )
+            db.session.commit()
+
     print("Tables seeded")
+
+    if users > 0:
+        started = time.perf_counter()
+        counts = generate(
+            users,
+            accounts_per_user,
+            transactions_per_account,
+            password_hash,
+            chunk_size=chunk_size,
+            seed=random_seed,
+            progress=lambda written: print(f"  {written}/{users} synthetic users written"),
+        )
+        elapsed = time.perf_counter() - started
+        print(
+            f"Generated {counts['users']} users, {counts['accounts']} accounts and "
+            f"{counts['transactions']} transactions in {elapsed:.1f}s"
+        )
+
+
+# Snapshot account balances, used to answer historical balance queries quickly.
+# Run daily (e.g. from cron) to snapshot every account with new transactions,
+# or with --min-transactions N to only snapshot accounts with N new transactions since their last snapshot.
+@db_commands.cli.command("snapshot")
+@click.option("--min-transactions", default=1, help="New transactions an account needs before it is snapshotted.")
+def snapshot_balances(min_transactions):
+    created = 0
+    for index in range(shards.count):
+        with shards.on(index):
+            created += create_snapshots(min_transactions)
+    print(f"Created {created} balance snapshots")
+
+
+# Rebuild the transaction amount statistics (see GET /accounts/<id>/amount_stats) from scratch.
+# They are kept up to date on every write, so this is only needed after loading data outside the app.
+@db_commands.cli.command("rebuild-stats")
+@click.option("--chunk-size", default=10000, help="Transactions read per query.")
+def rebuild_stats(chunk_size):
+    started = time.perf_counter()
+    done = 0
+    for index in range(shards.count):
+        with shards.on(index):
+            done += rebuild_amount_stats(chunk_size, progress=lambda done: print(f"  {done} transactions"))
+    print(f"Rebuilt amount statistics from {done} transactions in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,57 @@
+import io
+import os
+import pstats
+
+import click
+from flask import Blueprint, current_app
+
+profile_commands = Blueprint("profile", __name__)
+
+
+# Summarise the request profiles written by the profiling hook (see extensions/profiler.py),
+# listing the functions each endpoint spends the most time in across all its profiles.
+# e.g. flask profile report --endpoint accounts.transactions_search --sort tottime
+@profile_commands.cli.command("report")
+@click.option("--endpoint", default=None, help="Only report this endpoint, e.g. accounts.account_summary.")
+@click.option("--limit", default=20, help="Functions listed per endpoint.")
+@click.option(
+    "--sort",
+    type=click.Choice(["cumulative", "tottime", "ncalls"]),
+    default="cumulative",
+    help="cumulative includes the time spent in called functions, tottime doesn't.",
+)
+def profile_report(endpoint, limit, sort):
+    directory = current_app.config["PROFILE_DIR"]
+    endpoints = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    if endpoint:
+        endpoints = [name for name in endpoints if name == endpoint]
+    if not endpoints:
+        raise click.ClickException(f"No profiles found in {directory}")
+
+    for name in endpoints:
+        files = sorted(
+            os.path.join(directory, name, file) for file in os.listdir(os.path.join(directory, name))
+            if file.endswith(".prof")
+        )
+        if not files:
+            continue
+        output = io.StringIO()
+        stats = pstats.Stats(*files, stream=output)
+        print(f"== {name}: {len(files)} requests, {stats.total_tt / len(files) * 1000:.1f} ms profiled per request")
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        # Skip the header pstats prints before the table
+        table = output.getvalue()
+        table = table[table.index("   ncalls"):] if "   ncalls" in table else table
+        print(table.rstrip() + "\n")
+
+
+@profile_commands.cli.command("clear")
+def profile_clear():
+    directory = current_app.config["PROFILE_DIR"]
+    removed = 0
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith(".prof"):
+                os.remove(os.path.join(root, file))
+                removed += 1
+    print(f"Removed {removed} profiles")
@@ -0,0 +1,286 @@
+import csv
+import io
+import math
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from extensions.extensions import db, shards
+from extensions.shards import ACCOUNT_ID_SPAN
+
+from models.user import User
+from models.account import Account
+from models.transaction import Transaction
+from models.category import Category
+from models.change_log import next_change_seqs
+from models.amount_stats import add_sketches, sketches_of
+
+# Categories used by the synthetic data, with the merchants that appear in transaction descriptions.
+# Lists are ordered from most to least common, the generator picks from them with a Zipf-like skew.
+SYNTHETIC_CATEGORIES = {
+    "Groceries": ["Woolworths", "Coles", "Aldi", "IGA", "Harris Farm"],
+    "Dining": ["McDonalds", "Guzman y Gomez", "Grill'd", "Local Cafe", "Sushi Train"],
+    "Transport": ["Opal", "Uber", "BP", "Shell", "Ampol"],
+    "Subscriptions": ["Spotify", "Netflix", "Leetcode", "Disney Plus", "iCloud"],
+    "Utilities": ["AGL", "Origin Energy", "Sydney Water", "Telstra", "Optus"],
+    "Shopping": ["Amazon", "Kmart", "JB Hi-Fi", "Bunnings", "Target"],
+    "Entertainment": ["Event Cinemas", "Steam", "Ticketek", "Timezone", "Bowlarama"],
+    "Health": ["Chemist Warehouse", "Priceline", "Medicare Gap", "Dentist", "Physio"],
+    "Insurance": ["Travel Insurance", "Car Insurance", "Pet Insurance", "Health Insurance", "Home and Contents"],
+    "Income": ["Salary", "Interest", "Refund", "Transfer In", "Dividend"],
+}
+
+# Typical spend (median, spread) per category, used as lognormal parameters for the amount.
+CATEGORY_AMOUNTS = {
+    "Groceries": (60, 0.6),
+    "Dining": (20, 0.5),
+    "Transport": (15, 0.7),
+    "Subscriptions": (15, 0.4),
+    "Utilities": (150, 0.4),
+    "Shopping": (45, 1.0),
+    "Entertainment": (30, 0.7),
+    "Health": (40, 0.8),
+    "Insurance": (120, 0.9),
+    "Income": (1500, 0.6),
+}
+
+ACCOUNT_TYPES = ["Everyday", "Savings", "Credit", "Holiday", "Business", "Offset"]
+
+# How far back generated transactions go.
+HISTORY_DAYS = 730
+
+
+# Build cumulative weights following a Zipf distribution, so the first items are picked far more often.
+def zipf_weights(count, exponent=1.1):
+    weights = [1 / (rank**exponent) for rank in range(1, count + 1)]
+    total = 0
+    cumulative = []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+class SyntheticDataGenerator:
+    def __init__(self, category_ids, password_hash, start_ids, seed=None, now=None, shard_of=lambda user_id: 0):
+        # Parameters:
+        # - category_ids: mapping of category name to its database id.
+        # - password_hash: a single pre-computed bcrypt hash shared by every generated user.
+        # - start_ids: the next free id for "users", and a list of the next free id on each shard
+        #   for "accounts" and "transactions".
+        # - shard_of: the shard of a user id, where their accounts and transactions are written.
+        self.rng = random.Random(seed)
+        self.password_hash = password_hash
+        self.now = now or datetime.utcnow()
+        self.shard_of = shard_of
+        self.next_user_id = start_ids["users"]
+        self.next_account_id = list(start_ids["accounts"])
+        self.next_transaction_id = list(start_ids["transactions"])
+
+        self.category_names = list(SYNTHETIC_CATEGORIES)
+        self.category_ids = category_ids
+        self.category_cum_weights = zipf_weights(len(self.category_names))
+        self.merchant_cum_weights = zipf_weights(5, exponent=1.3)
+        self.account_type_cum_weights = zipf_weights(len(ACCOUNT_TYPES))
+
+    # Pick a date in the history window, skewed towards the recent past.
+    def random_date(self, start):
+        window = (self.now - start).total_seconds()
+        offset = window * (self.rng.random() ** 0.5)
+        return start + timedelta(seconds=offset)
+
+    def random_amount(self, category):
+        median, spread = CATEGORY_AMOUNTS[category]
+        amount = Decimal(str(round(self.rng.lognormvariate(math.log(median), spread), 2)))
+        if amount < Decimal("0.01"):
+            amount = Decimal("0.01")
+        # Income is the only category that adds money to an account.
+        return amount if category == "Income" else -amount
+
+    def user_rows(self, count):
+        rows = []
+        for _ in range(count):
+            user_id = self.next_user_id
+            self.next_user_id += 1
+            roll = self.rng.random()
+            role = "Admin" if roll < 0.001 else "Auditor" if roll < 0.01 else "User"
+            rows.append(
+                {
+                    "id": user_id,
+                    "username": f"user{user_id}",
+                    "email": f"user{user_id}@example.com",
+                    "password_hash": self.password_hash,
+                    "role": role,
+                    "date_created": self.now - timedelta(days=HISTORY_DAYS + self.rng.randint(0, 365)),
+                }
+            )
+        return rows
+
+    def account_rows(self, user_rows, accounts_per_user):
+        rows = []
+        for user in user_rows:
+            shard = self.shard_of(user["id"])
+            for _ in range(accounts_per_user):
+                account_type = self.rng.choices(ACCOUNT_TYPES, cum_weights=self.account_type_cum_weights)[0]
+                rows.append(
+                    {
+                        "id": self.next_account_id[shard],
+                        "user_id": user["id"],
+                        "account_type": account_type,
+                        # The opening balance, transactions are added on top of it below.
+                        "balance": Decimal(str(round(self.rng.uniform(0, 5000), 2))),
+                        "date_created": self.now - timedelta(days=HISTORY_DAYS + self.rng.randint(0, 30)),
+                    }
+                )
+                self.next_account_id[shard] += 1
+        return rows
+
+    # Generates the transactions of each account and updates its balance to match them.
+    def transaction_rows(self, account_rows, transactions_per_account):
+        rows = []
+        for account in account_rows:
+            shard = self.shard_of(account["user_id"])
+            start = self.now - timedelta(days=HISTORY_DAYS)
+            for _ in range(transactions_per_account):
+                category = self.rng.choices(self.category_names, cum_weights=self.category_cum_weights)[0]
+                merchant = self.rng.choices(SYNTHETIC_CATEGORIES[category], cum_weights=self.merchant_cum_weights)[0]
+                amount = self.random_amount(category)
+                # Roughly one in twenty transactions is uncategorised and has no description.
+                uncategorised = self.rng.random() < 0.05
+                rows.append(
+                    {
+                        "id": self.next_transaction_id[shard],
+                        "account_id": account["id"],
+                        "category_id": None if uncategorised else self.category_ids[category],
+                        "amount": amount,
+                        "description": None if uncategorised else merchant,
+                        "transaction_date": self.random_date(start),
+                    }
+                )
+                account["balance"] += amount
+                self.next_transaction_id[shard] += 1
+            # Keep the balance inside the Numeric(10, 2) column range.
+            account["balance"] = max(min(account["balance"], Decimal("99999999.99")), Decimal("-99999999.99"))
+        return rows
+
+
+# Make sure every synthetic category exists, returning a mapping of category name to id.
+def ensure_categories():
+    existing = {category.name: category.id for category in db.session.scalars(db.select(Category))}
+    for name in SYNTHETIC_CATEGORIES:
+        if name not in existing:
+            category = Category(name=name, description=f"{name} transactions")
+            db.session.add(category)
+            db.session.flush()
+            existing[name] = category.id
+    db.session.commit()
+    return existing
+
+
+# The next free primary key of each table, so generated rows can carry explicit ids.
+# Users come from shard 0, accounts and transactions from each shard, in its own account id range.
+def next_ids():
+    ids = {"users": (db.session.scalar(db.select(func.max(User.id))) or 0) + 1, "accounts": [], "transactions": []}
+    for index in range(shards.count):
+        with shards.on(index):
+            max_account_id = db.session.scalar(db.select(func.max(Account.id))) or 0
+            ids["accounts"].append(max(max_account_id, index * ACCOUNT_ID_SPAN) + 1)
+            ids["transactions"].append((db.session.scalar(db.select(func.max(Transaction.id))) or 0) + 1)
+    return ids
+
+
+# Bulk insert rows into a table, using COPY on PostgreSQL and an executemany INSERT elsewhere.
+def bulk_insert(table, rows):
+    if not rows:
+        return
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            # An unquoted empty field is read back as NULL by COPY ... CSV
+            writer.writerow(["" if row[column] is None else row[column] for column in columns])
+        buffer.seek(0)
+        cursor = connection.connection.dbapi_connection.cursor()
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+        )
+    else:
+        connection.execute(table.insert(), rows)
+
+
+# Rows were inserted with explicit ids, so move the PostgreSQL sequences past them.
+def reset_sequences():
+    connection = db.session.connection()
+    if connection.dialect.name != "postgresql":
+        return
+    for model in (User, Account, Transaction):
+        table = model.__tablename__
+        # An empty table keeps its sequence, which on shards past 0 starts their account id range
+        connection.exec_driver_sql(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), MAX(id)) FROM {table} "
+            "HAVING MAX(id) IS NOT NULL"
+        )
+
+
+def generate(users, accounts_per_user, transactions_per_account, password_hash, chunk_size=10000, seed=None, progress=None):
+    # Parameters:
+    # - users, accounts_per_user, transactions_per_account: how much data to generate.
+    # - password_hash: hashed once by the caller, bcrypt is far too slow to run per user.
+    # - chunk_size: the approximate number of transactions written per database transaction.
+    # - progress: optional callback receiving the number of users written so far.
+    generator = SyntheticDataGenerator(
+        ensure_categories(), password_hash, next_ids(), seed=seed, shard_of=shards.for_user
+    )
+    rows_per_user = max(1, accounts_per_user * max(1, transactions_per_account))
+    users_per_chunk = max(1, chunk_size // rows_per_user)
+
+    written = 0
+    while written < users:
+        count = min(users_per_chunk, users - written)
+        user_rows = generator.user_rows(count)
+        account_rows = generator.account_rows(user_rows, accounts_per_user)
+        transaction_rows = generator.transaction_rows(account_rows, transactions_per_account)
+        # Users go to every shard, accounts and transactions to the shard of their user
+        for index in range(shards.count):
+            shard_accounts = [row for row in account_rows if shards.for_user(row["user_id"]) == index]
+            account_ids = {row["id"] for row in shard_accounts}
+            shard_transactions = [row for row in transaction_rows if row["account_id"] in account_ids]
+            with shards.on(index):
+                write_chunk(user_rows, shard_accounts, shard_transactions, chunk_size)
+
+        written += count
+        if progress:
+            progress(written)
+
+    for index in range(shards.count):
+        with shards.on(index):
+            reset_sequences()
+            db.session.commit()
+    return {
+        "users": users,
+        "accounts": users * accounts_per_user,
+        "transactions": users * accounts_per_user * transactions_per_account,
+    }
+
+
+# Write one chunk of generated rows to the current shard in a single database transaction.
+def write_chunk(user_rows, account_rows, transaction_rows, chunk_size):
+    # Bulk inserts skip the ORM events, so reserve the change sequence numbers here
+    rows = account_rows + transaction_rows
+    for row, seq in zip(rows, next_change_seqs(db.session.connection(), len(rows))):
+        row["change_seq"] = seq
+
+    bulk_insert(User.__table__, user_rows)
+    bulk_insert(Account.__table__, account_rows)
+    # Large accounts are split again so a single INSERT never holds more than chunk_size rows.
+    for start in range(0, len(transaction_rows), chunk_size):
+        bulk_insert(Transaction.__table__, transaction_rows[start:start + chunk_size])
+    add_sketches(
+        db.session.connection(),
+        sketches_of((row["account_id"], row["category_id"], row["amount"]) for row in transaction_rows),
+    )
+    db.session.commit()
@@ -0,0 +1,106 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+from flask import Blueprint, current_app
+
+from commands.bench_commands import token_for
+
+startup_commands = Blueprint("startup", __name__, cli_group=None)
+
+# Run in a fresh interpreter, so every import is paid again like on a cold start.
+# Prints the phase it enters to stderr, where -X importtime writes each import as it happens.
+COLD_START = """
+import json, sys, time
+started = time.perf_counter()
+sys.stderr.write("phase: startup\\n")
+from app import create_app
+app = create_app()
+created = time.perf_counter()
+sys.stderr.write("phase: first request\\n")
+response = app.test_client().open({path!r}, method={method!r}, headers={headers!r})
+responded = time.perf_counter()
+print(json.dumps({{"status": response.status_code, "startup": created - started, "first_request": responded - created}}), flush=True)
+"""
+
+
+# Start a cold process and return its timings, with the process start to first response time as "total".
+def cold_start(root_path, path, method, headers, importtime=False):
+    script = COLD_START.format(path=path, method=method, headers=headers)
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", script]
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=root_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    line = process.stdout.readline()
+    total = time.perf_counter() - started
+    _, errors = process.communicate()
+    if not line:
+        raise click.ClickException(f"The app failed to start:\n{errors}")
+    result = json.loads(line)
+    result["total"] = total
+    result["imports"] = parse_importtime(errors) if importtime else []
+    return result
+
+
+# Read the -X importtime output into (phase, module, self seconds, cumulative seconds) rows.
+def parse_importtime(output):
+    phase = None
+    imports = []
+    for line in output.splitlines():
+        if line.startswith("phase: "):
+            phase = line[len("phase: "):]
+        elif line.startswith("import time:") and phase and "|" in line:
+            own, cumulative, module = line[len("import time:"):].split("|")
+            if own.strip().isdigit():
+                imports.append((phase, module.strip(), int(own) / 1e6, int(cumulative) / 1e6))
+    return imports
+
+
+# Profile a cold start of the app: the time from process start to the first response,
+# and the time each package and module takes to import.
+# Exits with an error when the time to first response is above --target-ms.
+# e.g. flask startup-profile --path /accounts/ --runs 10
+@startup_commands.cli.command("startup-profile")
+@click.option("--path", default="/accounts/", help="Endpoint of the first request.")
+@click.option("--method", default="GET", help="Method of the first request.")
+@click.option("--email", default="user@email.com", help="User the first request is authenticated as, empty for none.")
+@click.option("--runs", default=5, help="Cold starts timed, the median is reported.")
+@click.option("--limit", default=15, help="Packages and modules listed.")
+@click.option("--target-ms", default=600, help="Time to first response to stay under.")
+def startup_profile(path, method, email, runs, limit, target_ms):
+    root_path = current_app.root_path
+    headers = {"Authorization": f"Bearer {token_for(email)}"} if email else {}
+    print(f"Cold starts: {method} {path}, median of {runs} runs")
+    results = [cold_start(root_path, path, method, headers) for _ in range(runs)]
+    status = results[-1]["status"]
+    if status >= 400:
+        raise click.ClickException(f"{method} {path} returned {status}")
+    median = {key: statistics.median(result[key] for result in results) * 1000 for key in ("startup", "first_request", "total")}
+    print(f"{'startup ms':>12} {'first request ms':>18} {'to first response ms':>22}")
+    print(f"{median['startup']:>12.0f} {median['first_request']:>18.0f} {median['total']:>22.0f}")
+
+    # -X importtime slows imports down, so the breakdown comes from a separate run
+    imports = cold_start(root_path, path, method, headers, importtime=True)["imports"]
+    packages = {}
+    for phase, module, own, _ in imports:
+        totals = packages.setdefault(module.split(".")[0], {"startup": 0, "first request": 0})
+        totals[phase] += own
+    print("\nImport time per package (ms)")
+    print(f"{'package':<32} {'startup':>10} {'first request':>14}")
+    ranked = sorted(packages.items(), key=lambda item: -sum(item[1].values()))
+    for package, totals in ranked[:limit]:
+        print(f"{package:<32} {totals['startup'] * 1000:>10.1f} {totals['first request'] * 1000:>14.1f}")
+
+    print("\nSlowest modules (ms, excluding their own imports)")
+    print(f"{'module':<48} {'phase':<14} {'self':>8} {'cumulative':>11}")
+    for phase, module, own, cumulative in sorted(imports, key=lambda row: -row[2])[:limit]:
+        print(f"{module:<48} {phase:<14} {own * 1000:>8.1f} {cumulative * 1000:>11.1f}")
+
+    verdict = "within" if median["total"] <= target_ms else "over"
+    print(f"\nTime to first response: {median['total']:.0f} ms, {verdict} the {target_ms} ms target")
+    if median["total"] > target_ms:
+        sys.exit(1)
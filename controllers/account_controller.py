@@ -1,14 +1,19 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sqlalchemy import func
+from datetime import datetime, timedelta
 
-from extensions.extensions import db
-from utils.auth_utils import is_user_in_role, role_required
+from sqlalchemy import func, inspect
+
+from extensions.extensions import db, cache, shards
+from utils.auth_utils import authorized_account, is_user_in_role, role_required
+from utils.balance_utils import BUCKETS, balance_history, parse_date, snapshot_adjustment
+from utils.purge_utils import delete_owner, needs_background_purge, start_purge
+from utils.stats_utils import amount_stats, parse_percentiles
 
 from models.account import Account, account_schema, accounts_schema
 from models.transaction import Transaction, transactions_schema
 
-from controllers.transaction_controller import transactions_bp
+from controllers.transaction_controller import transactions_bp, event_stream
 
 accounts_bp = Blueprint("accounts", __name__, url_prefix="/accounts")
 accounts_bp.register_blueprint(transactions_bp)
@@ -50,11 +55,16 @@ def get_all_accounts():
         )
         accounts = db.session.scalars(stmt)
         return accounts_schema.dump(accounts), 200
-    # Select all accounts, ordered by creation date, without filtering by user ID
+    # Select all accounts from every shard, merged by creation date, without filtering by user ID
+    accounts = [account for dumped in shards.scatter(dump_all_accounts) for account in dumped]
+    accounts.sort(key=lambda account: account["date_created"], reverse=True)
+    return accounts, 200
+
+
+# All accounts of the current shard, serialized, newest first.
+def dump_all_accounts():
     stmt = db.select(Account).order_by(Account.date_created.desc())
-    accounts = db.session.scalars(stmt)
-    # Execute the query and return the results
-    return accounts_schema.dump(accounts), 200
+    return accounts_schema.dump(db.session.scalars(stmt))
 
 
 # Retrieves a specific Account by its ID from the database.
@@ -62,16 +72,14 @@ def get_all_accounts():
 @accounts_bp.route("/<int:account_id>")
 @jwt_required()
 def get_account(account_id):
-    # Select an account by its ID
-    user_id = get_jwt_identity()
-    stmt = db.select(Account).filter_by(id=account_id)
-    account = db.session.scalar(stmt)
+    # Select an account by its ID, checking whether the user is an auditor or its owner
+    account, allowed = authorized_account(account_id, ["Auditor"])
     # If the account does not exist, return an error message
     if not account:
         return {"error": f"Account with id {account_id} not found"}, 404
 
     # If the user is an auditor or the owner of the account, return account details; otherwise, return an error
-    if is_user_in_role(["Auditor"]) or int(account.user_id) == int(user_id):
+    if allowed:
         return account_schema.dump(account), 200
     else:
         return {"error": "Not authorized to view this account"}, 403
@@ -83,19 +91,21 @@ def get_account(account_id):
 @accounts_bp.route("/<int:account_id>", methods=["PUT", "PATCH"])
 @jwt_required()
 def update_account(account_id):
-    user_id = get_jwt_identity()
     # Partially load JSON data allowing for optional fields
     body_data = account_schema.load(request.get_json(), partial=True)
-    # Select an account by its ID
-    stmt = db.select(Account).filter_by(id=account_id)
-    account = db.session.scalar(stmt)
+    # Select an account by its ID, checking whether the user is an admin or its owner
+    account, allowed = authorized_account(account_id, ["Admin"])
     # If the account does not exist, return an error message
     if not account:
         return {"error": f"Account with id {account_id} not found"}, 404
     # If the user is an admin or the owner of the account, update the account details; otherwise, return an error
-    if is_user_in_role(["Admin"]) or int(account.user_id) == int(user_id):
-        account.account_type = (body_data.get("account_type") or account.account_type,)
+    if allowed:
+        account.account_type = body_data.get("account_type") or account.account_type
         account.balance = body_data.get("balance") or account.balance
+        # A balance set directly isn't explained by any transaction, so snapshot it for the balance history
+        balance_changes = inspect(account).attrs.balance.history
+        if balance_changes.has_changes():
+            snapshot_adjustment(account, balance_changes.deleted[0])
         # Commit the updates to the database
         db.session.commit()
         return account_schema.dump(account), 201
@@ -106,21 +116,25 @@ def update_account(account_id):
 # Delete an Account
 # Users are only able to delete their own account
 # Otherwise users with the 'Admin' role can delete all accounts regardless of ownership
+# Accounts with many transactions are deleted in the background, returning 202 straight away
 # http://localhost:8080/accounts/id - DELETE
 @accounts_bp.route("/<int:account_id>", methods=["DELETE"])
 @jwt_required()
 def delete_account(account_id):
-    # Select an account by its ID
-    user_id = get_jwt_identity()
-    stmt = db.select(Account).filter_by(id=account_id)
-    account = db.session.scalar(stmt)
+    # Select an account by its ID, checking whether the user is an admin or its owner
+    account, allowed = authorized_account(account_id, ["Admin"])
     # If the account does not exist, return an error message
     if not account:
         return {"error": f"Account with id {account_id} not found"}, 404
     # If the user is an admin or the owner of the account, delete the account; otherwise, return an error
-    if is_user_in_role(["Admin"]) or int(account.user_id) == int(user_id):
-        # Remove the account from the database
-        db.session.delete(account)
+    if allowed:
+        if needs_background_purge(account):
+            start_purge(account)
+            return {
+                "message": f"Account '{account.account_type}' is being deleted"
+            }, 202
+        # Remove the account from the database, the database deletes its transactions with it
+        delete_owner(account)
         # Commit the changes to the database
         db.session.commit()
         return {
@@ -130,15 +144,84 @@ def delete_account(account_id):
         return {"error": "Unauthorized access"}, 403
 
 
+# Get the balance history of an account, for charts and point-in-time balances.
+# Optional query parameters: start and end (ISO 8601 dates, default the last 30 days),
+# bucket ("hour", "day", "week" or "month") to return only the closing balance of each period,
+# or at (ISO 8601 date) to return the balance at a single point in time.
+# http://localhost:8080/accounts/id/balance_history - GET
+@accounts_bp.route("/<int:account_id>/balance_history")
+@jwt_required()
+def get_balance_history(account_id):
+    account, allowed = authorized_account(account_id, ["Auditor"])
+    # If the account does not exist, return an error message
+    if not account:
+        return {"error": f"Account with id {account_id} not found"}, 404
+    # Only auditors and the owner of the account can view its history
+    if not allowed:
+        return {"error": "Not authorized to view this account"}, 403
+
+    bucket = request.args.get("bucket")
+    if bucket and bucket not in BUCKETS:
+        return {"error": f"bucket must be one of: {', '.join(BUCKETS)}"}, 400
+    try:
+        at = request.args.get("at")
+        if at:
+            start = end = parse_date(at)
+        else:
+            end = parse_date(request.args["end"]) if "end" in request.args else datetime.utcnow()
+            start = parse_date(request.args["start"]) if "start" in request.args else end - timedelta(days=30)
+    except ValueError:
+        return {"error": "Dates must be in ISO 8601 format, e.g. 2024-03-01T00:00:00"}, 400
+    if start > end:
+        return {"error": "start must be before end"}, 400
+
+    history = balance_history(account, start, end, bucket)
+    if at:
+        return {"account_id": account_id, "at": history[0]["date"], "balance": history[0]["balance"]}, 200
+    return {"account_id": account_id, "bucket": bucket, "history": history}, 200
+
+
+# Stream the transaction changes of every account as server-sent events, only accessible by "Auditor".
+# http://localhost:8080/accounts/stream - GET
+@accounts_bp.route("/stream")
+@jwt_required()
+@role_required(["Auditor"])
+def stream_all_transactions():
+    return event_stream()
+
+
 # Retrieve the total balance from all accounts, only accessible by users with "Auditor" role.
 # http://localhost:8080/accounts/total_balance - GET
 @accounts_bp.route("/total_balance")
 @jwt_required()
 @role_required(["Auditor"])
+@cache.cached(["total_balance"])
 def total_balance():
-    # This query calculates the sum of balances across all accounts in the database.
-    total = db.session.query(func.sum(Account.balance)).scalar()
-    return jsonify({"total_balance": total}), 200
+    # This query calculates the sum of balances across all accounts of a shard, the shards' sums are added up.
+    totals = [total for total in shards.scatter(shard_total_balance) if total is not None]
+    return jsonify({"total_balance": sum(totals) if totals else None}), 200
+
+
+def shard_total_balance():
+    return db.session.query(func.sum(Account.balance)).scalar()
+
+
+# Distribution of the transaction amounts of an account, accessible only by "Auditor".
+# Percentiles are approximate (within 1%) and read from a sketch kept up to date on every write,
+# so the response time doesn't depend on the number of transactions.
+# Optional query parameter: percentiles (comma separated, default "50,90,99").
+# http://localhost:8080/accounts/id/amount_stats - GET
+@accounts_bp.route("/<int:account_id>/amount_stats")
+@jwt_required()
+@role_required(["Auditor"])
+def get_account_amount_stats(account_id):
+    try:
+        percentiles = parse_percentiles(request.args.get("percentiles"))
+    except ValueError:
+        return {"error": "percentiles must be comma separated numbers between 0 and 100"}, 400
+    if not db.session.get(Account, account_id):
+        return {"error": f"Account with id {account_id} not found"}, 404
+    return {"account_id": account_id, **amount_stats("account", account_id, percentiles)}, 200
 
 
 # Rank transactions within an account by their amounts in descending order, accessible only by "Auditor".
@@ -146,6 +229,7 @@ def total_balance():
 @accounts_bp.route("/<int:account_id>/transactions/rank")
 @jwt_required()
 @role_required(["Auditor"])
+@cache.cached(["transaction_ranks:{account_id}"])
 def transaction_ranks(account_id):
     # This query assigns a rank to each transaction within a specified account based on the transaction amount.
     # It uses a window function to order transactions by amount within the partition of the account.
@@ -175,7 +259,15 @@ def transaction_ranks(account_id):
 @accounts_bp.route("/summary")
 @jwt_required()
 @role_required(["Auditor"])
+@cache.cached(["account_summary"])
 def account_summary():
+    # Accounts and their transactions live on the same shard, so each shard summarises its own accounts
+    summary = [row for rows in shards.scatter(shard_account_summary) for row in rows]
+    # The final result is a list of account summaries, each including the account ID, type, and total spent.
+    return jsonify(summary), 200
+
+
+def shard_account_summary():
     # This query creates a Common Table Expression (CTE) named 'account_summary' that contains
     # the total amount spent per account. It groups the sum of transaction amounts by account ID.
     cte = (
@@ -193,19 +285,14 @@ def account_summary():
         .join(Account, Account.id == cte.c.account_id)
         .all()
     )
-    # The final result is a list of account summaries, each including the account ID, type, and total spent.
-    return (
-        jsonify(
-            [
-                {
-                    "account_id": row.account_id,
-                    "account_type": row.account_type,
-                    "total_spent": row.total_spent,
-                }
-                for row in summary
-            ]
-        )
-    ), 200
+    return [
+        {
+            "account_id": row.account_id,
+            "account_type": row.account_type,
+            "total_spent": row.total_spent,
+        }
+        for row in summary
+    ]
 
 
 # Search for transactions based on a description term, with role-based results filtering.
@@ -220,16 +307,27 @@ def transactions_search():
 
     user_id = get_jwt_identity()
     search_term = f"%{body_data['query']}%"
-    # The query joins transactions with accounts and filters transactions by the search term using a case-insensitive LIKE.
-    query = Transaction.query.join(Account).filter(
-        Transaction.description.ilike(search_term)
-    )
 
-    # If the user is an auditor, they see all transactions. Otherwise, they only see transactions from their accounts.
+    # If the user is an auditor, they see all transactions, searched on every shard.
+    # Otherwise, they only see transactions from their accounts, which are all on their shard.
     if is_user_in_role("Auditor"):
-        search_result = query.all()
-        return jsonify(transactions_schema.dump(search_result)), 200
+        search_result = [
+            transaction
+            for dumped in shards.scatter(search_transactions, search_term)
+            for transaction in dumped
+        ]
+        return jsonify(search_result), 200
     else:
-        user_results = query.filter(Account.user_id == user_id)
         # Returns a JSON array of transactions that match the search term.
-        return jsonify(transactions_schema.dump(user_results)), 200
+        return jsonify(search_transactions(search_term, user_id)), 200
+
+
+# The transactions of the current shard matching a LIKE pattern, optionally only those of one user, serialized.
+def search_transactions(search_term, user_id=None):
+    # The query joins transactions with accounts and filters transactions by the search term using a case-insensitive LIKE.
+    query = Transaction.query.join(Account).filter(
+        Transaction.description.ilike(search_term)
+    )
+    if user_id is not None:
+        query = query.filter(Account.user_id == user_id)
+    return transactions_schema.dump(query)
@@ -0,0 +1,101 @@
+import json
+import re
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from extensions.extensions import async_db
+from utils.auth_utils import async_is_user_in_role
+
+from models.account import Account, account_schema, accounts_schema
+from models.transaction import Transaction, transactions_schema
+
+# Async versions of the read-heavy account endpoints, served natively by the ASGI app (see asgi.py).
+# They share the models, schemas and JWT settings of the sync controllers and return the same responses.
+# Relationships are eager loaded, as an AsyncSession can't lazy load them during serialisation.
+
+
+# Get a list of all accounts from the database.
+# http://localhost:8080/accounts - GET
+async def get_all_accounts(request):
+    user_id = request.user_id
+    stmt = (
+        select(Account)
+        .options(selectinload(Account.transactions), selectinload(Account.user))
+        .order_by(Account.date_created.desc())
+    )
+    async with async_db.session() as session:
+        # Query all accounts if the user is an auditor; otherwise, filter by the user's ID
+        if not await async_is_user_in_role(session, user_id, ["Auditor"]):
+            stmt = stmt.filter_by(user_id=user_id)
+        accounts = (await session.scalars(stmt)).all()
+    return accounts_schema.dump(accounts), 200
+
+
+# Retrieves a specific Account by its ID from the database.
+# http://localhost:8080/accounts/id - GET
+async def get_account(request, account_id):
+    user_id = request.user_id
+    stmt = (
+        select(Account)
+        .options(selectinload(Account.transactions), selectinload(Account.user))
+        .filter_by(id=account_id)
+    )
+    async with async_db.session() as session:
+        account = await session.scalar(stmt)
+        # If the account does not exist, return an error message
+        if not account:
+            return {"error": f"Account with id {account_id} not found"}, 404
+        is_auditor = await async_is_user_in_role(session, user_id, ["Auditor"])
+
+    # If the user is an auditor or the owner of the account, return account details; otherwise, return an error
+    if is_auditor or int(account.user_id) == int(user_id):
+        return account_schema.dump(account), 200
+    else:
+        return {"error": "Not authorized to view this account"}, 403
+
+
+# Search for transactions based on a description term, with role-based results filtering.
+# http://localhost:8080/accounts/search - POST
+async def transactions_search(request):
+    try:
+        body_data = json.loads(request.body or b"null")
+    except ValueError:
+        body_data = None
+    if not isinstance(body_data, dict) or "query" not in body_data:
+        return {"error": "Search term is required"}, 400
+
+    user_id = request.user_id
+    search_term = f"%{body_data['query']}%"
+    stmt = (
+        select(Transaction)
+        .join(Account)
+        .filter(Transaction.description.ilike(search_term))
+        .options(
+            selectinload(Transaction.account).selectinload(Account.user),
+            selectinload(Transaction.category),
+        )
+    )
+    async with async_db.session() as session:
+        # If the user is an auditor, they see all transactions. Otherwise, they only see transactions from their accounts.
+        if not await async_is_user_in_role(session, user_id, "Auditor"):
+            stmt = stmt.filter(Account.user_id == user_id)
+        search_result = (await session.scalars(stmt)).all()
+    return transactions_schema.dump(search_result), 200
+
+
+# (method, path pattern, handler), path parameters are passed to the handler as integers.
+routes = [
+    ("GET", re.compile(r"^/accounts/$"), get_all_accounts),
+    ("GET", re.compile(r"^/accounts/(?P<account_id>\d+)$"), get_account),
+    ("POST", re.compile(r"^/accounts/search$"), transactions_search),
+]
+
+
+# Find the async handler for a request, or None if the Flask app should serve it.
+def match_route(method, path):
+    for route_method, pattern, handler in routes:
+        match = pattern.match(path)
+        if route_method == method and match:
+            return handler, {key: int(value) for key, value in match.groupdict().items()}
+    return None, None
@@ -3,13 +3,13 @@ from datetime import timedelta
 from flask import Blueprint, request
 from flask_jwt_extended import create_access_token, jwt_required
 from sqlalchemy.exc import IntegrityError
-from psycopg2 import errorcodes
 
-from extensions.extensions import db, bcrypt
+from extensions.extensions import db, bcrypt, shards
 
 from models.user import User, user_schema, users_schema
 
 from utils.auth_utils import role_required
+from utils.purge_utils import delete_owner, needs_background_purge, start_purge
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
@@ -20,11 +20,18 @@ auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 @jwt_required()
 @role_required(["Auditor"])
 def get_all_users():
-    # Query: Select all user records, ordering by the date they were created in descending order
-    stmt = db.select(User).order_by(User.date_created.desc())
-    users = db.session.scalars(stmt)
+    # Every shard serializes the users whose accounts it holds, merged by the date they were created
+    users = [user for dumped in shards.scatter(dump_shard_users) for user in dumped]
+    users.sort(key=lambda user: user["date_created"], reverse=True)
     # Return the users, serialized into JSON
-    return users_schema.dump(users), 200
+    return users, 200
+
+
+# The users of the current shard, serialized with their accounts.
+def dump_shard_users():
+    # Query: Select the shard's user records, ordering by the date they were created in descending order
+    stmt = db.select(User).filter(User.id % shards.count == shards.current()).order_by(User.date_created.desc())
+    return users_schema.dump(db.session.scalars(stmt))
 
 
 # Register a new user to the platform
@@ -53,6 +60,9 @@ def auth_register():
 
     # Handle cases where the user could not be created due to database integrity constraints
     except IntegrityError as err:
+        # Only needed here, so psycopg2 isn't imported at startup when the database is SQLite
+        from psycopg2 import errorcodes
+
         # A not-null constraint was violated, return an error message indicating the missing field
         if err.orig.pgcode == errorcodes.NOT_NULL_VIOLATION:
             return {"error": f"The {err.orig.diag.column_name} is required"}, 400
@@ -86,6 +96,7 @@ def auth_login():
 
 
 # Delete a user profile, accessible only to users with the 'Admin' role
+# Users with many transactions are deleted in the background, returning 202 straight away
 # http://localhost:8080/auth/id - DELETE
 @auth_bp.route("/<int:user_id>", methods=["DELETE"])
 @jwt_required()
@@ -98,8 +109,14 @@ def delete_user(user_id):
     if not user:
         # The user record was not found, return an error message
         return {"error": f"User with id {user_id} not found"}, 404
-    # Delete the found user record from the database and commit the transaction
-    db.session.delete(user)
+    if needs_background_purge(user):
+        start_purge(user)
+        return {
+            "message": f"User '{user.username}', '{user.role}' is being deleted"
+        }, 202
+    # Delete the found user record from the database and commit the transaction,
+    # the database deletes their accounts and transactions with it
+    delete_owner(user)
     db.session.commit()
     # Return a success message indicating the user was deleted
     return {
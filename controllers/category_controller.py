@@ -1,8 +1,9 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 
-from extensions.extensions import db
+from extensions.extensions import db, shards
 from utils.auth_utils import is_user_in_role, role_required
+from utils.stats_utils import amount_stats, merge_sketches, parse_percentiles, stored_sketch
 
 from models.category import Category, category_schema, categories_schema
 
@@ -70,6 +71,25 @@ def get_category(category_id):
         return {"error": f"Category with id {category_id} not found"}, 404
 
 
+# Distribution of the transaction amounts in a category, accessible only by "Auditor".
+# Category id 0 returns the uncategorised transactions.
+# Optional query parameter: percentiles (comma separated, default "50,90,99").
+# http://localhost:8080/categories/id/amount_stats - GET
+@categories_bp.route("/<int:category_id>/amount_stats")
+@jwt_required()
+@role_required(["Auditor"])
+def get_category_amount_stats(category_id):
+    try:
+        percentiles = parse_percentiles(request.args.get("percentiles"))
+    except ValueError:
+        return {"error": "percentiles must be comma separated numbers between 0 and 100"}, 400
+    if category_id != 0 and not db.session.get(Category, category_id):
+        return {"error": f"Category with id {category_id} not found"}, 404
+    # Each shard keeps the statistics of its own transactions in the category
+    sketch = merge_sketches(shards.scatter(stored_sketch, "category", category_id))
+    return {"category_id": category_id, **amount_stats("category", category_id, percentiles, sketch)}, 200
+
+
 # Updates an existing category identified by its ID.
 # Only accessible by Admin users.
 # http://localhost:8080/categories/id - PUT, PATCH
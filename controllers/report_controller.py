@@ -0,0 +1,96 @@
+from datetime import datetime
+
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from extensions.extensions import db
+from utils.auth_utils import is_user_in_role
+from utils.report_jobs import REPORT_ROLES, enqueue_report_job
+
+from models.report_job import ReportJob, report_job_schema, report_jobs_schema
+
+reports_bp = Blueprint("reports", __name__, url_prefix="/reports")
+
+
+# Find a report job owned by the current user.
+def get_user_job(job_id):
+    stmt = db.select(ReportJob).filter_by(id=job_id, user_id=get_jwt_identity())
+    return db.session.scalar(stmt)
+
+
+# Queue a report to be computed in the background, returning the id of the job straight away.
+# Reports: "account_summary" (Auditor only), "search" (requires params.query) and "export".
+# http://localhost:8080/reports - POST
+@reports_bp.route("/", methods=["POST"])
+@jwt_required()
+def create_report():
+    # Load and validate the JSON data from the request
+    body_data = report_job_schema.load(request.get_json())
+    report = body_data.get("report")
+    params = body_data.get("params") or {}
+
+    # Some reports are restricted to specific roles
+    if report in REPORT_ROLES and not is_user_in_role(REPORT_ROLES[report]):
+        return {"error": "Not authorised for this action"}, 403
+    if report == "search" and not params.get("query"):
+        return {"error": "Search term is required"}, 400
+
+    job = ReportJob(report=report, params=params, user_id=get_jwt_identity())
+    enqueue_report_job(job)
+    return report_job_schema.dump(job), 202
+
+
+# List the report jobs of the current user, most recent first.
+# http://localhost:8080/reports - GET
+@reports_bp.route("/")
+@jwt_required()
+def get_all_reports():
+    stmt = (
+        db.select(ReportJob)
+        .filter_by(user_id=get_jwt_identity())
+        .order_by(ReportJob.date_created.desc())
+    )
+    jobs = db.session.scalars(stmt)
+    return report_jobs_schema.dump(jobs), 200
+
+
+# Get the status and progress (0-100) of a report job.
+# http://localhost:8080/reports/id - GET
+@reports_bp.route("/<job_id>")
+@jwt_required()
+def get_report(job_id):
+    job = get_user_job(job_id)
+    if not job:
+        return {"error": f"Report with id {job_id} not found"}, 404
+    return report_job_schema.dump(job), 200
+
+
+# Get the result of a completed report job.
+# http://localhost:8080/reports/id/result - GET
+@reports_bp.route("/<job_id>/result")
+@jwt_required()
+def get_report_result(job_id):
+    job = get_user_job(job_id)
+    if not job:
+        return {"error": f"Report with id {job_id} not found"}, 404
+    if job.status != "completed":
+        return {"error": f"Report is {job.status}", "progress": job.progress}, 409
+    # The result is already stored as JSON, so it is returned without decoding it again
+    return job.result, 200, {"Content-Type": "application/json"}
+
+
+# Cancel a queued or running report job.
+# http://localhost:8080/reports/id - DELETE
+@reports_bp.route("/<job_id>", methods=["DELETE"])
+@jwt_required()
+def cancel_report(job_id):
+    job = get_user_job(job_id)
+    if not job:
+        return {"error": f"Report with id {job_id} not found"}, 404
+    if job.status not in ("queued", "running"):
+        return {"error": f"Report is already {job.status}"}, 409
+    # The worker checks the status between chunks, and stops once it sees the cancellation
+    job.status = "cancelled"
+    job.date_completed = datetime.utcnow()
+    db.session.commit()
+    return report_job_schema.dump(job), 200
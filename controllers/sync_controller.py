@@ -0,0 +1,131 @@
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from extensions.extensions import db, shards
+from utils.auth_utils import is_user_in_role
+
+from models.account import Account, AccountSchema
+from models.transaction import Transaction, TransactionSchema
+from models.category import Category, categories_schema
+from models.change_log import Tombstone, change_watermark
+
+sync_bp = Blueprint("sync", __name__, url_prefix="/sync")
+
+
+# Synced transactions name their account instead of embedding it
+class SyncTransactionSchema(TransactionSchema):
+    class Meta(TransactionSchema.Meta):
+        fields = ("id", "account_id", "amount", "description", "transaction_date", "category")
+
+
+# Flat schemas, synced accounts don't embed their transactions
+sync_accounts_schema = AccountSchema(many=True, exclude=["transactions", "user"])
+sync_transactions_schema = SyncTransactionSchema(many=True)
+
+MAX_LIMIT = 1000
+
+
+# Return the accounts, transactions and categories created, updated or deleted since a cursor.
+# Start with cursor=0 (everything), then pass the returned cursor on the next sync.
+# While has_more is true, sync again straight away to fetch the rest.
+# Query parameters: cursor (default 0) and limit (default and max 1000).
+# With several shards, an Auditor's cursor holds one position per shard, e.g. "12.40.33".
+# http://localhost:8080/sync - GET
+@sync_bp.route("/")
+@jwt_required()
+def sync():
+    # Auditors sync every account, other users only their own
+    all_accounts = is_user_in_role(["Auditor"])
+    sharded = all_accounts and shards.count > 1
+    try:
+        cursors = [int(part) for part in request.args.get("cursor", "0").split(".")]
+        limit = min(int(request.args.get("limit", MAX_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        return {"error": "cursor and limit must be integers"}, 400
+    if sharded and cursors == [0]:
+        cursors = [0] * shards.count
+    if len(cursors) != (shards.count if sharded else 1):
+        return {"error": f"cursor must have {shards.count if sharded else 1} part(s)"}, 400
+    if min(cursors) < 0 or limit < 1:
+        return {"error": "cursor must be 0 or more, and limit at least 1"}, 400
+
+    if not sharded:
+        return changes_since(cursors[0], limit, get_jwt_identity(), all_accounts), 200
+
+    # Each shard keeps its own sequence numbers, so sync each from its own cursor and share out the limit.
+    # Categories are copied to every shard, only shard 0's are sent.
+    pages = shards.scatter(shard_changes, cursors, max(1, limit // shards.count))
+    result = {
+        "cursor": ".".join(str(page["cursor"]) for page in pages),
+        "has_more": any(page["has_more"] for page in pages),
+    }
+    for kind in ("accounts", "transactions", "categories"):
+        result[kind] = [row for page in pages for row in page[kind]]
+    result["deleted"] = {
+        kind: [entity_id for page in pages for entity_id in page["deleted"][kind]]
+        for kind in ("accounts", "transactions", "categories")
+    }
+    return result, 200
+
+
+# An Auditor's changes on the current shard
+def shard_changes(cursors, limit):
+    index = shards.current()
+    return changes_since(cursors[index], limit, None, True, categories=index == 0)
+
+
+# The changes of the current shard after the cursor, at most `limit` of them
+def changes_since(cursor, limit, user_id, all_accounts, categories=True):
+    # Changes past the watermark may have a transaction with a lower number still to commit, leave them for later
+    watermark = change_watermark(db.session.connection())
+    accounts = db.select(Account).filter(Account.change_seq > cursor, Account.change_seq <= watermark)
+    transactions = db.select(Transaction).filter(Transaction.change_seq > cursor, Transaction.change_seq <= watermark)
+    tombstones = db.select(Tombstone).filter(Tombstone.change_seq > cursor, Tombstone.change_seq <= watermark)
+    if not all_accounts:
+        accounts = accounts.filter(Account.user_id == user_id)
+        transactions = transactions.join(Account).filter(Account.user_id == user_id)
+        tombstones = tombstones.filter(
+            db.or_(Tombstone.user_id == user_id, Tombstone.entity == "categories")
+        )
+    if not categories:
+        tombstones = tombstones.filter(Tombstone.entity != "categories")
+    kinds = [
+        ("accounts", Account, accounts),
+        ("transactions", Transaction, transactions),
+        ("deleted", Tombstone, tombstones),
+    ]
+    if categories:
+        category_changes = db.select(Category).filter(Category.change_seq > cursor, Category.change_seq <= watermark)
+        kinds.append(("categories", Category, category_changes))
+
+    # Take the first `limit` changes of each kind in sequence order, then keep the first `limit` overall.
+    # Every change has its own sequence number, so the page ends cleanly at the last one returned.
+    changes = []
+    for kind, model, stmt in kinds:
+        rows = db.session.scalars(stmt.order_by(model.change_seq).limit(limit + 1))
+        changes.extend((row.change_seq, kind, row) for row in rows)
+    changes.sort(key=lambda change: change[0])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    if changes:
+        next_cursor = changes[-1][0]
+    else:
+        # Nothing new, so skip ahead to the watermark
+        next_cursor = max(cursor, watermark)
+
+    grouped = {"accounts": [], "transactions": [], "categories": [], "deleted": []}
+    for _, kind, row in changes:
+        grouped[kind].append(row)
+    deleted = {"accounts": [], "transactions": [], "categories": []}
+    for tombstone in grouped["deleted"]:
+        deleted[tombstone.entity].append(tombstone.entity_id)
+
+    return {
+        "cursor": next_cursor,
+        "has_more": has_more,
+        "accounts": sync_accounts_schema.dump(grouped["accounts"]),
+        "transactions": sync_transactions_schema.dump(grouped["transactions"]),
+        "categories": categories_schema.dump(grouped["categories"]),
+        "deleted": deleted,
+    }
@@ -1,8 +1,10 @@
-from flask import Blueprint, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from decimal import Decimal
 
-from extensions.extensions import db
-from utils.auth_utils import role_required, is_user_in_role
+from flask import Blueprint, Response, request
+from flask_jwt_extended import jwt_required
+
+from extensions.extensions import db, change_feed, group_commit
+from utils.auth_utils import role_required, authorized_account
 
 from models.account import Account
 from models.transaction import Transaction, transaction_schema
@@ -14,44 +16,47 @@ transactions_bp = Blueprint(
 
 
 # Adds a new transaction to a specified account. This operation checks account ownership and adjusts the account balance.
+# With GROUP_COMMIT enabled, concurrent transactions are committed together (see extensions/group_commit.py).
 # http://localhost:8080/accounts/id/transactions - POST
 @transactions_bp.route("/", methods=["POST"])
 @jwt_required()
 def create_transaction(account_id):
-    # Obtain the current user's ID from the JWT payload
-    user_id = get_jwt_identity()
     body_data = request.get_json()
     # Retrieve the specified account to ensure it exists and determine if the user is authorized to add a transaction
-    stmt = db.select(Account).filter_by(id=account_id)
-    account = db.session.scalar(stmt)
+    account, allowed = authorized_account(account_id, ["Admin"])
 
     # If no account matches the provided ID, return an error
     if not account:
         return {"error": f"Account with id {account_id} not found"}, 404
 
     # Allow adding transactions to an account if the user is either an admin or the account owner
-    if is_user_in_role(["Admin"]) or int(account.user_id) == int(user_id):
-        # Create a new Transaction object and associate it with the account
-        transaction = Transaction(
-            amount=body_data.get("amount"),
-            description=body_data.get("description"),
-            account_id=account_id,
+    if allowed:
+        return group_commit.submit(
+            record_transaction, account_id, body_data.get("amount"), body_data.get("description")
         )
-        # Add the transaction to the session and adjust the account's balance accordingly
-        db.session.add(transaction)
-
-        # Update the account balance
-        account.balance += body_data.get("amount")
-        db.session.add(account)
-
-        db.session.commit()
-        return transaction_schema.dump(transaction), 201
 
     # If the user does not own the account and is not an admin, deny access
     else:
         return {"error": "Unauthorized access"}, 403
 
 
+# Adds a transaction and adjusts the account balance, returning a function that builds the response.
+# May run on the group commit thread, so it only takes plain values from the request.
+def record_transaction(account_id, amount, description):
+    # Lock the account until the transaction commits, so concurrent posts can't overwrite each other's balance
+    account = db.session.get(Account, account_id, with_for_update=True, populate_existing=True)
+    if not account:
+        # The account was deleted after the request checked it
+        return lambda: ({"error": f"Account with id {account_id} not found"}, 404)
+    # Create a new Transaction object and associate it with the account
+    transaction = Transaction(amount=amount, description=description, account_id=account_id)
+    # Add the transaction to the session and adjust the account's balance accordingly
+    db.session.add(transaction)
+    # Amounts from request JSON may be floats, which can't be added to the Decimal balance
+    account.balance += Decimal(str(amount))
+    return lambda: (transaction_schema.dump(transaction), 201)
+
+
 # Updates an existing transaction, restricted to admin users. This includes adjusting the account balance if the transaction amount changes.
 # http://localhost:8080/accounts/id/transactions/id - PUT, PATCH
 @transactions_bp.route("/<int:transaction_id>", methods=["PUT", "PATCH"])
@@ -113,3 +118,35 @@ def delete_transaction(account_id, transaction_id):
         return {
             "error": f"Transaction with id {transaction_id}, on account {account_id} not found"
         }, 404
+
+
+# Stream the created, updated and deleted transactions of an account as server-sent events,
+# so clients don't need to poll the account. Accessible to the account owner and auditors.
+# http://localhost:8080/accounts/id/transactions/stream - GET
+@transactions_bp.route("/stream")
+@jwt_required()
+def stream_transactions(account_id):
+    account, allowed = authorized_account(account_id, ["Auditor"])
+    # If no account matches the provided ID, return an error
+    if not account:
+        return {"error": f"Account with id {account_id} not found"}, 404
+    if not allowed:
+        return {"error": "Not authorized to view this account"}, 403
+    return event_stream(account_id)
+
+
+# The streaming response shared by the account and auditor change feeds.
+def event_stream(account_id=None):
+    # Each stream holds a request thread until the client disconnects, so keep threads free for other requests
+    if not change_feed.acquire_stream():
+        return {"error": "Too many open streams, try again later"}, 503, {"Retry-After": "30"}
+    # Release the database connection, the stream can stay open for a long time
+    db.session.remove()
+    response = Response(
+        change_feed.stream(account_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Called once the response is closed, even if the client left before the stream started
+    response.call_on_close(change_feed.release_stream)
+    return response
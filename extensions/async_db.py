@@ -0,0 +1,47 @@
+from sqlalchemy.engine import make_url
+
+# Async drivers used in place of the sync ones from DATABASE_URL
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+# Convert a sync database URL, e.g. postgresql+psycopg2://..., into its async equivalent.
+def async_database_url(database_url):
+    url = make_url(database_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}' databases")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class AsyncDatabase:
+    def __init__(self):
+        self.engine = None
+        self.session = None
+
+    def init_app(self, app):
+        # Only the ASGI app has an async engine, so only it pays for importing asyncio
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+        from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+        url = async_database_url(app.config["SQLALCHEMY_DATABASE_URI"])
+        options = {"pool_pre_ping": True}
+        # aiosqlite defaults to opening a new connection (and thread) per session,
+        # so file databases get a real pool too. In-memory databases keep their default.
+        if url.get_backend_name() != "sqlite" or url.database not in (None, "", ":memory:"):
+            options["poolclass"] = AsyncAdaptedQueuePool
+            options["pool_size"] = int(app.config.get("ASYNC_POOL_SIZE", 20))
+        self.engine = create_async_engine(url, **options)
+        # expire_on_commit is off as objects are serialised after the session closes
+        self.session = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+
+    # Drop the connections inherited from the parent process, without closing them for the parent
+    def reset_after_fork(self):
+        if self.engine is not None:
+            self.engine.sync_engine.dispose(close=False)
+
+    async def dispose(self):
+        if self.engine is not None:
+            await self.engine.dispose()
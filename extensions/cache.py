@@ -0,0 +1,314 @@
+import base64
+import functools
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, make_response, request
+from sqlalchemy import event, inspect
+
+from extensions.encoding import negotiate
+
+
+# In-process backend, entries expire after their TTL and the least recently used entry is evicted when full.
+class MemoryCache:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # How many times each tag was invalidated
+        self.tag_generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, tags, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            # Mark the entry as the most recently used
+            self.entries.move_to_end(key)
+            return value
+
+    def generations(self, tags):
+        with self.lock:
+            return [self.tag_generations.get(tag, 0) for tag in tags]
+
+    # With generations (read before computing the value), the entry is only stored if none of its tags
+    # were invalidated since, otherwise it may hold data from before the write.
+    def set(self, key, value, ttl, tags=(), generations=None):
+        with self.lock:
+            if generations is not None and [self.tag_generations.get(tag, 0) for tag in tags] != list(generations):
+                return
+            self.entries[key] = (value, tuple(tags), time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, tags):
+        tags = set(tags)
+        with self.lock:
+            for tag in tags:
+                self.tag_generations[tag] = self.tag_generations.get(tag, 0) + 1
+            for key in [key for key, entry in self.entries.items() if tags & set(entry[1])]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # A forked process inherits the entries, but a lock held by another thread would never be released
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
+
+
+# Local stand-in for a shared cache server such as Redis or memcached.
+# Entries live in a SQLite file, so every worker process on the machine shares them,
+# and values go through JSON like they would over the network.
+class SQLiteCache:
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        with self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_tags ("
+                "tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_generations ("
+                "tag TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+            )
+
+    # One connection per thread, sqlite3 connections can't be shared between threads.
+    def connect(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self.connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND expires_at >= ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def generations(self, tags, conn=None):
+        tags = list(tags)
+        if not tags:
+            return []
+        placeholders = ", ".join("?" for _ in tags)
+        rows = (conn or self.connect()).execute(
+            f"SELECT tag, generation FROM cache_generations WHERE tag IN ({placeholders})", tags
+        )
+        stored = dict(rows.fetchall())
+        return [stored.get(tag, 0) for tag in tags]
+
+    def set(self, key, value, ttl, tags=(), generations=None):
+        conn = self.connect()
+        now = time.time()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Checked in the same transaction, so no invalidation can come in between
+            if generations is not None and self.generations(tags, conn) != list(generations):
+                return
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO cache_tags VALUES (?, ?)", [(tag, key) for tag in tags]
+            )
+            # Drop expired entries, then the least recently used ones above the limit
+            conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (now,))
+            conn.execute(
+                "DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_entries "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.execute("DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache_entries)")
+
+    def invalidate(self, tags):
+        tags = list(tags)
+        if not tags:
+            return
+        conn = self.connect()
+        placeholders = ", ".join("?" for _ in tags)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                f"DELETE FROM cache_entries WHERE key IN "
+                f"(SELECT key FROM cache_tags WHERE tag IN ({placeholders}))",
+                tags,
+            )
+            conn.execute(f"DELETE FROM cache_tags WHERE tag IN ({placeholders})", tags)
+            conn.executemany(
+                "INSERT INTO cache_generations VALUES (?, 1) "
+                "ON CONFLICT (tag) DO UPDATE SET generation = generation + 1",
+                [(tag,) for tag in tags],
+            )
+
+    # SQLite connections must not be shared with the parent process
+    def reset_after_fork(self):
+        self.local = threading.local()
+
+    def clear(self):
+        conn = self.connect()
+        with conn:
+            conn.execute("DELETE FROM cache_entries")
+            conn.execute("DELETE FROM cache_tags")
+
+
+# Work out which cached reports a flushed Account or Transaction affects.
+def tags_for(obj, deleted=False):
+    tablename = getattr(obj, "__tablename__", None)
+    if tablename == "accounts":
+        tags = {"total_balance", "account_summary"}
+        if deleted:
+            tags.add(f"transaction_ranks:{obj.id}")
+        return tags
+    if tablename == "transactions":
+        tags = {"account_summary"}
+        # A transaction moved between accounts changes the ranking of both
+        history = inspect(obj).attrs.account_id.history
+        for account_id in {obj.account_id, *history.deleted}:
+            if account_id is not None:
+                tags.add(f"transaction_ranks:{account_id}")
+        return tags
+    return set()
+
+
+class ResponseCache:
+    def __init__(self):
+        self.backend = None
+        self.default_ttl = 60
+        self.auto = False
+        self.sqlite_path = None
+        self.max_entries = 1024
+
+    def init_app(self, app):
+        app.config.setdefault("CACHE_BACKEND", "auto")
+        app.config.setdefault("CACHE_DEFAULT_TTL", 60)
+        app.config.setdefault("CACHE_MAX_ENTRIES", 1024)
+        app.config.setdefault("CACHE_SQLITE_PATH", "response_cache.sqlite3")
+
+        backend = app.config["CACHE_BACKEND"]
+        self.max_entries = int(app.config["CACHE_MAX_ENTRIES"])
+        self.sqlite_path = app.config["CACHE_SQLITE_PATH"]
+        # "auto" is the in-process cache, until reset_after_fork finds there are several worker processes
+        self.auto = backend == "auto"
+        if backend in ("memory", "auto"):
+            self.backend = MemoryCache(self.max_entries)
+        elif backend == "sqlite":
+            self.backend = SQLiteCache(self.sqlite_path, self.max_entries)
+        elif backend == "none":
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND '{backend}'")
+        self.default_ttl = int(app.config["CACHE_DEFAULT_TTL"])
+
+        from extensions.extensions import db
+
+        # The session is shared by every app, listen once however many apps are set up (e.g. in the tests)
+        if not event.contains(db.session, "after_flush", self.after_flush):
+            event.listen(db.session, "after_flush", self.after_flush)
+            event.listen(db.session, "after_commit", self.after_commit)
+
+    # Invalidate as soon as the write reaches the database, and remember the tags so they can be
+    # invalidated again on commit, in case another request re-cached the old values in between.
+    def after_flush(self, session, flush_context):
+        tags = set()
+        for obj in session.new:
+            tags |= tags_for(obj)
+        for obj in session.dirty:
+            if session.is_modified(obj):
+                tags |= tags_for(obj)
+        for obj in session.deleted:
+            tags |= tags_for(obj, deleted=True)
+        if tags:
+            self.invalidate_session(session, tags)
+
+    # Invalidate now and again when the session commits, for writes the flush doesn't see such as database cascades
+    def invalidate_session(self, session, tags):
+        session.info.setdefault("cache_tags", set()).update(tags)
+        self.invalidate(tags)
+
+    def after_commit(self, session):
+        tags = session.info.pop("cache_tags", None)
+        if tags:
+            self.invalidate(tags)
+
+    def invalidate(self, tags):
+        if self.backend is not None:
+            self.backend.invalidate(tags)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    # With several worker processes, a write in one must invalidate the entries of all of them,
+    # so the "auto" backend moves to the SQLite file they share.
+    def reset_after_fork(self, processes=1):
+        if self.auto and processes > 1:
+            self.backend = SQLiteCache(self.sqlite_path, self.max_entries)
+        elif self.backend is not None:
+            self.backend.reset_after_fork()
+
+    # Cache the successful responses of a view. Tags name the data the response depends on,
+    # and may use the view arguments, e.g. "transaction_ranks:{account_id}".
+    def cached(self, tags, ttl=None):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if self.backend is None:
+                    return fn(*args, **kwargs)
+                entry_tags = [tag.format(**kwargs) for tag in tags]
+                # Each response format is cached separately
+                key = f"{request.endpoint}:{negotiate(request.accept_mimetypes)}:{request.full_path}"
+                entry = self.backend.get(key)
+                if entry is not None:
+                    response = current_app.response_class(
+                        base64.b64decode(entry["body"]), status=entry["status"], mimetype=entry["mimetype"]
+                    )
+                    response.headers["X-Cache"] = "HIT"
+                    return response
+
+                # A write committed while the view runs invalidates before the entry is stored,
+                # so only store it if none of its tags were invalidated since it started
+                generations = self.backend.generations(entry_tags)
+                response = make_response(fn(*args, **kwargs))
+                if response.status_code == 200:
+                    self.backend.set(
+                        key,
+                        {
+                            # Base64, as MessagePack bodies are binary and the SQLite backend stores JSON
+                            "body": base64.b64encode(response.get_data()).decode("ascii"),
+                            "status": response.status_code,
+                            "mimetype": response.mimetype,
+                        },
+                        ttl or self.default_ttl,
+                        entry_tags,
+                        generations,
+                    )
+                response.headers["X-Cache"] = "MISS"
+                return response
+
+            return wrapper
+
+        return decorator
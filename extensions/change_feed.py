@@ -0,0 +1,215 @@
+import json
+import queue
+import select
+import threading
+from decimal import Decimal
+
+from sqlalchemy import event, text
+
+CHANNEL = "transaction_changes"
+
+
+# Describe a flushed Transaction as a change event, or None for other objects.
+def transaction_event(obj, kind):
+    if getattr(obj, "__tablename__", None) != "transactions":
+        return None
+    data = {"id": obj.id, "account_id": obj.account_id}
+    if kind != "deleted":
+        data.update(
+            # Amounts set from request JSON may still be ints or floats, format them like the API does
+            amount=None if obj.amount is None else str(Decimal(str(obj.amount)).quantize(Decimal("0.01"))),
+            description=obj.description,
+            category_id=obj.category_id,
+            transaction_date=obj.transaction_date.isoformat() if obj.transaction_date else None,
+        )
+    return {"event": f"transaction.{kind}", "data": data}
+
+
+# Sent when an account is deleted, its transactions are deleted with it without events of their own.
+def account_deleted_event(account_id):
+    return {"event": "account.deleted", "data": {"account_id": account_id}}
+
+
+# Hands events to every subscriber in this process. Each subscriber has its own queue,
+# optionally filtered to a single account.
+class Broker:
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self, account_id=None):
+        subscriber = (queue.Queue(self.max_queue), account_id)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, change):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for events, account_id in subscribers:
+            if account_id is None or account_id == change["data"]["account_id"]:
+                try:
+                    events.put_nowait(change)
+                except queue.Full:
+                    # A client that stopped reading shouldn't hold up everyone else
+                    pass
+
+
+class ChangeFeed:
+    def __init__(self):
+        self.app = None
+        self.backend = None
+        self.broker = Broker()
+        self.listener = None
+        self.lock = threading.Lock()
+        self.max_streams = 2
+        self.open_streams = 0
+
+    def init_app(self, app):
+        from extensions.extensions import db
+
+        app.config.setdefault("CHANGE_FEED_BACKEND", "auto")
+        app.config.setdefault("MAX_STREAMS", 2)
+        self.max_streams = int(app.config["MAX_STREAMS"])
+        backend = app.config["CHANGE_FEED_BACKEND"]
+        if backend == "auto":
+            # LISTEN/NOTIFY reaches every worker process, the in-process fallback only its own
+            is_postgres = (app.config.get("SQLALCHEMY_DATABASE_URI") or "").startswith("postgres")
+            backend = "postgres" if is_postgres else "memory"
+        if backend not in ("postgres", "memory"):
+            raise ValueError(f"Unknown CHANGE_FEED_BACKEND '{backend}'")
+        self.app = app
+        self.backend = backend
+
+        # The session is shared by every app, listen once however many apps are set up (e.g. in the tests)
+        if not event.contains(db.session, "after_flush", self.after_flush):
+            event.listen(db.session, "after_flush", self.after_flush)
+            event.listen(db.session, "after_commit", self.after_commit)
+            event.listen(db.session, "after_rollback", self.after_rollback)
+
+    def after_flush(self, session, flush_context):
+        changes = []
+        for objects, kind in ((session.new, "created"), (session.dirty, "updated"), (session.deleted, "deleted")):
+            for obj in objects:
+                if kind == "updated" and not session.is_modified(obj):
+                    continue
+                if kind == "deleted" and getattr(obj, "__tablename__", None) == "accounts":
+                    changes.append(account_deleted_event(obj.id))
+                    continue
+                change = transaction_event(obj, kind)
+                if change:
+                    changes.append(change)
+        self.queue(session, changes)
+
+    # Send changes once the session commits
+    def queue(self, session, changes):
+        if not changes:
+            return
+        if self.backend == "postgres":
+            # NOTIFY is transactional, PostgreSQL only delivers it if the transaction commits
+            connection = session.connection()
+            for change in changes:
+                connection.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": CHANNEL, "payload": json.dumps(change)},
+                )
+        else:
+            session.info.setdefault("feed_changes", []).extend(changes)
+
+    def after_commit(self, session):
+        for change in session.info.pop("feed_changes", []):
+            self.broker.publish(change)
+
+    def after_rollback(self, session):
+        session.info.pop("feed_changes", None)
+
+    # Subscribe to the changes of one account, or of every account when account_id is None.
+    def subscribe(self, account_id=None):
+        if self.backend == "postgres":
+            self.start_listener()
+        return self.broker.subscribe(account_id)
+
+    def unsubscribe(self, subscriber):
+        self.broker.unsubscribe(subscriber)
+
+    # Each open stream holds a request thread of its worker for as long as the client stays connected.
+    # Take one of the MAX_STREAMS stream slots of this process, or return False when they are all taken.
+    def acquire_stream(self):
+        with self.lock:
+            if self.open_streams >= self.max_streams:
+                return False
+            self.open_streams += 1
+            return True
+
+    def release_stream(self):
+        with self.lock:
+            self.open_streams -= 1
+
+    # Server-sent events for the changes of one account, or of every account when account_id is None.
+    # A comment line is sent when nothing has happened for a while, so proxies keep the connection open.
+    def stream(self, account_id=None, keepalive=15):
+        subscriber = self.subscribe(account_id)
+        events = subscriber[0]
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    change = events.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {change['event']}\ndata: {json.dumps(change['data'])}\n\n"
+        finally:
+            # Runs when the client disconnects and the server closes the generator
+            self.unsubscribe(subscriber)
+
+    # One LISTEN connection per shard and process, started when the first client subscribes.
+    def start_listener(self):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self.listen, name="change-feed", daemon=True)
+                self.listener.start()
+
+    def listen(self):
+        from extensions.extensions import shards
+
+        while True:
+            dbapi_connections = []
+            try:
+                # Changes are notified on the shard that made them, so listen on all of them
+                for index in range(shards.count):
+                    with shards.on(index):
+                        # Take the connection out of the pool, it stays busy listening for as long as the process runs
+                        connection = shards.engine(index).raw_connection()
+                        connection.detach()
+                    dbapi_connection = connection.dbapi_connection
+                    dbapi_connections.append(dbapi_connection)
+                    dbapi_connection.autocommit = True
+                    dbapi_connection.cursor().execute(f"LISTEN {CHANNEL}")
+                while True:
+                    ready, _, _ = select.select(dbapi_connections, [], [], 30)
+                    for dbapi_connection in ready:
+                        dbapi_connection.poll()
+                        while dbapi_connection.notifies:
+                            notification = dbapi_connection.notifies.pop(0)
+                            self.broker.publish(json.loads(notification.payload))
+            except Exception:
+                self.app.logger.exception("Change feed listener failed, reconnecting")
+                for dbapi_connection in dbapi_connections:
+                    try:
+                        dbapi_connection.close()
+                    except Exception:
+                        pass
+                threading.Event().wait(1)
+
+    # The listener thread doesn't survive a fork, so a forked worker starts its own
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
+        self.listener = None
+        self.open_streams = 0
+        self.broker = Broker(self.broker.max_queue)
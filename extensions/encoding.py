@@ -0,0 +1,107 @@
+import gzip
+
+import msgpack
+import zstandard
+from flask import has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+JSON = "application/json"
+# A list of objects as one array per field, so each key is sent once instead of once per row
+COLUMNAR_JSON = "application/vnd.columnar+json"
+MSGPACK = "application/msgpack"
+# JSON comes first, so clients accepting anything keep getting it
+FORMATS = (JSON, COLUMNAR_JSON, MSGPACK)
+
+COMPRESSORS = {
+    "zstd": lambda body: zstandard.compress(body, 3),
+    "gzip": lambda body: gzip.compress(body, compresslevel=6),
+}
+
+
+# [{"id": 1, "amount": "-5.00"}, {"id": 2, "amount": "12.50"}] becomes
+# {"count": 2, "columns": {"id": [1, 2], "amount": ["-5.00", "12.50"]}}.
+# Lists of objects inside the rows, like an account's transactions, become columns too.
+# Anything other than a list of objects is returned unchanged.
+def to_columns(data):
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        return data
+    fields = {}
+    for row in data:
+        fields.update(dict.fromkeys(row))
+    return {
+        "count": len(data),
+        "columns": {field: [to_columns(row.get(field)) for row in data] for field in fields},
+    }
+
+
+# Flask's JSON provider, answering in the format the request's Accept header prefers.
+# Every view response built from a dict or list, or with jsonify, goes through it.
+class NegotiatingJSONProvider(DefaultJSONProvider):
+    def response(self, *args, **kwargs):
+        if not has_request_context():
+            return super().response(*args, **kwargs)
+        mimetype = negotiate(request.accept_mimetypes)
+        if mimetype == JSON:
+            return super().response(*args, **kwargs)
+        data = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(data, mimetype), mimetype=mimetype)
+
+    def encode(self, data, mimetype=JSON):
+        if mimetype == MSGPACK:
+            # Values JSON can't hold, like Decimal, are converted the same way as for JSON
+            return msgpack.packb(data, default=self.default)
+        if mimetype == COLUMNAR_JSON:
+            data = to_columns(data)
+        return f"{self.dumps(data, separators=(',', ':'))}\n".encode()
+
+
+def negotiate(accept):
+    return accept.best_match(FORMATS, default=JSON)
+
+
+# Encodes responses as JSON, columnar JSON or MessagePack by content negotiation, and compresses
+# those above COMPRESS_MIN_SIZE bytes with the first of COMPRESS_ALGORITHMS the client accepts.
+class ResponseEncoder:
+    def __init__(self):
+        self.min_size = 1024
+        self.algorithms = ("zstd", "gzip")
+
+    def init_app(self, app):
+        app.config.setdefault("COMPRESS_MIN_SIZE", 1024)
+        app.config.setdefault("COMPRESS_ALGORITHMS", ["zstd", "gzip"])
+        self.min_size = int(app.config["COMPRESS_MIN_SIZE"])
+        self.algorithms = tuple(name for name in app.config["COMPRESS_ALGORITHMS"] if name in COMPRESSORS)
+
+        provider = NegotiatingJSONProvider(app)
+        provider.sort_keys = app.json.sort_keys
+        provider.compact = app.json.compact
+        app.json = provider
+        app.after_request(self.compress_response)
+
+    # The format and body of data for a raw Accept header, for responses built outside Flask's views
+    def encode(self, app, data, accept_header):
+        mimetype = negotiate(parse_accept_header(accept_header, MIMEAccept))
+        return mimetype, app.json.encode(data, mimetype)
+
+    # Compress a body for a raw Accept-Encoding header, returning the body and its encoding (or None)
+    def compress(self, body, accept_encoding):
+        if not self.algorithms or len(body) < self.min_size:
+            return body, None
+        algorithm = parse_accept_header(accept_encoding).best_match(self.algorithms)
+        if algorithm is None:
+            return body, None
+        return COMPRESSORS[algorithm](body), algorithm
+
+    def compress_response(self, response):
+        if response.mimetype in FORMATS:
+            response.vary.add("Accept")
+        if not response.direct_passthrough and not response.is_streamed:
+            response.vary.add("Accept-Encoding")
+            if "Content-Encoding" not in response.headers and response.status_code not in (204, 304):
+                body, encoding = self.compress(response.get_data(), request.headers.get("Accept-Encoding"))
+                if encoding:
+                    response.set_data(body)
+                    response.headers["Content-Encoding"] = encoding
+        return response
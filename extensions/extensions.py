@@ -1,9 +1,37 @@
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
-from flask_marshmallow import Marshmallow
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from extensions.async_db import AsyncDatabase
+from extensions.cache import ResponseCache
+from extensions.change_feed import ChangeFeed
+from extensions.encoding import ResponseEncoder
+from extensions.group_commit import GroupCommit
+from extensions.profiler import RequestProfiler
+from extensions.job_runner import JobRunner
+from extensions.shards import ShardSession, Shards
+from extensions.stats_merger import StatsMerger
 
-db = SQLAlchemy()
-ma = Marshmallow()
+db = SQLAlchemy(session_options={"class_": ShardSession})
 bcrypt = Bcrypt()
-jwt = JWTManager()
\ No newline at end of file
+jwt = JWTManager()
+cache = ResponseCache()
+async_db = AsyncDatabase()
+jobs = JobRunner()
+change_feed = ChangeFeed()
+group_commit = GroupCommit()
+profiler = RequestProfiler()
+shards = Shards()
+encoder = ResponseEncoder()
+stats_merger = StatsMerger()
+
+
+# SQLite only enforces foreign keys, and so their ON DELETE CASCADE, when each connection asks for it
+@event.listens_for(Engine, "connect")
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+# Commits concurrent writes together. Requests hand their write to a committer thread, which gathers
+# every write that arrives within a few milliseconds (or up to a batch size) and commits them in one
+# database transaction, so many writes share one fsync. Each request waits until its write is
+# committed, so a response still means the write is durable.
+#
+# A write is a function that adds its changes to the session and returns a function building the
+# response, which is called once the batch is flushed and before it commits.
+class GroupCommit:
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.window = 0.005
+        self.max_batch = 100
+        self.queue = queue.Queue()
+        self.committer = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("GROUP_COMMIT", False)
+        app.config.setdefault("GROUP_COMMIT_WINDOW_MS", 5)
+        app.config.setdefault("GROUP_COMMIT_MAX_BATCH", 100)
+        self.app = app
+        self.enabled = bool(app.config["GROUP_COMMIT"])
+        self.window = float(app.config["GROUP_COMMIT_WINDOW_MS"]) / 1000
+        self.max_batch = int(app.config["GROUP_COMMIT_MAX_BATCH"])
+
+    # Run a write and return its response once committed.
+    # Anything the request itself added to the session must be committed before this is called.
+    def submit(self, fn, *args):
+        from extensions.extensions import db, shards
+
+        if not self.enabled:
+            # Commit straight away in the request's own session
+            return self.commit_batch([(fn, args, None)])[0]
+        # Give the request's connection back to the pool while it waits, the committer needs one too
+        shard = shards.current()
+        db.session.close()
+        self.start_committer()
+        future = Future()
+        self.queue.put((shard, (fn, args, future)))
+        return future.result()
+
+    # One committer thread per process, started by the first write.
+    def start_committer(self):
+        with self.lock:
+            if self.committer is None or not self.committer.is_alive():
+                self.committer = threading.Thread(target=self.run, name="group-commit", daemon=True)
+                self.committer.start()
+
+    def run(self):
+        from extensions.extensions import shards
+
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Writes to different shards go in different transactions
+            by_shard = {}
+            for shard, item in batch:
+                by_shard.setdefault(shard, []).append(item)
+            for shard, items in by_shard.items():
+                try:
+                    with shards.on(shard):
+                        self.commit_batch(items)
+                except Exception as err:
+                    # Never leave a request waiting, even if something outside the writes failed
+                    for _, _, future in items:
+                        if not future.done():
+                            future.set_exception(err)
+
+    # Commit the writes in one transaction, returning their responses in order.
+    # If any write fails before the commit, retry them one at a time, so only the failing write gets the error.
+    # If the commit itself fails, the whole batch fails: the commit may have reached the database before
+    # the error (e.g. the connection dropped while committing), and retrying would post every write twice.
+    def commit_batch(self, batch):
+        from extensions.extensions import db
+
+        try:
+            respond = [fn(*args) for fn, args, _ in batch]
+            db.session.flush()
+            responses = [fn() for fn in respond]
+        except Exception as err:
+            db.session.rollback()
+            if len(batch) > 1:
+                return [self.commit_batch([item])[0] for item in batch]
+            return self.fail(batch, err)
+        try:
+            db.session.commit()
+        except Exception as err:
+            # The transaction is over whatever happened to it, close rather than roll back
+            db.session.close()
+            return self.fail(batch, err)
+        for (_, _, future), response in zip(batch, responses):
+            if future is not None:
+                future.set_result(response)
+        return responses
+
+    # Hand the error to every write of the batch, or raise it for a write committed in its own request
+    def fail(self, batch, err):
+        if batch[0][2] is None:
+            raise err
+        for _, _, future in batch:
+            future.set_exception(err)
+        return [None] * len(batch)
+
+    # The committer thread doesn't survive a fork, so a forked worker starts its own
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.committer = None
@@ -0,0 +1,109 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Runs background jobs on a local pool of worker threads, no external broker is needed.
+# Each job runs inside its own app context, so it gets its own database session,
+# bound to the shard of the session that submitted it.
+# Jobs only live in the process that submitted them, so tasks registered with periodic() run on
+# every shard each JOB_SWEEP_INTERVAL seconds to find and restart the jobs of processes that stopped.
+class JobRunner:
+    def __init__(self):
+        self.app = None
+        self.executor = None
+        self.lock = threading.Lock()
+        # (shard, fn, args) of the jobs submitted in this process and not finished yet
+        self.pending = {}
+        self.tasks = []
+        self.sweeper = None
+
+    def init_app(self, app):
+        app.config.setdefault("JOB_WORKERS", 2)
+        app.config.setdefault("JOB_SWEEP_INTERVAL", 30)
+        self.app = app
+        # Started by the first request, so a forked worker starts its own
+        app.before_request(self.start_sweeper)
+
+    # The pool is created on first use, so worker processes forked from a preloaded app each get their own threads.
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=int(self.app.config["JOB_WORKERS"]), thread_name_prefix="job"
+                )
+            return self.executor
+
+    def submit(self, fn, *args):
+        from extensions.extensions import shards
+
+        shard = shards.current()
+        future = self.get_executor().submit(self.run, shard, fn, *args)
+        with self.lock:
+            self.pending[future] = (shard, fn, args)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.pending.pop(future, None)
+
+    def run(self, shard, fn, *args):
+        from extensions.extensions import shards
+
+        with shards.on(shard):
+            try:
+                return fn(*args)
+            except Exception:
+                self.app.logger.exception("Background job %s failed", fn.__name__)
+                raise
+
+    # The args of the calls of fn submitted on the current shard that are queued or running in this process.
+    def in_flight(self, fn):
+        from extensions.extensions import shards
+
+        shard = shards.current()
+        with self.lock:
+            return [args for index, job_fn, args in self.pending.values() if index == shard and job_fn is fn]
+
+    # Run fn on every shard every JOB_SWEEP_INTERVAL seconds, starting when the process serves its first request.
+    def periodic(self, fn):
+        if fn not in self.tasks:
+            self.tasks.append(fn)
+
+    def start_sweeper(self):
+        if self.sweeper is not None and self.sweeper.is_alive():
+            return
+        with self.lock:
+            if self.sweeper is None or not self.sweeper.is_alive():
+                self.sweeper = threading.Thread(target=self.sweep_forever, name="job-sweeper", daemon=True)
+                self.sweeper.start()
+
+    def sweep_forever(self):
+        while True:
+            self.sweep()
+            threading.Event().wait(float(self.app.config["JOB_SWEEP_INTERVAL"]))
+
+    def sweep(self):
+        from extensions.extensions import shards
+
+        for fn in list(self.tasks):
+            for index in range(shards.count):
+                with shards.on(index):
+                    try:
+                        fn()
+                    except Exception:
+                        self.app.logger.exception("Periodic job %s failed on shard %s", fn.__name__, index)
+
+    # Threads don't survive a fork, so a forked worker starts with a new pool
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pending = {}
+        self.sweeper = None
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        # Outside the lock, finishing jobs take it to remove themselves from pending
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
@@ -0,0 +1,99 @@
+import cProfile
+import hmac
+import os
+import random
+import threading
+import time
+
+from flask import current_app, g, request
+
+
+# Profiles a sample of requests with cProfile, or any request sending the X-Profile header with the
+# PROFILE_TOKEN value. Each profile is written to PROFILE_DIR/<endpoint>/, keeping the newest
+# PROFILE_KEEP files per endpoint. Summarise them with `flask profile report`.
+# Only one request per process is profiled at a time: since Python 3.12 a second profiler can't be
+# enabled while one is running, so requests arriving meanwhile are served without a profile.
+class RequestProfiler:
+    header = "X-Profile"
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.token = None
+        self.directory = None
+        self.keep = 50
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("PROFILE_SAMPLE_RATE", 0.0)
+        app.config.setdefault("PROFILE_TOKEN", None)
+        app.config.setdefault("PROFILE_DIR", os.path.join(app.root_path, "profiles"))
+        app.config.setdefault("PROFILE_KEEP", 50)
+        self.sample_rate = float(app.config["PROFILE_SAMPLE_RATE"])
+        self.token = app.config["PROFILE_TOKEN"]
+        self.directory = app.config["PROFILE_DIR"]
+        self.keep = int(app.config["PROFILE_KEEP"])
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        # Views that raise skip after_request, so stop their profile here instead
+        app.teardown_request(lambda error: self.stop())
+
+    def requested(self):
+        value = request.headers.get(self.header)
+        return bool(self.token and value and hmac.compare_digest(value, self.token))
+
+    def start(self):
+        if request.endpoint is None:
+            return
+        if self.requested() or (self.sample_rate and random.random() < self.sample_rate):
+            if not self.lock.acquire(blocking=False):
+                return
+            try:
+                profile = cProfile.Profile()
+                profile.enable()
+            except Exception:
+                # e.g. another profiler or debugger is active, profiling must never fail the request
+                self.lock.release()
+                current_app.logger.exception("Couldn't start profiling %s", request.endpoint)
+                return
+            g.profile = profile
+
+    def finish(self, response):
+        path = self.stop()
+        if path and self.requested():
+            response.headers[self.header] = os.path.basename(path)
+        return response
+
+    # Stop the current request's profile and write it out, returning the file written.
+    def stop(self):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return None
+        try:
+            profile.disable()
+        finally:
+            self.lock.release()
+        try:
+            directory = os.path.join(self.directory, request.endpoint)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{time.time():.6f}-{os.getpid()}.prof")
+            profile.dump_stats(path)
+            self.prune(directory)
+        except Exception:
+            current_app.logger.exception("Couldn't write the profile of %s", request.endpoint)
+            return None
+        return path
+
+    # Remove the oldest profiles of an endpoint above the PROFILE_KEEP limit.
+    def prune(self, directory):
+        files = sorted(name for name in os.listdir(directory) if name.endswith(".prof"))
+        for name in files[: max(0, len(files) - self.keep)]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                # Another worker pruned it first
+                pass
+
+    # A lock held by a request of the parent process would never be released in a forked worker
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
@@ -0,0 +1,242 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect
+
+# Accounts of shard N get ids from N * ACCOUNT_ID_SPAN + 1, so an account id alone tells its shard
+ACCOUNT_ID_SPAN = 100_000_000
+
+# Copies to a shard that fail are retried in the background this many times, waiting 2, 4, 8... seconds
+REPLICATE_ATTEMPTS = 5
+
+# Blueprints whose requests run on the shard of the signed in user. Users and categories are written
+# on shard 0, which hands out their ids, and copied to the other shards from there.
+ROUTED_BLUEPRINTS = ("accounts", "sync", "reports")
+
+
+def bind_key(index):
+    return f"shard{index}" if index else None
+
+
+# The column values copied to the other shards. Change sequence numbers are per shard,
+# each shard stamps its copy itself.
+def replicated_values(obj):
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(type(obj)).column_attrs if attr.key != "change_seq"}
+
+
+# A session bound to one shard, chosen with Shards.use() before its first query.
+# Shard 0 is the default database, the others are SQLALCHEMY_BINDS entries named "shard<N>".
+class ShardSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get("shard"):
+            return self._db.engines[bind_key(self.info["shard"])]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Splits accounts and transactions across databases by user, so an account and all its transactions
+# live on the shard of their owner (user id modulo the number of shards). Every shard has the full
+# schema, users and categories are copied to all of them so joins and foreign keys keep working.
+# With no SHARD_DATABASE_URLS there is a single shard, and all of this does nothing.
+class Shards:
+    def __init__(self):
+        self.app = None
+        self.db = None
+        self.count = 1
+        self.executor = None
+        self.lock = threading.Lock()
+
+    # Must run before db.init_app, which creates an engine per bind
+    def init_app(self, app, db):
+        app.config.setdefault("SHARD_DATABASE_URLS", [])
+        urls = app.config["SHARD_DATABASE_URLS"]
+        self.app = app
+        self.db = db
+        self.count = 1 + len(urls)
+        if self.count == 1:
+            return
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        for index, url in enumerate(urls, start=1):
+            binds[bind_key(index)] = url
+
+        app.url_value_preprocessor(self.route_url)
+        app.before_request(self.route_user)
+        # The session is shared by every app, listen once however many apps are set up (e.g. in the tests)
+        if not event.contains(db.session, "after_flush", self.collect_replicated):
+            event.listen(db.session, "after_flush", self.collect_replicated)
+            event.listen(db.session, "after_commit", self.replicate)
+            event.listen(db.session, "after_rollback", self.forget_replicated)
+
+    def for_user(self, user_id):
+        return int(user_id) % self.count
+
+    def for_account(self, account_id):
+        index = int(account_id) // ACCOUNT_ID_SPAN
+        # Ids past the last shard don't exist anywhere, let shard 0 answer with a 404
+        return index if index < self.count else 0
+
+    # Bind the current session to a shard
+    def use(self, index):
+        self.db.session.info["shard"] = index
+
+    def current(self):
+        return self.db.session.info.get("shard", 0)
+
+    def engine(self, index):
+        return self.db.engines[bind_key(index)]
+
+    # Run a block on a shard, in its own app context and so its own session
+    @contextmanager
+    def on(self, index):
+        with self.app.app_context():
+            self.use(index)
+            yield
+
+    # Like on(), but keeps the current session when it is already on that shard
+    @contextmanager
+    def switch(self, index):
+        if index == self.current():
+            yield
+        else:
+            with self.on(index):
+                yield
+
+    def call(self, index, fn, *args):
+        with self.switch(index):
+            return fn(*args)
+
+    # Requests addressing an account run on its shard. Users are written on shard 0, so requests
+    # addressing a user (like DELETE /auth/<user_id>) stay there.
+    def route_url(self, endpoint, values):
+        if values and "account_id" in values:
+            self.use(self.for_account(values["account_id"]))
+
+    # Everything else a user does with their accounts runs on their own shard
+    def route_user(self):
+        if "shard" in self.db.session.info or not request.blueprints:
+            return
+        if request.blueprints[-1] not in ROUTED_BLUEPRINTS:
+            return
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            # The view's own jwt_required reports the error
+            return
+        user_id = get_jwt_identity()
+        if user_id is not None:
+            self.use(self.for_user(user_id))
+
+    # Run fn on every shard in parallel and return the results in shard order.
+    # fn runs in an app context of its own, without the request, so pass it what it needs.
+    def scatter(self, fn, *args):
+        if self.count == 1:
+            return [fn(*args)]
+        futures = [self.get_executor().submit(self.run_on, index, fn, *args) for index in range(self.count)]
+        return [future.result() for future in futures]
+
+    def run_on(self, index, fn, *args):
+        with self.on(index):
+            return fn(*args)
+
+    # One thread per shard, created on first use so forked workers each get their own
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.count, thread_name_prefix="shard")
+            return self.executor
+
+    # Remember the users and categories written in this flush, to copy them to the other shards on commit
+    def collect_replicated(self, session, flush_context):
+        from models.user import User
+        from models.category import Category
+
+        if session.info.get("replica"):
+            return
+        pending = session.info.setdefault("replicate", [])
+        for obj in list(session.new) + [obj for obj in session.dirty if session.is_modified(obj)]:
+            if isinstance(obj, (User, Category)):
+                pending.append((type(obj), obj.id, replicated_values(obj)))
+        for obj in session.deleted:
+            if isinstance(obj, (User, Category)):
+                pending.append((type(obj), obj.id, None))
+
+    def forget_replicated(self, session):
+        session.info.pop("replicate", None)
+
+    def replicate(self, session):
+        pending = session.info.pop("replicate", None)
+        if not pending:
+            return
+        source = session.info.get("shard", 0)
+        for index in range(self.count):
+            if index != source:
+                self.replicate_to(index, source, pending)
+
+    # The write has already committed, so a shard that fails to take its copy mustn't fail the request.
+    # It is retried in the background, with the rows read again from the source shard, so a late retry
+    # doesn't undo a newer write.
+    def replicate_to(self, index, source, pending, attempt=1):
+        try:
+            if attempt > 1:
+                pending = self.run_on(source, self.current_values, pending)
+            # Through the ORM, so each shard's change log and statistics follow the copy
+            with self.on(index):
+                self.db.session.info["replica"] = True
+                for model, id, values in pending:
+                    if values is not None:
+                        self.db.session.merge(model(**values))
+                        continue
+                    obj = self.db.session.get(model, id)
+                    if obj is not None:
+                        self.db.session.delete(obj)
+                self.db.session.commit()
+        except Exception:
+            if attempt >= REPLICATE_ATTEMPTS:
+                self.app.logger.exception("Copying %d rows to shard %d failed, giving up", len(pending), index)
+                return
+            self.app.logger.exception("Copying %d rows to shard %d failed, retrying", len(pending), index)
+            retry = threading.Timer(2**attempt, self.replicate_to, (index, source, pending, attempt + 1))
+            retry.daemon = True
+            retry.start()
+
+    # The rows to copy as they are now, None for those deleted since
+    def current_values(self, pending):
+        rows = []
+        for model, id, _ in pending:
+            obj = self.db.session.get(model, id)
+            rows.append((model, id, None if obj is None else replicated_values(obj)))
+        return rows
+
+    # Create the tables on the shards past shard 0, moving their account ids into their own range
+    def create_all(self):
+        for index in range(1, self.count):
+            engine = self.engine(index)
+            self.db.metadata.create_all(engine)
+            start = index * ACCOUNT_ID_SPAN
+            with engine.begin() as connection:
+                if connection.dialect.name == "postgresql":
+                    connection.exec_driver_sql(
+                        "SELECT setval(pg_get_serial_sequence('accounts', 'id'), "
+                        f"GREATEST({start}, (SELECT COALESCE(MAX(id), 0) FROM accounts)))"
+                    )
+                else:
+                    # accounts is an AUTOINCREMENT table on SQLite, which takes its next id from here
+                    connection.exec_driver_sql(
+                        f"UPDATE sqlite_sequence SET seq = MAX(seq, {start}) WHERE name = 'accounts'"
+                    )
+                    connection.exec_driver_sql(
+                        f"INSERT INTO sqlite_sequence (name, seq) SELECT 'accounts', {start} "
+                        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'accounts')"
+                    )
+
+    def drop_all(self):
+        for index in range(1, self.count):
+            self.db.metadata.drop_all(self.engine(index))
+
+    # Threads don't survive a fork, so a forked worker starts with a new pool
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
+        self.executor = None
@@ -0,0 +1,54 @@
+import threading
+
+
+# Adds the category amounts buffered by transaction writes (see AmountStatsDelta) to the category
+# statistics every STATS_MERGE_INTERVAL seconds, in batches of up to STATS_MERGE_BATCH amounts.
+# Each worker process runs one merger thread, started by its first write. The batches a merger takes
+# are deleted as they are read, so the mergers of several processes can run at the same time.
+class StatsMerger:
+    def __init__(self):
+        self.app = None
+        self.merger = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault("STATS_MERGE_INTERVAL", 1.0)
+        app.config.setdefault("STATS_MERGE_BATCH", 10000)
+        self.app = app
+
+    def start(self):
+        with self.lock:
+            if self.merger is None or not self.merger.is_alive():
+                self.merger = threading.Thread(target=self.run, name="stats-merger", daemon=True)
+                self.merger.start()
+
+    def run(self):
+        while True:
+            threading.Event().wait(float(self.app.config["STATS_MERGE_INTERVAL"]))
+            self.merge()
+
+    # Merge every buffered amount on each shard, returning how many there were.
+    def merge(self):
+        from extensions.extensions import db, shards
+        from utils.stats_utils import merge_amount_deltas
+
+        batch = int(self.app.config["STATS_MERGE_BATCH"])
+        merged = 0
+        for index in range(shards.count):
+            with shards.on(index):
+                try:
+                    while True:
+                        done = merge_amount_deltas(batch)
+                        merged += done
+                        if done < batch:
+                            break
+                except Exception:
+                    # The amounts of a failed batch are still buffered, they are merged on the next run
+                    db.session.rollback()
+                    self.app.logger.exception("Merging the amount statistics of shard %s failed", index)
+        return merged
+
+    # The merger thread doesn't survive a fork, so a forked worker starts its own
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
+        self.merger = None
@@ -0,0 +1,35 @@
+# Production launcher: gunicorn -c gunicorn.conf.py
+# The app is created once in the master process (imports, schemas and blueprints),
+# then forked into one worker process per CPU core, each serving requests on a pool of threads.
+import multiprocessing
+from os import environ
+
+wsgi_app = "wsgi:app"
+bind = environ.get("BIND", f"0.0.0.0:{environ.get('PORT', '8080')}")
+
+workers = int(environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Requests mostly wait on the database, so each worker serves several at once on threads
+worker_class = "gthread"
+threads = int(environ.get("THREADS", 4))
+
+preload_app = True
+
+# Workers are replaced after a number of requests, staggered so they don't all restart at once
+max_requests = int(environ.get("MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+timeout = 60
+# Time given to in-flight requests when workers are stopped or reloaded
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = environ.get("ACCESS_LOG", "-") or None
+
+
+def post_fork(server, worker):
+    from app import reset_after_fork
+    from wsgi import app
+
+    # Connections opened by the master while preloading must not be shared between workers.
+    # The worker and thread counts from the config, after any command line override,
+    # so each worker has one database connection per request thread.
+    reset_after_fork(app, workers=server.cfg.workers, threads=server.cfg.threads)
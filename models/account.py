@@ -1,33 +1,37 @@
 from datetime import datetime
 
-from marshmallow import fields, pre_load
+from marshmallow import Schema, fields, pre_load
 from marshmallow.validate import Length, And, Regexp
 
-from extensions.extensions import db, ma
+from extensions.extensions import db
 
 from utils.input_utils import sanitize_input
 
 
 class Account(db.Model):
     __tablename__ = "accounts"
+    # So SQLite takes new ids from sqlite_sequence, where each shard's account id range starts
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(
-        db.Integer, db.ForeignKey("users.id"), nullable=False
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )  # foreign key
 
     account_type = db.Column(db.String(50), nullable=False)
     balance = db.Column(db.Numeric(10, 2), nullable=False)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set on every write, used by the delta sync endpoint (see models/change_log.py)
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, index=True)
 
     # Relationships
     user = db.relationship("User", back_populates="accounts")
     transactions = db.relationship(
-        "Transaction", back_populates="account", cascade="all, delete"
+        "Transaction", back_populates="account", cascade="all, delete", passive_deletes=True
     )
 
 
-class AccountSchema(ma.Schema):
+class AccountSchema(Schema):
 
     account_type = fields.String(
         validate=And(
@@ -0,0 +1,263 @@
+from decimal import Decimal
+
+from sqlalchemy import bindparam, event, inspect
+
+from extensions.extensions import db, stats_merger
+
+from models.user import User
+from models.account import Account
+from models.category import Category
+from models.transaction import Transaction
+from utils.amount_sketch import AmountSketch
+
+# Statistics are kept per "account" and per "category", uncategorised transactions use category 0
+UNCATEGORISED = 0
+
+
+# Count, sum, min and max of the transaction amounts of an account or category.
+class AmountStats(db.Model):
+    __tablename__ = "amount_stats"
+
+    scope = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+    total = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    # Cleared when the min or max transaction is removed, the bins give an estimate until the next rebuild
+    min_amount = db.Column(db.Numeric(10, 2), nullable=True)
+    max_amount = db.Column(db.Numeric(10, 2), nullable=True)
+
+
+# How many amounts of an account or category fall in each bin of the sketch (see utils/amount_sketch.py).
+class AmountSketchBin(db.Model):
+    __tablename__ = "amount_sketch_bins"
+
+    scope = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bin = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+# Category statistics are shared by every account, so updating them in each write's transaction would make
+# concurrent posts in a popular category wait on the same rows. Writes append their amounts here instead,
+# and the stats merger adds them to the category statistics in batches (see merge_amount_deltas).
+# Account statistics are still updated by the write, as posts to an account already wait on its balance.
+class AmountStatsDelta(db.Model):
+    __tablename__ = "amount_stats_deltas"
+    __table_args__ = (db.Index("ix_amount_stats_deltas_scope_key", "scope", "key"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), nullable=False)
+    key = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    # 1 for an amount added, -1 for an amount removed
+    sign = db.Column(db.SmallInteger, nullable=False)
+
+
+def upsert(connection, model):
+    # Imported here, the PostgreSQL dialect package takes a while to import and isn't needed on SQLite
+    from sqlalchemy.dialects import postgresql, sqlite
+
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    return dialect.insert(model)
+
+
+# Add in-memory sketches, a mapping of (scope, key) to AmountSketch, to the stored ones.
+def add_sketches(connection, sketches):
+    sketches = {scope_key: sketch for scope_key, sketch in sketches.items() if sketch.count}
+    if not sketches:
+        return
+    stats = AmountStats.__table__
+    stmt = upsert(connection, AmountStats)
+    excluded = stmt.excluded
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["scope", "key"],
+            set_={
+                "count": stats.c["count"] + excluded["count"],
+                "total": stats.c.total + excluded.total,
+                # A cleared bound stays cleared, unless the row was empty
+                "min_amount": db.case(
+                    (stats.c["count"] == 0, excluded.min_amount),
+                    (excluded.min_amount < stats.c.min_amount, excluded.min_amount),
+                    else_=stats.c.min_amount,
+                ),
+                "max_amount": db.case(
+                    (stats.c["count"] == 0, excluded.max_amount),
+                    (excluded.max_amount > stats.c.max_amount, excluded.max_amount),
+                    else_=stats.c.max_amount,
+                ),
+            },
+        ),
+        [
+            {
+                "scope": scope,
+                "key": key,
+                "count": sketch.count,
+                "total": sketch.total,
+                "min_amount": sketch.min_amount,
+                "max_amount": sketch.max_amount,
+            }
+            for (scope, key), sketch in sketches.items()
+        ],
+    )
+    stmt = upsert(connection, AmountSketchBin)
+    connection.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["scope", "key", "bin"],
+            set_={"count": AmountSketchBin.__table__.c["count"] + stmt.excluded["count"]},
+        ),
+        [
+            {"scope": scope, "key": key, "bin": bin, "count": count}
+            for (scope, key), sketch in sketches.items()
+            for bin, count in sketch.bins.items()
+        ],
+    )
+
+
+# Subtract in-memory sketches of removed amounts from the stored ones.
+def remove_sketches(connection, sketches):
+    sketches = {scope_key: sketch for scope_key, sketch in sketches.items() if sketch.count}
+    if not sketches:
+        return
+    stats = AmountStats.__table__
+    connection.execute(
+        stats.update()
+        .where(stats.c.scope == bindparam("row_scope"), stats.c.key == bindparam("row_key"))
+        .values(
+            count=stats.c["count"] - bindparam("removed_count"),
+            total=stats.c.total - bindparam("removed_total", type_=db.Numeric(16, 2)),
+            min_amount=db.case(
+                (stats.c.min_amount >= bindparam("removed_min", type_=db.Numeric(10, 2)), None),
+                else_=stats.c.min_amount,
+            ),
+            max_amount=db.case(
+                (stats.c.max_amount <= bindparam("removed_max", type_=db.Numeric(10, 2)), None),
+                else_=stats.c.max_amount,
+            ),
+        ),
+        [
+            {
+                "row_scope": scope,
+                "row_key": key,
+                "removed_count": sketch.count,
+                "removed_total": sketch.total,
+                "removed_min": sketch.min_amount,
+                "removed_max": sketch.max_amount,
+            }
+            for (scope, key), sketch in sketches.items()
+        ],
+    )
+    bins = AmountSketchBin.__table__
+    connection.execute(
+        bins.update()
+        .where(
+            bins.c.scope == bindparam("row_scope"),
+            bins.c.key == bindparam("row_key"),
+            bins.c.bin == bindparam("row_bin"),
+        )
+        .values(count=bins.c["count"] - bindparam("removed_count")),
+        [
+            {"row_scope": scope, "row_key": key, "row_bin": bin, "removed_count": count}
+            for (scope, key), sketch in sketches.items()
+            for bin, count in sketch.bins.items()
+        ],
+    )
+
+
+# Buffer (account_id, category_id, amount) rows added to (sign 1) or removed from (sign -1) their category.
+def buffer_category_amounts(connection, rows, sign):
+    values = [
+        {"scope": "category", "key": category_id or UNCATEGORISED, "amount": amount, "sign": sign}
+        for _, category_id, amount in rows
+    ]
+    if values:
+        connection.execute(AmountStatsDelta.__table__.insert(), values)
+        stats_merger.start()
+
+
+# Sketches of (account_id, category_id, amount) rows, for their account and category.
+def sketches_of(rows, scopes=("account", "category")):
+    sketches = {}
+    for account_id, category_id, amount in rows:
+        if "account" in scopes:
+            sketches.setdefault(("account", account_id), AmountSketch()).add(amount)
+        if "category" in scopes:
+            key = ("category", category_id or UNCATEGORISED)
+            sketches.setdefault(key, AmountSketch()).add(amount)
+    return sketches
+
+
+# Drop the statistics of deleted accounts or categories.
+def drop_stats(connection, scope, keys):
+    if not keys:
+        return
+    for model in (AmountStats, AmountSketchBin, AmountStatsDelta):
+        connection.execute(db.delete(model).where(model.scope == scope, model.key.in_(keys)))
+
+
+# Keep the statistics up to date as transactions are written through the ORM.
+# Bulk writes (the synthetic seed and the background purge) update them directly.
+@event.listens_for(Transaction, "after_insert")
+def transaction_inserted(mapper, connection, transaction):
+    row = (transaction.account_id, transaction.category_id, transaction.amount)
+    add_sketches(connection, sketches_of([row], scopes=("account",)))
+    buffer_category_amounts(connection, [row], 1)
+
+
+@event.listens_for(Transaction, "after_update")
+def transaction_updated(mapper, connection, transaction):
+    state = inspect(transaction)
+    old, new = [], []
+    for attr in ("account_id", "category_id", "amount"):
+        history = state.attrs[attr].history
+        current = getattr(transaction, attr)
+        old.append(history.deleted[0] if history.deleted else current)
+        new.append(current)
+    # Amounts set from request JSON may be floats, so compare them as Decimals
+    old[2], new[2] = Decimal(str(old[2])), Decimal(str(new[2]))
+    # Only move the amount in the statistics it affects, e.g. recategorising leaves the account's alone
+    if old[0] != new[0] or old[2] != new[2]:
+        remove_sketches(connection, sketches_of([old], scopes=("account",)))
+        add_sketches(connection, sketches_of([new], scopes=("account",)))
+    if old[1] != new[1] or old[2] != new[2]:
+        buffer_category_amounts(connection, [old], -1)
+        buffer_category_amounts(connection, [new], 1)
+
+
+@event.listens_for(Transaction, "after_delete")
+def transaction_deleted(mapper, connection, transaction):
+    row = (transaction.account_id, transaction.category_id, transaction.amount)
+    remove_sketches(connection, sketches_of([row], scopes=("account",)))
+    buffer_category_amounts(connection, [row], -1)
+
+
+# Deleting a user or account cascades to its transactions inside the database, where the events above
+# don't see them. So take the transactions still left out of their category statistics first.
+def forget_transactions(connection, account_ids):
+    if not account_ids:
+        return
+    rows = connection.execute(
+        db.select(Transaction.account_id, Transaction.category_id, Transaction.amount).filter(
+            Transaction.account_id.in_(account_ids)
+        )
+    ).all()
+    buffer_category_amounts(connection, rows, -1)
+    drop_stats(connection, "account", account_ids)
+
+
+@event.listens_for(Account, "before_delete")
+def account_deleted(mapper, connection, account):
+    forget_transactions(connection, [account.id])
+
+
+@event.listens_for(User, "before_delete")
+def user_deleted(mapper, connection, user):
+    account_ids = connection.scalars(db.select(Account.id).filter_by(user_id=user.id)).all()
+    forget_transactions(connection, account_ids)
+
+
+@event.listens_for(Category, "after_delete")
+def category_deleted(mapper, connection, category):
+    drop_stats(connection, "category", [category.id])
@@ -0,0 +1,59 @@
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import event, inspect
+
+from extensions.extensions import db
+
+from models.transaction import Transaction
+
+
+# The balance of an account at a point in time. Historical balances start from the latest
+# snapshot before the requested date, and only add the transactions made since it.
+class BalanceSnapshot(db.Model):
+    __tablename__ = "balance_snapshots"
+    __table_args__ = (
+        db.Index("ix_balance_snapshots_account_date", "account_id", "snapshot_date"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(
+        db.Integer, db.ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False
+    )  # foreign key
+
+    balance = db.Column(db.Numeric(10, 2), nullable=False)
+    snapshot_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Snapshots are only valid while the transactions before them don't change.
+# When a transaction dated before a snapshot is added, edited or removed, shift that snapshot by the difference.
+def shift_snapshots(connection, account_id, since, amount):
+    if not amount or since is None:
+        return
+    connection.execute(
+        db.update(BalanceSnapshot)
+        .where(
+            BalanceSnapshot.account_id == account_id,
+            BalanceSnapshot.snapshot_date >= since,
+        )
+        .values(balance=BalanceSnapshot.balance + amount)
+    )
+
+
+@event.listens_for(Transaction, "after_insert")
+def transaction_inserted(mapper, connection, transaction):
+    shift_snapshots(connection, transaction.account_id, transaction.transaction_date, transaction.amount)
+
+
+@event.listens_for(Transaction, "after_update")
+def transaction_updated(mapper, connection, transaction):
+    history = inspect(transaction).attrs.amount.history
+    if history.deleted and history.added:
+        # Amounts set from request JSON may be floats, so compare them as Decimals
+        old_amount, new_amount = (Decimal(str(amount)) for amount in (history.deleted[0], history.added[0]))
+        shift_snapshots(connection, transaction.account_id, transaction.transaction_date, new_amount - old_amount)
+
+
+@event.listens_for(Transaction, "after_delete")
+def transaction_deleted(mapper, connection, transaction):
+    shift_snapshots(connection, transaction.account_id, transaction.transaction_date, -transaction.amount)
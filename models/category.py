@@ -1,7 +1,7 @@
-from marshmallow import fields, pre_load
+from marshmallow import Schema, fields, pre_load
 from marshmallow.validate import Length, And, Regexp
 
-from extensions.extensions import db, ma
+from extensions.extensions import db
 
 from utils.input_utils import sanitize_input
 
@@ -13,12 +13,14 @@ class Category(db.Model):
 
     name = db.Column(db.String(100), nullable=False, unique=True)
     description = db.Column(db.String(255), nullable=True)
+    # Set on every write, used by the delta sync endpoint (see models/change_log.py)
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, index=True)
 
     # Relationship to Transaction
     transactions = db.relationship("Transaction", back_populates="category")
 
 
-class CategorySchema(ma.Schema):
+class CategorySchema(Schema):
 
     name = fields.String(
         validate=And(
@@ -0,0 +1,135 @@
+from sqlalchemy import DDL, bindparam, event, text
+
+from extensions.extensions import db
+
+# Tables whose rows carry a change_seq, used by the delta sync endpoint
+SYNCED_TABLES = ("accounts", "transactions", "categories")
+
+
+# Change sequence numbers come from the change_seq sequence on postgreSQL. A sequence hands out numbers
+# without locking, so writers don't wait on each other, but numbers no longer commit in order: a client
+# could sync past a number whose transaction commits later. So each transaction holds an advisory lock on
+# the first number of every batch it takes until it commits, and readers stop below the lowest locked
+# number (see change_watermark).
+CHANGE_SEQ = db.Sequence("change_seq", metadata=db.metadata)
+# Advisory lock (two int key) taken shared while a writer takes and locks numbers, and exclusive by
+# readers while they look for the lowest locked one. Numbers are locked with the single bigint key.
+SEQ_GUARD = (0x5EC, 0)
+
+
+# SQLite only lets one transaction write at a time, so there a single row counter is enough.
+class ChangeCounter(db.Model):
+    __tablename__ = "change_counter"
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+event.listen(
+    ChangeCounter.__table__,
+    "after_create",
+    DDL("INSERT INTO change_counter (id, value) VALUES (1, 0)"),
+)
+
+
+# Records a deleted row, so syncing clients learn about the deletion.
+class Tombstone(db.Model):
+    __tablename__ = "tombstones"
+
+    id = db.Column(db.Integer, primary_key=True)
+    change_seq = db.Column(db.BigInteger, nullable=False, index=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    # Owner of the deleted account or transaction, None for categories which everyone can see
+    user_id = db.Column(db.Integer, nullable=True, index=True)
+
+
+# Reserve `count` sequence numbers for the current transaction, returned in increasing order.
+def next_change_seqs(connection, count):
+    if connection.dialect.name != "postgresql":
+        connection.execute(
+            db.update(ChangeCounter).filter_by(id=1).values(value=ChangeCounter.value + count)
+        )
+        last = connection.scalar(db.select(ChangeCounter.value).filter_by(id=1))
+        return list(range(last - count + 1, last + 1))
+
+    connection.execute(text("SELECT pg_advisory_lock_shared(:a, :b)"), {"a": SEQ_GUARD[0], "b": SEQ_GUARD[1]})
+    try:
+        seqs = connection.scalars(
+            text("SELECT nextval('change_seq') FROM generate_series(1, :count)"), {"count": count}
+        ).all()
+        seqs.sort()
+        # Released by the commit or rollback
+        connection.execute(text("SELECT pg_advisory_xact_lock(:seq)"), {"seq": seqs[0]})
+    finally:
+        connection.execute(text("SELECT pg_advisory_unlock_shared(:a, :b)"), {"a": SEQ_GUARD[0], "b": SEQ_GUARD[1]})
+    return seqs
+
+
+# The highest sequence number below which every change is committed (or rolled back).
+# Readers only return changes up to it, so a cursor never moves past a change still to commit.
+def change_watermark(connection):
+    if connection.dialect.name != "postgresql":
+        return connection.scalar(db.select(ChangeCounter.value).filter_by(id=1)) or 0
+
+    connection.execute(text("SELECT pg_advisory_lock(:a, :b)"), {"a": SEQ_GUARD[0], "b": SEQ_GUARD[1]})
+    try:
+        # Read the last number handed out before the locks, so every number up to it is either locked or done
+        last = connection.scalar(text("SELECT last_value FROM change_seq WHERE is_called")) or 0
+        lowest_locked = connection.scalar(
+            text(
+                "SELECT MIN((classid::bigint << 32) | objid::bigint) FROM pg_locks "
+                "WHERE locktype = 'advisory' AND objsubid = 1 AND granted "
+                "AND database = (SELECT oid FROM pg_database WHERE datname = current_database())"
+            )
+        )
+    finally:
+        connection.execute(text("SELECT pg_advisory_unlock(:a, :b)"), {"a": SEQ_GUARD[0], "b": SEQ_GUARD[1]})
+    return last if lowest_locked is None else min(last, lowest_locked - 1)
+
+
+# Insert tombstones for (entity, entity_id, user_id) rows, e.g. accounts removed by a database cascade.
+def add_tombstones(connection, deleted):
+    if not deleted:
+        return
+    seqs = next_change_seqs(connection, len(deleted))
+    connection.execute(
+        Tombstone.__table__.insert(),
+        [
+            {"change_seq": seq, "entity": entity, "entity_id": entity_id, "user_id": user_id}
+            for seq, (entity, entity_id, user_id) in zip(seqs, deleted)
+        ],
+    )
+
+
+def owner_of(obj):
+    if obj.__tablename__ == "accounts":
+        return obj.user_id
+    if obj.__tablename__ == "transactions":
+        return obj.account.user_id if obj.account else None
+    return None
+
+
+# Give every row written by the flush a new change_seq, and a tombstone to every deleted row.
+@event.listens_for(db.session, "after_flush")
+def stamp_changes(session, flush_context):
+    changed = [
+        obj
+        for obj in list(session.new) + [obj for obj in session.dirty if session.is_modified(obj)]
+        if getattr(obj, "__tablename__", None) in SYNCED_TABLES
+    ]
+    deleted = [obj for obj in session.deleted if getattr(obj, "__tablename__", None) in SYNCED_TABLES]
+    if not changed and not deleted:
+        return
+
+    connection = session.connection()
+    if changed:
+        stamps = {}
+        for obj, seq in zip(changed, next_change_seqs(connection, len(changed))):
+            stamps.setdefault(obj.__table__, []).append({"row_id": obj.id, "seq": seq})
+        for table, rows in stamps.items():
+            connection.execute(
+                table.update().where(table.c.id == bindparam("row_id")).values(change_seq=bindparam("seq")),
+                rows,
+            )
+    add_tombstones(connection, [(obj.__tablename__, obj.id, owner_of(obj)) for obj in deleted])
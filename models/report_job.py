@@ -0,0 +1,56 @@
+import uuid
+from datetime import datetime
+
+from marshmallow import Schema, fields
+from marshmallow.validate import OneOf
+
+from extensions.extensions import db
+
+VALID_REPORTS = ("account_summary", "search", "export")
+JOB_STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+
+
+class ReportJob(db.Model):
+    __tablename__ = "report_jobs"
+
+    # Random ids, so other users can't guess the id of a report
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )  # foreign key
+
+    report = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    # The finished report, stored as a JSON document. Deferred so status checks don't load it
+    result = db.deferred(db.Column(db.Text, nullable=True))
+    error = db.Column(db.String(255), nullable=True)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    # Kept recent by the process holding the job, so jobs lost with their process can be found and restarted
+    date_heartbeat = db.Column(db.DateTime, default=datetime.utcnow)
+    # Incremented each time a running job is restarted, so a run that was given up on can't overwrite the next
+    attempt = db.Column(db.Integer, nullable=False, default=1)
+    date_completed = db.Column(db.DateTime, nullable=True)
+
+
+class ReportJobSchema(Schema):
+    report = fields.String(required=True, validate=OneOf(VALID_REPORTS))
+    params = fields.Dict()
+
+    class Meta:
+        fields = (
+            "id",
+            "report",
+            "params",
+            "status",
+            "progress",
+            "error",
+            "date_created",
+            "date_completed",
+        )
+        ordered = True
+
+
+report_job_schema = ReportJobSchema()
+report_jobs_schema = ReportJobSchema(many=True)
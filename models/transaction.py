@@ -1,18 +1,22 @@
 from datetime import datetime
 
-from marshmallow import fields, pre_load
+from marshmallow import Schema, fields, pre_load
 
-from extensions.extensions import db, ma
+from extensions.extensions import db
 
 from utils.input_utils import sanitize_input
 
 
 class Transaction(db.Model):
     __tablename__ = "transactions"
+    # Used by the balance history, which sums an account's transactions between two dates
+    __table_args__ = (
+        db.Index("ix_transactions_account_date", "account_id", "transaction_date"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     account_id = db.Column(
-        db.Integer, db.ForeignKey("accounts.id"), nullable=False
+        db.Integer, db.ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False
     )  # Foreign Key
     category_id = db.Column(
         db.Integer, db.ForeignKey("categories.id"), nullable=True
@@ -22,14 +26,17 @@ class Transaction(db.Model):
     amount = db.Column(db.Numeric(10, 2), nullable=False)
     description = db.Column(db.String(255), nullable=True)
     transaction_date = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set on every write, used by the delta sync endpoint (see models/change_log.py)
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, index=True)
 
     # Relationships
     account = db.relationship("Account", back_populates="transactions")
     category = db.relationship("Category", back_populates="transactions")
 
 
-class TransactionSchema(ma.Schema):
+class TransactionSchema(Schema):
     account = fields.Nested("AccountSchema", exclude=["transactions"])
+    category = fields.Nested("CategorySchema", only=("id", "name"))
     description = fields.String()
 
     @pre_load
@@ -1,9 +1,9 @@
 from datetime import datetime
 
-from marshmallow import fields, pre_load
+from marshmallow import Schema, fields, pre_load
 from marshmallow.validate import OneOf, Length, Email
 
-from extensions.extensions import db, ma
+from extensions.extensions import db
 
 from utils.input_utils import sanitize_input
 
@@ -20,10 +20,13 @@ class User(db.Model):
     role = db.Column(db.String(50), nullable=False, default="User")
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
 
-    accounts = db.relationship("Account", back_populates="user", cascade="all, delete")
+    # The database deletes a user's accounts, passive_deletes stops the ORM loading them to delete one by one
+    accounts = db.relationship(
+        "Account", back_populates="user", cascade="all, delete", passive_deletes=True
+    )
 
 
-class UserSchema(ma.Schema):
+class UserSchema(Schema):
     username = fields.String(
         required=True,
         validate=Length(min=1, error="Username is required."),
@@ -0,0 +1,85 @@
+import pytest
+
+from app import create_app
+from extensions.extensions import bcrypt, cache, db, jobs
+
+PASSWORD = "123456"
+
+
+# Environment variables the module's app is created with. Override it in a test module to change them.
+@pytest.fixture(scope="module")
+def app_env():
+    return {}
+
+
+# One app per test module, on its own SQLite database.
+@pytest.fixture(scope="module")
+def app(app_env, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("app")
+    env = {
+        "DATABASE_URL": f"sqlite:///{directory / 'test.db'}",
+        "JWT_SECRET_KEY": "test-secret-key-at-least-32-bytes-long",
+        "SHARD_DATABASE_URLS": "",
+        "CACHE_BACKEND": "memory",
+        "GROUP_COMMIT": "",
+        "PROFILE_DIR": str(directory / "profiles"),
+        # Tests merge statistics and sweep jobs themselves, when they need to
+        "STATS_MERGE_INTERVAL": "3600",
+        "JOB_SWEEP_INTERVAL": "3600",
+        **app_env,
+    }
+    with pytest.MonkeyPatch.context() as patch:
+        for name, value in env.items():
+            patch.setenv(name, value)
+        app = create_app()
+    app.config.update(TESTING=True, BCRYPT_LOG_ROUNDS=4)
+    # Read the rounds again, bcrypt's default makes every seed and login take a quarter of a second
+    bcrypt.init_app(app)
+    yield app
+    jobs.shutdown()
+
+
+# Fresh tables with the example users, accounts and transactions of `flask db seed` for every test.
+@pytest.fixture(autouse=True)
+def database(app):
+    runner = app.test_cli_runner()
+    for args in (["db", "drop"], ["db", "create"], ["db", "seed"]):
+        result = runner.invoke(args=args)
+        assert result.exit_code == 0, result.output
+    cache.clear()
+    yield
+    # Background jobs of this test must not write to the next test's tables
+    jobs.shutdown()
+    with app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Authorization headers of a seeded user, signed in through POST /auth/login.
+@pytest.fixture
+def login(client):
+    def login(email):
+        response = client.post("/auth/login", json={"email": email, "password": PASSWORD})
+        assert response.status_code == 200, response.get_json()
+        return {"Authorization": f"Bearer {response.get_json()['token']}"}
+
+    return login
+
+
+@pytest.fixture
+def admin(login):
+    return login("admin@email.com")
+
+
+@pytest.fixture
+def user(login):
+    return login("user@email.com")
+
+
+@pytest.fixture
+def auditor(login):
+    return login("audit@email.com")
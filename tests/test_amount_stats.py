@@ -0,0 +1,142 @@
+import math
+import random
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func
+
+from extensions.extensions import db, stats_merger
+from models.amount_stats import AmountStatsDelta
+from models.transaction import Transaction
+from utils.amount_sketch import RELATIVE_ERROR, AmountSketch, quantile
+from utils.stats_utils import merge_sketches, rebuild_amount_stats
+
+# The three seeded Subscriptions transactions, all on account 2 but the first
+SEEDED = [Decimal("-45.67"), Decimal("-123.45"), Decimal("-234.56")]
+
+
+def random_amounts(count, seed=1):
+    generator = random.Random(seed)
+    return [
+        Decimal(str(round(generator.lognormvariate(3, 1.5), 2) or 0.01)) * generator.choice((-1, 1))
+        for _ in range(count)
+    ]
+
+
+# The amount at the same rank as quantile() reads from the bins
+def exact_quantile(amounts, q):
+    return float(sorted(amounts)[math.floor(q * (len(amounts) - 1))])
+
+
+def assert_close(estimate, exact):
+    assert abs(float(estimate) - exact) <= RELATIVE_ERROR * abs(exact) + 0.01
+
+
+@pytest.mark.parametrize("q", [0, 0.01, 0.25, 0.5, 0.9, 0.99, 1])
+def test_sketch_percentiles_are_within_the_relative_error(q):
+    amounts = random_amounts(5000)
+    sketch = AmountSketch()
+    for amount in amounts:
+        sketch.add(amount)
+    assert_close(quantile(sorted(sketch.bins.items()), sketch.count, q), exact_quantile(amounts, q))
+
+
+def test_merged_sketches_equal_one_sketch_of_everything():
+    amounts = random_amounts(300)
+    parts = [AmountSketch(), AmountSketch()]
+    whole = AmountSketch()
+    for index, amount in enumerate(amounts):
+        parts[index % 2].add(amount)
+        whole.add(amount)
+    merged = merge_sketches(parts)
+    assert (merged.count, merged.total, merged.min_amount, merged.max_amount) == (
+        whole.count, whole.total, whole.min_amount, whole.max_amount
+    )
+    assert merged.bins == whole.bins
+
+
+# Add transactions in category 1 of account 2 and return every amount of that category.
+@pytest.fixture
+def amounts(app):
+    amounts = random_amounts(500)
+    with app.app_context():
+        db.session.add_all(
+            Transaction(account_id=2, category_id=1, amount=amount, description="Random") for amount in amounts
+        )
+        db.session.commit()
+    return SEEDED + amounts
+
+
+def get_stats(client, auditor, path, **query):
+    response = client.get(path, query_string=query, headers=auditor)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_account_stats_match_the_exact_values(client, auditor, amounts):
+    stats = get_stats(client, auditor, "/accounts/2/amount_stats", percentiles="10,50,99.9")
+    account_amounts = amounts[1:]
+    assert stats["count"] == len(account_amounts)
+    assert Decimal(stats["sum"]) == sum(account_amounts)
+    assert (Decimal(stats["min"]), Decimal(stats["max"])) == (min(account_amounts), max(account_amounts))
+    for name, q in (("p10", 0.1), ("p50", 0.5), ("p99.9", 0.999)):
+        assert_close(stats["percentiles"][name], exact_quantile(account_amounts, q))
+    assert sum(bucket["count"] for bucket in stats["histogram"]) == len(account_amounts)
+
+
+def pending_deltas(app):
+    with app.app_context():
+        return db.session.scalar(db.select(func.count(AmountStatsDelta.id)))
+
+
+def test_buffered_category_amounts_are_counted_before_and_after_merging(app, client, auditor, amounts):
+    # Every transaction written so far, with the seeded Insurance one
+    assert pending_deltas(app) == len(amounts) + 1
+    pending = get_stats(client, auditor, "/categories/1/amount_stats")
+    assert pending["count"] == len(amounts)
+    assert Decimal(pending["sum"]) == sum(amounts)
+
+    assert stats_merger.merge() == len(amounts) + 1
+    assert pending_deltas(app) == 0
+    assert get_stats(client, auditor, "/categories/1/amount_stats") == pending
+
+    with app.app_context():
+        assert rebuild_amount_stats(chunk_size=100) == len(amounts) + 1
+    assert get_stats(client, auditor, "/categories/1/amount_stats") == pending
+
+
+def test_merged_batches_take_removals_after_their_adds(app, client, auditor, amounts, monkeypatch):
+    monkeypatch.setitem(app.config, "STATS_MERGE_BATCH", 7)
+    with app.app_context():
+        removed = db.session.scalars(db.select(Transaction).filter_by(description="Random").limit(100)).all()
+        for transaction in removed:
+            db.session.delete(transaction)
+        db.session.commit()
+    stats_merger.merge()
+    merged = get_stats(client, auditor, "/categories/1/amount_stats")
+    with app.app_context():
+        rebuild_amount_stats()
+    rebuilt = get_stats(client, auditor, "/categories/1/amount_stats")
+    assert merged["count"] == rebuilt["count"] == len(amounts) - 100
+    assert (merged["sum"], merged["percentiles"], merged["histogram"]) == (
+        rebuilt["sum"], rebuilt["percentiles"], rebuilt["histogram"]
+    )
+
+
+def test_stats_without_transactions(client, auditor):
+    stats = get_stats(client, auditor, "/categories/0/amount_stats")
+    assert (stats["count"], stats["min"], stats["percentiles"]["p50"]) == (0, None, None)
+
+
+@pytest.mark.parametrize(
+    "path, headers, status",
+    [
+        ("/accounts/2/amount_stats?percentiles=abc", "auditor", 400),
+        ("/accounts/2/amount_stats?percentiles=101", "auditor", 400),
+        ("/accounts/999/amount_stats", "auditor", 404),
+        ("/categories/999/amount_stats", "auditor", 404),
+        ("/accounts/2/amount_stats", "user", 403),
+    ],
+)
+def test_stats_requests_are_validated(client, request, path, headers, status):
+    assert client.get(path, headers=request.getfixturevalue(headers)).status_code == status
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import pytest
+
+from app import create_asgi_app
+from extensions.extensions import async_db
+
+
+@pytest.fixture(scope="module")
+def asgi_app(app):
+    return create_asgi_app(app)
+
+
+# Send one HTTP request through the ASGI app and return (status, headers, body).
+def call(asgi_app, method, path, headers=None, body=b""):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def request():
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()],
+            "server": ("localhost", 80),
+            "client": ("127.0.0.1", 1234),
+        }
+        try:
+            await asgi_app(scope, receive, send)
+        finally:
+            # Pooled connections belong to this event loop, every call runs in its own
+            await async_db.dispose()
+
+    asyncio.run(request())
+    start = next(message for message in messages if message["type"] == "http.response.start")
+    headers = {key.decode(): value.decode() for key, value in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in messages if message["type"] == "http.response.body")
+    return start["status"], headers, body
+
+
+@pytest.mark.parametrize("path", ["/accounts/", "/accounts/2"])
+def test_async_views_match_the_sync_views(asgi_app, client, user, path):
+    status, headers, body = call(asgi_app, "GET", path, user)
+    response = client.get(path, headers=user)
+    assert status == response.status_code == 200
+    assert headers["content-type"] == response.headers["Content-Type"]
+    assert json.loads(body) == response.get_json()
+
+
+def test_async_account_list_is_filtered_by_role(asgi_app, user, auditor):
+    _, _, body = call(asgi_app, "GET", "/accounts/", user)
+    assert [account["id"] for account in json.loads(body)] == [2]
+    _, _, body = call(asgi_app, "GET", "/accounts/", auditor)
+    assert sorted(account["id"] for account in json.loads(body)) == [1, 2, 3]
+
+
+@pytest.mark.parametrize("path, status", [("/accounts/1", 403), ("/accounts/999", 404)])
+def test_async_account_errors(asgi_app, user, path, status):
+    assert call(asgi_app, "GET", path, user)[0] == status
+
+
+def test_async_views_require_a_token(asgi_app):
+    assert call(asgi_app, "GET", "/accounts/")[0] == 401
+
+
+def test_async_search_validates_its_body(asgi_app, user):
+    headers = {**user, "Content-Type": "application/json"}
+    assert call(asgi_app, "POST", "/accounts/search", headers, b"not json")[0] == 400
+    status, _, body = call(asgi_app, "POST", "/accounts/search", headers, json.dumps({"query": ""}).encode())
+    assert status == 200
+    assert {transaction["id"] for transaction in json.loads(body)} == {2, 3}
+
+
+def test_other_routes_fall_through_to_flask(asgi_app, user):
+    status, _, body = call(asgi_app, "GET", "/categories/", user)
+    assert status == 200
+    assert [category["name"] for category in json.loads(body)] == ["Subscriptions", "Insurance"]
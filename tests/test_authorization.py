@@ -0,0 +1,54 @@
+import pytest
+from flask_jwt_extended import verify_jwt_in_request
+from sqlalchemy import event
+
+from extensions.extensions import db
+from utils.auth_utils import authorized_account
+
+
+@pytest.mark.parametrize(
+    "method, path, body, statuses",
+    [
+        # (user, admin, auditor) statuses, the user owns account 2
+        ("GET", "/accounts/2", None, (200, 403, 200)),
+        ("GET", "/accounts/1", None, (403, 200, 200)),
+        ("PATCH", "/accounts/2", {"account_type": "Spending"}, (201, 201, 403)),
+        ("POST", "/accounts/2/transactions/", {"amount": -5, "description": "Coffee"}, (201, 201, 403)),
+        ("GET", "/accounts/2/balance_history", None, (200, 403, 200)),
+    ],
+)
+def test_owner_and_roles_are_checked(client, user, admin, auditor, method, path, body, statuses):
+    for headers, status in zip((user, admin, auditor), statuses):
+        response = client.open(path, method=method, json=body, headers=headers)
+        assert response.status_code == status, (headers, response.get_json())
+
+
+@pytest.mark.parametrize("method", ["GET", "PATCH", "DELETE"])
+def test_missing_account_is_not_found_for_everyone(client, user, admin, method):
+    for headers in (user, admin):
+        response = client.open("/accounts/999", method=method, json={}, headers=headers)
+        assert response.status_code == 404
+
+
+def test_account_and_role_are_checked_in_one_query(app, admin):
+    statements = []
+
+    def executed(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.test_request_context(headers=admin):
+        verify_jwt_in_request()
+        event.listen(db.engine, "before_cursor_execute", executed)
+        try:
+            account, allowed = authorized_account(2, ["Admin"])
+            assert (account.id, allowed) == (2, True)
+            assert authorized_account(2, ["Auditor"])[1] is False
+            assert authorized_account(999, ["Admin"]) == (None, False)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", executed)
+    assert len(statements) == 3
+
+
+def test_deleted_user_is_not_authorized(client, user, admin):
+    assert client.delete("/auth/2", headers=admin).status_code == 200
+    assert client.get("/accounts/1", headers=user).status_code == 403
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+from extensions.extensions import db
+from models.account import Account
+from models.balance_snapshot import BalanceSnapshot
+from models.transaction import Transaction
+from utils.balance_utils import BUCKETS, create_snapshots
+
+# Start of the day the test account was opened, ten days ago
+OPENED = (datetime.utcnow() - timedelta(days=10)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def day(days):
+    return (OPENED + timedelta(days=days)).isoformat()
+
+
+# An account of user@email.com opened with 100.00, then +50 on day 2, -20 on day 5 and +30 on day 8.
+@pytest.fixture
+def account_id(app):
+    with app.app_context():
+        account = Account(account_type="History", balance=160, user_id=2, date_created=OPENED)
+        db.session.add(account)
+        db.session.add_all(
+            Transaction(account=account, amount=amount, description="History", transaction_date=OPENED + timedelta(days=days))
+            for days, amount in ((2, 50), (5, -20), (8, 30))
+        )
+        db.session.commit()
+        return account.id
+
+
+def balance(client, headers, account_id, at):
+    response = client.get(f"/accounts/{account_id}/balance_history", query_string={"at": at}, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()["balance"]
+
+
+def add_transaction(app, account_id, days, amount):
+    with app.app_context():
+        account = db.session.get(Account, account_id)
+        account.balance += Decimal(amount)
+        transaction_date = OPENED + timedelta(days=days)
+        db.session.add(Transaction(account_id=account_id, amount=amount, description="Late", transaction_date=transaction_date))
+        db.session.commit()
+
+
+EXPECTED = [(day(-1), None), (day(1), "100.00"), (day(3), "150.00"), (day(6), "130.00"), (day(9), "160.00")]
+
+
+@pytest.mark.parametrize("at, expected", EXPECTED)
+def test_balance_at_without_snapshots(client, user, account_id, at, expected):
+    assert balance(client, user, account_id, at) == expected
+
+
+@pytest.mark.parametrize("at, expected", EXPECTED)
+def test_snapshots_give_the_same_balances(app, client, user, account_id, at, expected):
+    with app.app_context():
+        assert create_snapshots() > 0
+        # A second run finds no new transactions to snapshot
+        assert create_snapshots() == 0
+    assert balance(client, user, account_id, at) == expected
+
+
+def test_snapshots_need_enough_new_transactions(app, account_id):
+    with app.app_context():
+        assert create_snapshots(min_transactions=4) == 0
+        assert create_snapshots(min_transactions=3) == 1
+        snapshot = db.session.scalar(db.select(BalanceSnapshot).filter_by(account_id=account_id))
+        assert snapshot.balance == Decimal("160.00")
+
+
+def test_backdated_transaction_shifts_later_snapshots(app, client, user, account_id):
+    with app.app_context():
+        create_snapshots()
+    add_transaction(app, account_id, 4, 10)
+    assert [balance(client, user, account_id, at) for at in (day(3), day(6), day(9))] == ["150.00", "140.00", "170.00"]
+
+
+def test_balance_set_directly_keeps_the_history(client, user, admin, account_id):
+    response = client.patch(f"/accounts/{account_id}", json={"balance": 500}, headers=admin)
+    assert response.status_code == 201
+    assert balance(client, user, account_id, day(9)) == "160.00"
+    assert balance(client, user, account_id, datetime.utcnow().isoformat()) == "500.00"
+
+
+def test_history_is_downsampled_to_buckets(client, user, account_id):
+    response = client.get(
+        f"/accounts/{account_id}/balance_history",
+        query_string={"start": day(0), "end": day(9), "bucket": "week"},
+        headers=user,
+    )
+    closing = {}
+    for days, amount in ((0, "100.00"), (2, "150.00"), (5, "130.00"), (8, "160.00")):
+        closing[BUCKETS["week"](OPENED + timedelta(days=days)).isoformat()] = amount
+    history = response.get_json()["history"]
+    assert {point["date"]: point["balance"] for point in history} == closing
+
+
+def test_history_lists_every_transaction(client, user, account_id):
+    response = client.get(
+        f"/accounts/{account_id}/balance_history", query_string={"start": day(1), "end": day(9)}, headers=user
+    )
+    assert [point["balance"] for point in response.get_json()["history"]] == ["100.00", "150.00", "130.00", "160.00"]
+
+
+@pytest.mark.parametrize(
+    "query, status",
+    [
+        ({"bucket": "year"}, 400),
+        ({"at": "yesterday"}, 400),
+        ({"start": day(5), "end": day(1)}, 400),
+    ],
+)
+def test_history_validates_its_query(client, user, account_id, query, status):
+    response = client.get(f"/accounts/{account_id}/balance_history", query_string=query, headers=user)
+    assert response.status_code == status
+
+
+@pytest.mark.parametrize("path, status", [("/accounts/1/balance_history", 403), ("/accounts/999/balance_history", 404)])
+def test_history_of_other_accounts(client, user, auditor, path, status):
+    assert client.get(path, headers=user).status_code == status
+    # Auditors can read the history of every account
+    assert client.get("/accounts/1/balance_history", headers=auditor).status_code == 200
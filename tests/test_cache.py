@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+from controllers import account_controller
+from extensions.cache import MemoryCache, SQLiteCache
+from extensions.extensions import cache, db, shards
+from models.account import Account
+from utils.purge_utils import purge_transactions
+
+
+def cache_status(client, path, headers, **kwargs):
+    response = client.get(path, headers=headers, **kwargs)
+    assert response.status_code == 200, response.get_json()
+    return response.headers["X-Cache"]
+
+
+def test_memory_cache_evicts_the_least_recently_used_entry():
+    backend = MemoryCache(max_entries=2)
+    backend.set("a", 1, 60)
+    backend.set("b", 2, 60)
+    backend.get("a")
+    backend.set("c", 3, 60)
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == (1, None, 3)
+
+
+def test_memory_cache_expires_and_invalidates_by_tag():
+    backend = MemoryCache()
+    backend.set("expired", 1, -1)
+    backend.set("tagged", 2, 60, tags=["total_balance"])
+    backend.set("other", 3, 60, tags=["account_summary"])
+    backend.invalidate(["total_balance"])
+    assert (backend.get("expired"), backend.get("tagged"), backend.get("other")) == (None, None, 3)
+
+
+def test_sqlite_cache_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    writer, reader = SQLiteCache(path), SQLiteCache(path)
+    writer.set("summary", {"body": "x"}, 60, tags=["account_summary"])
+    assert reader.get("summary") == {"body": "x"}
+    # A write in one worker process invalidates the entries every worker sees
+    reader.invalidate(["account_summary"])
+    assert writer.get("summary") is None
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_entry_is_not_stored_after_its_tags_are_invalidated(tmp_path, backend):
+    backend = MemoryCache() if backend == "memory" else SQLiteCache(str(tmp_path / "cache.sqlite3"))
+    generations = backend.generations(["total_balance", "account_summary"])
+    backend.invalidate(["account_summary"])
+    backend.set("stale", 1, 60, ["total_balance", "account_summary"], generations)
+    assert backend.get("stale") is None
+    backend.set("fresh", 2, 60, ["total_balance"], backend.generations(["total_balance"]))
+    assert backend.get("fresh") == 2
+
+
+@pytest.mark.parametrize("processes, backend", [(1, MemoryCache), (2, SQLiteCache)])
+def test_auto_backend_is_shared_with_several_workers(app, monkeypatch, tmp_path, processes, backend):
+    monkeypatch.setattr(cache, "auto", True)
+    monkeypatch.setattr(cache, "sqlite_path", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(cache, "backend", MemoryCache())
+    cache.reset_after_fork(processes)
+    assert isinstance(cache.backend, backend)
+
+
+def test_report_is_cached_until_a_transaction_is_written(client, auditor, user):
+    assert cache_status(client, "/accounts/summary", auditor) == "MISS"
+    assert cache_status(client, "/accounts/summary", auditor) == "HIT"
+    response = client.post("/accounts/2/transactions/", json={"amount": -5, "description": "Coffee"}, headers=user)
+    assert response.status_code == 201
+    assert cache_status(client, "/accounts/summary", auditor) == "MISS"
+
+
+def test_total_balance_is_invalidated_by_an_account_update(client, auditor, admin):
+    before = client.get("/accounts/total_balance", headers=auditor).get_json()["total_balance"]
+    assert cache_status(client, "/accounts/total_balance", auditor) == "HIT"
+    assert client.patch("/accounts/1", json={"balance": 100}, headers=admin).status_code == 201
+    response = client.get("/accounts/total_balance", headers=auditor)
+    assert response.headers["X-Cache"] == "MISS"
+    assert float(response.get_json()["total_balance"]) == pytest.approx(float(before) - 1134.56)
+
+
+def test_report_computed_across_a_write_is_not_cached(app, client, auditor, monkeypatch):
+    original = account_controller.shard_total_balance
+
+    def update_account():
+        with app.app_context():
+            db.session.get(Account, 1).balance = 100
+            db.session.commit()
+
+    # The total is read before another request commits a new balance
+    def total_then_write():
+        total = original()
+        thread = threading.Thread(target=update_account)
+        thread.start()
+        thread.join()
+        return total
+
+    monkeypatch.setattr(account_controller, "shard_total_balance", total_then_write)
+    before = client.get("/accounts/total_balance", headers=auditor).get_json()["total_balance"]
+    monkeypatch.setattr(account_controller, "shard_total_balance", original)
+    response = client.get("/accounts/total_balance", headers=auditor)
+    assert response.headers["X-Cache"] == "MISS"
+    assert float(response.get_json()["total_balance"]) == pytest.approx(float(before) - 1134.56)
+
+
+def test_ranks_are_only_invalidated_for_the_changed_account(client, auditor, admin):
+    for account_id in (1, 2):
+        cache_status(client, f"/accounts/{account_id}/transactions/rank", auditor)
+    assert client.patch("/accounts/2/transactions/2", json={"amount": -1}, headers=admin).status_code == 201
+    assert cache_status(client, "/accounts/1/transactions/rank", auditor) == "HIT"
+    assert cache_status(client, "/accounts/2/transactions/rank", auditor) == "MISS"
+
+
+def test_each_response_format_is_cached_separately(client, auditor):
+    assert cache_status(client, "/accounts/summary", auditor) == "MISS"
+    msgpack = {**auditor, "Accept": "application/msgpack"}
+    assert cache_status(client, "/accounts/summary", msgpack) == "MISS"
+    response = client.get("/accounts/summary", headers=msgpack)
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.mimetype == "application/msgpack"
+
+
+def test_purge_chunks_invalidate_the_reports(app, client, auditor):
+    summary = client.get("/accounts/summary", headers=auditor).get_json()
+    assert 2 in [row["account_id"] for row in summary]
+    assert cache_status(client, "/accounts/2/transactions/rank", auditor) == "MISS"
+    with app.app_context():
+        # The account itself is still there, only its transactions are purged
+        assert shards.call(0, purge_transactions, Account, 2, 1) == 2
+    response = client.get("/accounts/summary", headers=auditor)
+    assert response.headers["X-Cache"] == "MISS"
+    assert 2 not in [row["account_id"] for row in response.get_json()]
+    ranks = client.get("/accounts/2/transactions/rank", headers=auditor)
+    assert (ranks.headers["X-Cache"], ranks.get_json()) == ("MISS", [])
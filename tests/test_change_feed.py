@@ -0,0 +1,110 @@
+import json
+import queue
+
+import pytest
+
+from extensions.extensions import change_feed, db
+from models.transaction import Transaction
+
+
+# The events a subscriber has received so far, as (event, data) pairs.
+def received(subscriber):
+    events = []
+    while True:
+        try:
+            change = subscriber[0].get_nowait()
+        except queue.Empty:
+            return events
+        events.append((change["event"], change["data"]))
+
+
+@pytest.fixture
+def subscribe():
+    subscribers = []
+
+    def subscribe(account_id=None):
+        subscriber = change_feed.subscribe(account_id)
+        subscribers.append(subscriber)
+        return subscriber
+
+    yield subscribe
+    for subscriber in subscribers:
+        change_feed.unsubscribe(subscriber)
+
+
+def test_account_subscribers_only_get_their_account(client, user, admin, subscribe):
+    account, everything = subscribe(2), subscribe()
+    client.post("/accounts/2/transactions/", json={"amount": -5, "description": "Coffee"}, headers=user)
+    client.post("/accounts/1/transactions/", json={"amount": -6, "description": "Tea"}, headers=admin)
+    events = [(event, data["account_id"], data["amount"]) for event, data in received(account)]
+    assert events == [("transaction.created", 2, "-5.00")]
+    assert [data["account_id"] for _, data in received(everything)] == [2, 1]
+
+
+def test_updates_and_deletes_are_sent(client, admin, subscribe):
+    subscriber = subscribe(2)
+    assert client.patch("/accounts/2/transactions/2", json={"amount": -100}, headers=admin).status_code == 201
+    assert client.delete("/accounts/2/transactions/3", headers=admin).status_code == 200
+    (updated, data), deleted = received(subscriber)
+    assert (updated, data["id"], data["amount"], data["description"]) == ("transaction.updated", 2, "-100.00", "Netflix")
+    assert deleted == ("transaction.deleted", {"id": 3, "account_id": 2})
+
+
+def test_rolled_back_changes_are_not_sent(app, subscribe):
+    subscriber = subscribe()
+    with app.app_context():
+        db.session.add(Transaction(account_id=2, amount=-1, description="Rolled back"))
+        db.session.flush()
+        db.session.rollback()
+    assert received(subscriber) == []
+
+
+def test_deleted_account_is_sent(client, user, subscribe):
+    subscriber = subscribe(2)
+    assert client.delete("/accounts/2", headers=user).status_code in (200, 202)
+    assert ("account.deleted", {"account_id": 2}) in received(subscriber)
+
+
+def test_stream_sends_events_and_keepalives(client, user):
+    stream = change_feed.stream(2, keepalive=0.01)
+    assert next(stream) == "retry: 3000\n\n"
+    assert next(stream) == ": keep-alive\n\n"
+    client.post("/accounts/2/transactions/", json={"amount": -5, "description": "Coffee"}, headers=user)
+    message = next(stream)
+    assert message.startswith("event: transaction.created\ndata: ")
+    assert json.loads(message.split("data: ", 1)[1])["description"] == "Coffee"
+    stream.close()
+    assert change_feed.broker.subscribers == set()
+
+
+@pytest.mark.parametrize(
+    "path, headers, status",
+    [
+        ("/accounts/1/transactions/stream", "user", 403),
+        ("/accounts/999/transactions/stream", "user", 404),
+        ("/accounts/stream", "user", 403),
+    ],
+)
+def test_streams_are_authorized(client, request, path, headers, status):
+    assert client.get(path, headers=request.getfixturevalue(headers)).status_code == status
+    assert change_feed.open_streams == 0
+
+
+def test_open_streams_are_capped(app, auditor, user):
+    assert change_feed.max_streams == 2
+    streams = [
+        app.test_client().get("/accounts/stream", headers=auditor, buffered=False),
+        app.test_client().get("/accounts/2/transactions/stream", headers=user, buffered=False),
+    ]
+    try:
+        assert [(stream.status_code, stream.mimetype) for stream in streams] == [(200, "text/event-stream")] * 2
+        refused = app.test_client().get("/accounts/stream", headers=auditor, buffered=False)
+        assert (refused.status_code, refused.headers["Retry-After"]) == (503, "30")
+        # Closing a stream frees its slot
+        streams.pop(0).close()
+        streams.append(app.test_client().get("/accounts/stream", headers=auditor, buffered=False))
+        assert streams[-1].status_code == 200
+    finally:
+        for stream in streams:
+            stream.close()
+    assert change_feed.open_streams == 0
@@ -0,0 +1,99 @@
+import gzip
+import json
+
+import msgpack
+import pytest
+import zstandard
+
+from extensions.encoding import COLUMNAR_JSON, MSGPACK, to_columns
+from extensions.extensions import encoder
+
+DECODERS = {
+    "application/json": json.loads,
+    COLUMNAR_JSON: json.loads,
+    MSGPACK: msgpack.unpackb,
+}
+DECOMPRESSORS = {"gzip": gzip.decompress, "zstd": zstandard.decompress}
+
+
+def get(client, headers, path="/accounts/", **accept):
+    response = client.get(path, headers={**headers, **accept})
+    body = response.get_data()
+    if "Content-Encoding" in response.headers:
+        body = DECOMPRESSORS[response.headers["Content-Encoding"]](body)
+    return response, DECODERS[response.mimetype](body)
+
+
+def test_rows_become_columns():
+    rows = [{"id": 1, "items": [{"a": 1}]}, {"id": 2, "extra": "x", "items": []}]
+    assert to_columns(rows) == {
+        "count": 2,
+        "columns": {
+            "id": [1, 2],
+            "items": [{"count": 1, "columns": {"a": [1]}}, {"count": 0, "columns": {}}],
+            "extra": [None, "x"],
+        },
+    }
+    assert to_columns({"id": 1}) == {"id": 1}
+    assert to_columns([1, 2]) == [1, 2]
+
+
+@pytest.mark.parametrize(
+    "accept, mimetype",
+    [
+        (MSGPACK, MSGPACK),
+        (COLUMNAR_JSON, COLUMNAR_JSON),
+        (f"{MSGPACK};q=0.5, {COLUMNAR_JSON}", COLUMNAR_JSON),
+        ("*/*", "application/json"),
+        ("text/html", "application/json"),
+    ],
+)
+def test_format_is_negotiated(client, auditor, accept, mimetype):
+    _, expected = get(client, auditor)
+    response, data = get(client, auditor, Accept=accept)
+    assert response.status_code == 200
+    assert response.mimetype == mimetype
+    assert "Accept" in response.vary
+    assert data == (to_columns(expected) if mimetype == COLUMNAR_JSON else expected)
+
+
+def test_errors_are_negotiated_too(client, user):
+    response, data = get(client, user, "/accounts/999", Accept=MSGPACK)
+    assert (response.status_code, response.mimetype, data) == (404, MSGPACK, {"error": "Account with id 999 not found"})
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, encoding",
+    [
+        ("gzip, zstd", "zstd"),
+        ("gzip", "gzip"),
+        ("zstd;q=0.5, gzip", "gzip"),
+        ("br", None),
+        ("", None),
+    ],
+)
+def test_large_responses_are_compressed(client, auditor, monkeypatch, accept_encoding, encoding):
+    monkeypatch.setattr(encoder, "min_size", 100)
+    _, expected = get(client, auditor)
+    response, data = get(client, auditor, **{"Accept-Encoding": accept_encoding})
+    assert response.headers.get("Content-Encoding") == encoding
+    assert "Accept-Encoding" in response.vary
+    assert data == expected
+
+
+def test_small_responses_are_not_compressed(client, user):
+    response = client.get("/accounts/2", headers={**user, "Accept-Encoding": "gzip"})
+    assert len(response.get_data()) < encoder.min_size
+    assert "Content-Encoding" not in response.headers
+
+
+def test_streams_are_not_compressed(app, user, monkeypatch):
+    monkeypatch.setattr(encoder, "min_size", 0)
+    response = app.test_client().get(
+        "/accounts/2/transactions/stream", headers={**user, "Accept-Encoding": "gzip"}, buffered=False
+    )
+    try:
+        assert response.mimetype == "text/event-stream"
+        assert "Content-Encoding" not in response.headers
+    finally:
+        response.close()
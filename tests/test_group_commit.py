@@ -0,0 +1,114 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from extensions.extensions import db, group_commit
+from models.account import Account
+from models.transaction import Transaction
+
+
+@pytest.fixture(scope="module")
+def app_env():
+    return {"GROUP_COMMIT": "1", "GROUP_COMMIT_WINDOW_MS": "20"}
+
+
+# A write adding a transaction to account 2, as the transaction post hands to the committer.
+def add_transaction(description, account_id=2):
+    transaction = Transaction(account_id=account_id, amount=-1, description=description)
+    db.session.add(transaction)
+    return lambda: transaction.description
+
+
+def failing_write():
+    raise ValueError("Invalid write")
+
+
+@pytest.fixture
+def commits(app):
+    commits = []
+
+    def committed(session):
+        commits.append(session)
+
+    event.listen(db.session, "after_commit", committed)
+    yield commits
+    event.remove(db.session, "after_commit", committed)
+
+
+def descriptions(app):
+    with app.app_context():
+        return db.session.scalars(db.select(Transaction.description).filter_by(account_id=2)).all()
+
+
+def commit_batch(app, writes):
+    batch = [(fn, args, Future()) for fn, *args in writes]
+    with app.app_context():
+        group_commit.commit_batch(batch)
+    return [future.exception() or future.result() for _, _, future in batch]
+
+
+def test_batch_is_committed_in_one_transaction(app, commits):
+    results = commit_batch(app, [(add_transaction, "First"), (add_transaction, "Second"), (add_transaction, "Third")])
+    assert results == ["First", "Second", "Third"]
+    assert len(commits) == 1
+    assert descriptions(app)[-3:] == ["First", "Second", "Third"]
+
+
+@pytest.mark.parametrize(
+    "write, error",
+    [
+        ((failing_write,), ValueError),
+        # Fails on the flush, account_id can't be null
+        ((add_transaction, "Orphan", None), IntegrityError),
+    ],
+)
+def test_failed_write_is_retried_without_the_others(app, commits, write, error):
+    results = commit_batch(app, [(add_transaction, "First"), write, (add_transaction, "Third")])
+    assert results[0] == "First" and results[2] == "Third"
+    assert isinstance(results[1], error)
+    # One commit for each write that succeeded on its own
+    assert len(commits) == 2
+    assert descriptions(app)[-2:] == ["First", "Third"]
+
+
+def test_failed_commit_fails_the_whole_batch(app, commits, monkeypatch):
+    def commit():
+        raise OperationalError("COMMIT", {}, Exception("connection lost"))
+
+    monkeypatch.setattr(db.session, "commit", commit)
+    results = commit_batch(app, [(add_transaction, "First"), (add_transaction, "Second")])
+    monkeypatch.undo()
+    # The commit may have reached the database, so the writes aren't tried again
+    assert all(isinstance(result, OperationalError) for result in results)
+    assert commits == []
+    assert "First" not in descriptions(app)
+
+
+def test_write_without_group_commit_raises_its_error(app):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            group_commit.commit_batch([(failing_write, (), None)])
+
+
+def test_concurrent_posts_are_committed_together(app, client, user, commits):
+    def post(index):
+        return client.post("/accounts/2/transactions/", json={"amount": -1, "description": f"Post {index}"}, headers=user)
+
+    assert group_commit.enabled
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        responses = list(executor.map(post, range(20)))
+    assert [response.status_code for response in responses] == [201] * 20
+    assert {response.get_json()["description"] for response in responses} == {f"Post {index}" for index in range(20)}
+    assert len(commits) < 20
+    with app.app_context():
+        assert db.session.get(Account, 2).balance == Decimal("10000.00") - 20
+
+
+def test_post_to_an_account_deleted_while_waiting_is_not_found(app, client, user, monkeypatch):
+    # The request found the account, which was then deleted before the committer ran its write
+    monkeypatch.setattr("controllers.transaction_controller.authorized_account", lambda account_id, roles: (True, True))
+    response = client.post("/accounts/999/transactions/", json={"amount": -1, "description": "Late"}, headers=user)
+    assert response.status_code == 404
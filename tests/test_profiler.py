@@ -0,0 +1,87 @@
+import os
+import shutil
+
+import pytest
+
+from extensions.extensions import profiler
+
+TOKEN = "profile-token"
+
+
+@pytest.fixture(scope="module")
+def app_env():
+    return {"PROFILE_TOKEN": TOKEN}
+
+
+@pytest.fixture(autouse=True)
+def profiles(app):
+    shutil.rmtree(app.config["PROFILE_DIR"], ignore_errors=True)
+    yield os.path.join(app.config["PROFILE_DIR"], "accounts.get_all_accounts")
+    assert not profiler.lock.locked()
+
+
+def get_accounts(client, user, token=TOKEN):
+    response = client.get("/accounts/", headers={**user, "X-Profile": token})
+    assert response.status_code == 200
+    return response
+
+
+def test_requested_profile_is_written(client, user, profiles):
+    response = get_accounts(client, user)
+    assert os.listdir(profiles) == [response.headers["X-Profile"]]
+
+
+def test_wrong_token_is_not_profiled(client, user, profiles):
+    assert "X-Profile" not in get_accounts(client, user, "wrong").headers
+    assert not os.path.exists(profiles)
+
+
+def test_sampled_requests_are_profiled(client, user, profiles, monkeypatch):
+    monkeypatch.setattr(profiler, "sample_rate", 1.0)
+    response = get_accounts(client, user, "")
+    # Only requests that asked for a profile are told its name
+    assert "X-Profile" not in response.headers
+    assert len(os.listdir(profiles)) == 1
+
+
+def test_only_the_newest_profiles_are_kept(client, user, profiles, monkeypatch):
+    monkeypatch.setattr(profiler, "keep", 2)
+    names = [get_accounts(client, user).headers["X-Profile"] for _ in range(4)]
+    assert sorted(os.listdir(profiles)) == names[2:]
+
+
+def test_request_is_not_profiled_while_another_is(client, user, profiles):
+    profiler.lock.acquire()
+    try:
+        assert "X-Profile" not in get_accounts(client, user).headers
+    finally:
+        profiler.lock.release()
+    assert not os.path.exists(profiles)
+
+
+def test_profiler_that_fails_to_start_is_skipped(client, user, monkeypatch):
+    class Profile:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr("extensions.profiler.cProfile.Profile", Profile)
+    assert "X-Profile" not in get_accounts(client, user).headers
+
+
+def test_profile_that_fails_to_write_is_skipped(client, user, tmp_path, monkeypatch):
+    # A file where the profile directory should be
+    blocked = tmp_path / "blocked"
+    blocked.write_text("")
+    monkeypatch.setattr(profiler, "directory", str(blocked))
+    assert "X-Profile" not in get_accounts(client, user).headers
+
+
+def test_report_and_clear_commands(app, client, user):
+    get_accounts(client, user)
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["profile", "report", "--limit", "5"])
+    assert result.exit_code == 0, result.output
+    assert "== accounts.get_all_accounts: 1 requests" in result.output
+    result = runner.invoke(args=["profile", "clear"])
+    assert result.output.strip() == "Removed 1 profiles"
+    assert "accounts.get_all_accounts" not in runner.invoke(args=["profile", "report"]).output
@@ -0,0 +1,143 @@
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from extensions.extensions import db, jobs, stats_merger
+from models.account import Account
+from models.change_log import Tombstone
+from models.transaction import Transaction
+from models.user import User
+from utils import purge_utils
+from utils.purge_utils import purge, purge_transactions
+
+
+def remaining(app, model, **filters):
+    with app.app_context():
+        return db.session.scalars(db.select(model.id).filter_by(**filters)).all()
+
+
+@pytest.fixture
+def chunk_size(app, monkeypatch):
+    def chunk_size(size):
+        monkeypatch.setitem(app.config, "PURGE_CHUNK_SIZE", size)
+
+    return chunk_size
+
+
+def test_small_account_is_deleted_with_its_transactions(app, client, user):
+    response = client.delete("/accounts/2", headers=user)
+    assert response.status_code == 200
+    assert (remaining(app, Account, id=2), remaining(app, Transaction, account_id=2)) == ([], [])
+    with app.app_context():
+        tombstone = db.session.scalar(db.select(Tombstone).filter_by(entity="accounts", entity_id=2))
+        assert tombstone.user_id == 2
+
+
+def test_large_account_is_purged_in_the_background(app, client, user, chunk_size):
+    chunk_size(1)
+    response = client.delete("/accounts/2", headers=user)
+    assert (response.status_code, response.get_json()["message"]) == (202, "Account 'Credit' is being deleted")
+    jobs.shutdown()
+    assert (remaining(app, Account, id=2), remaining(app, Transaction, account_id=2)) == ([], [])
+    # Other accounts are left alone
+    assert remaining(app, Transaction) == [1, 4]
+
+
+def test_purge_commits_each_chunk(app):
+    commits = []
+
+    def committed(session):
+        commits.append(session)
+
+    with app.app_context():
+        event.listen(db.session, "after_commit", committed)
+        try:
+            assert purge_transactions(Account, 2, 1) == 2
+        finally:
+            event.remove(db.session, "after_commit", committed)
+    assert len(commits) == 2
+    # The account itself is only deleted by purge()
+    assert (remaining(app, Account, id=2), remaining(app, Transaction, account_id=2)) == ([2], [])
+
+
+def test_interrupted_purge_can_run_again(app):
+    with app.app_context():
+        purge_transactions(Account, 2, 1)
+        purge(Account, 2)
+        purge(Account, 2)
+        purge(Account, 999)
+    assert remaining(app, Account, id=2) == []
+
+
+def test_repeat_delete_does_not_start_another_purge(app, client, user, chunk_size, monkeypatch):
+    chunk_size(1)
+    release, calls = threading.Event(), []
+    original = purge_utils.purge_transactions
+
+    def blocked(*args):
+        calls.append(args)
+        release.wait(5)
+        return original(*args)
+
+    monkeypatch.setattr(purge_utils, "purge_transactions", blocked)
+    try:
+        assert [client.delete("/accounts/2", headers=user).status_code for _ in range(2)] == [202, 202]
+    finally:
+        release.set()
+        jobs.shutdown()
+    assert len(calls) == 1
+    assert remaining(app, Account, id=2) == []
+
+
+def test_overlapping_purges_update_the_statistics_once(app, client, auditor):
+    # The second purge deletes the rows the first has just selected, before the first deletes them
+    def purge_in_between(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("DELETE FROM transactions") and not overlapped.is_set():
+            overlapped.set()
+            thread = threading.Thread(target=purge_again)
+            thread.start()
+            thread.join()
+
+    def purge_again():
+        with app.app_context():
+            assert purge_transactions(Account, 2, 5000) == 2
+
+    overlapped = threading.Event()
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", purge_in_between)
+        try:
+            assert purge_transactions(Account, 2, 5000) == 0
+        finally:
+            event.remove(db.engine, "before_cursor_execute", purge_in_between)
+    assert overlapped.is_set()
+    stats = client.get("/accounts/2/amount_stats", headers=auditor).get_json()
+    assert stats["count"] == 0
+    stats_merger.merge()
+    # Only the Subscriptions transaction of account 1 is left
+    stats = client.get("/categories/1/amount_stats", headers=auditor).get_json()
+    assert stats["count"] == 1
+
+
+@pytest.mark.parametrize("size, status", [(5000, 200), (1, 202)])
+def test_user_is_deleted_with_their_accounts(app, client, admin, chunk_size, size, status):
+    chunk_size(size)
+    assert client.delete("/auth/2", headers=admin).status_code == status
+    jobs.shutdown()
+    assert remaining(app, User, id=2) == []
+    assert (remaining(app, Account, user_id=2), remaining(app, Transaction, account_id=2)) == ([], [])
+    assert remaining(app, Account) == [1, 3]
+
+
+@pytest.mark.parametrize(
+    "path, headers, status",
+    [
+        ("/accounts/1", "user", 403),
+        ("/accounts/999", "user", 404),
+        ("/auth/3", "user", 403),
+        ("/auth/999", "admin", 404),
+    ],
+)
+def test_deletes_are_authorized(app, client, request, path, headers, status):
+    assert client.delete(path, headers=request.getfixturevalue(headers)).status_code == status
+    assert remaining(app, Account) == [1, 2, 3]
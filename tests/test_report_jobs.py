@@ -0,0 +1,141 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from extensions.extensions import db, jobs
+from models.report_job import ReportJob
+from utils.report_jobs import JobCancelled, JobContext, run_report_job, sweep_report_jobs
+
+
+# Queue a report and wait for the job runner to finish it.
+def run_report(client, headers, report, params=None):
+    response = client.post("/reports/", json={"report": report, "params": params or {}}, headers=headers)
+    assert response.status_code == 202, response.get_json()
+    jobs.shutdown()
+    return response.get_json()["id"]
+
+
+# Save a job in a given state, as a process that stopped would have left it.
+def add_job(app, status, attempt=1, age=0, user_id=3, report="account_summary", params=None):
+    with app.app_context():
+        job = ReportJob(
+            report=report, params=params or {}, user_id=user_id, status=status, attempt=attempt,
+            date_heartbeat=datetime.utcnow() - timedelta(seconds=age),
+        )
+        db.session.add(job)
+        db.session.commit()
+        return job.id
+
+
+def get_job(app, job_id):
+    with app.app_context():
+        return db.session.get(ReportJob, job_id)
+
+
+def test_account_summary_report_matches_the_summary_endpoint(client, auditor):
+    job_id = run_report(client, auditor, "account_summary")
+    status = client.get(f"/reports/{job_id}", headers=auditor).get_json()
+    assert (status["status"], status["progress"]) == ("completed", 100)
+    result = client.get(f"/reports/{job_id}/result", headers=auditor)
+    assert result.status_code == 200
+    summary = client.get("/accounts/summary", headers=auditor).get_json()
+    assert [row["account_id"] for row in result.get_json()] == [row["account_id"] for row in summary] == [1, 2, 3]
+
+
+@pytest.mark.parametrize("report, params", [("search", {"query": "e"}), ("export", {})])
+def test_reports_only_return_the_users_transactions(client, user, report, params):
+    job_id = run_report(client, user, report, params)
+    rows = client.get(f"/reports/{job_id}/result", headers=user).get_json()
+    assert {row["id"] for row in rows} == {2, 3}
+
+
+def test_invalid_job_is_failed_with_its_error(app, client, user):
+    job_id = add_job(app, "queued", user_id=2, report="search")
+    with app.app_context():
+        run_report_job(job_id)
+    status = client.get(f"/reports/{job_id}", headers=user).get_json()
+    assert (status["status"], status["error"]) == ("failed", "Search term is required")
+
+
+@pytest.mark.parametrize(
+    "body, status",
+    [
+        ({"report": "account_summary"}, 403),
+        ({"report": "search", "params": {}}, 400),
+        ({"report": "unknown"}, 400),
+    ],
+)
+def test_report_requests_are_validated(client, user, body, status):
+    assert client.post("/reports/", json=body, headers=user).status_code == status
+
+
+def test_jobs_of_other_users_are_not_found(app, client, user):
+    job_id = add_job(app, "queued")
+    for response in (
+        client.get(f"/reports/{job_id}", headers=user),
+        client.get(f"/reports/{job_id}/result", headers=user),
+        client.delete(f"/reports/{job_id}", headers=user),
+    ):
+        assert response.status_code == 404
+    assert client.get("/reports/", headers=user).get_json() == []
+
+
+def test_result_of_an_unfinished_job_is_a_conflict(app, client, auditor):
+    job_id = add_job(app, "running")
+    response = client.get(f"/reports/{job_id}/result", headers=auditor)
+    assert response.status_code == 409
+    assert response.get_json()["error"] == "Report is running"
+
+
+def test_cancelled_job_is_not_started(app, client, auditor):
+    job_id = add_job(app, "queued")
+    response = client.delete(f"/reports/{job_id}", headers=auditor)
+    assert (response.status_code, response.get_json()["status"]) == (200, "cancelled")
+    assert client.delete(f"/reports/{job_id}", headers=auditor).status_code == 409
+    with app.app_context():
+        run_report_job(job_id)
+    assert get_job(app, job_id).status == "cancelled"
+
+
+def test_job_stops_when_it_was_restarted(app):
+    job_id = add_job(app, "running", attempt=2)
+    with app.app_context():
+        with pytest.raises(JobCancelled):
+            JobContext(job_id, attempt=1).progress(1, 10)
+        JobContext(job_id, attempt=2).progress(1, 10)
+    assert get_job(app, job_id).progress == 10
+
+
+def test_sweep_restarts_stale_jobs(app):
+    queued = add_job(app, "queued", age=600)
+    running = add_job(app, "running", age=600)
+    fresh = add_job(app, "running", age=0)
+    with app.app_context():
+        sweep_report_jobs()
+    jobs.shutdown()
+    assert (get_job(app, queued).status, get_job(app, queued).attempt) == ("completed", 1)
+    assert (get_job(app, running).status, get_job(app, running).attempt) == ("completed", 2)
+    assert get_job(app, fresh).status == "running"
+    with app.app_context():
+        result = json.loads(db.session.get(ReportJob, running).result)
+    assert len(result) == 3
+
+
+def test_sweep_fails_a_job_out_of_attempts(app):
+    job_id = add_job(app, "running", attempt=app.config["JOB_MAX_ATTEMPTS"], age=600)
+    with app.app_context():
+        sweep_report_jobs()
+    job = get_job(app, job_id)
+    assert (job.status, job.error) == ("failed", "Report stopped with its worker")
+    assert job.date_completed is not None
+
+
+def test_sweep_keeps_the_heartbeat_of_jobs_in_flight(app, monkeypatch):
+    job_id = add_job(app, "queued", age=600)
+    monkeypatch.setattr(jobs, "in_flight", lambda fn: [(job_id,)])
+    with app.app_context():
+        sweep_report_jobs()
+    job = get_job(app, job_id)
+    assert (job.status, job.attempt) == ("queued", 1)
+    assert datetime.utcnow() - job.date_heartbeat < timedelta(seconds=60)
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from sqlalchemy import func
+
+from commands.seed_generator import SyntheticDataGenerator, SYNTHETIC_CATEGORIES, zipf_weights
+from extensions.extensions import db
+from models.account import Account
+from models.amount_stats import AmountStats
+from models.category import Category
+from models.transaction import Transaction
+from models.user import User
+
+CATEGORY_IDS = {name: index for index, name in enumerate(SYNTHETIC_CATEGORIES, start=1)}
+START_IDS = {"users": 10, "accounts": [100], "transactions": [1000]}
+NOW = datetime(2024, 1, 1)
+
+
+def generated(seed):
+    generator = SyntheticDataGenerator(CATEGORY_IDS, "hash", START_IDS, seed=seed, now=NOW)
+    users = generator.user_rows(5)
+    accounts = generator.account_rows(users, 2)
+    return users, accounts, generator.transaction_rows(accounts, 10)
+
+
+def count(model):
+    return db.session.scalar(db.select(func.count()).select_from(model))
+
+
+def test_zipf_weights_favour_the_first_items():
+    weights = zipf_weights(5)
+    steps = [weights[0]] + [later - earlier for earlier, later in zip(weights, weights[1:])]
+    assert steps == sorted(steps, reverse=True)
+
+
+def test_same_seed_generates_the_same_rows():
+    assert generated(seed=7) == generated(seed=7)
+    assert generated(seed=7) != generated(seed=8)
+
+
+def test_generated_rows_have_consecutive_ids_and_consistent_balances():
+    users, accounts, transactions = generated(seed=1)
+    assert [user["id"] for user in users] == list(range(10, 15))
+    assert [account["id"] for account in accounts] == list(range(100, 110))
+    assert [transaction["id"] for transaction in transactions] == list(range(1000, 1100))
+    for transaction in transactions:
+        income = transaction["category_id"] == CATEGORY_IDS["Income"]
+        assert (transaction["amount"] > 0) == income or transaction["category_id"] is None
+
+
+def test_seed_command_writes_users_accounts_and_transactions(app):
+    runner = app.test_cli_runner()
+    runner.invoke(args=["db", "drop"])
+    runner.invoke(args=["db", "create"])
+    result = runner.invoke(
+        args=["db", "seed", "--users", "30", "--accounts-per-user", "2", "--transactions-per-account", "7", "--chunk-size", "20"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "Generated 30 users, 60 accounts and 420 transactions" in result.output
+    with app.app_context():
+        # The three example users and their three accounts and four transactions are kept
+        assert count(User) == 33
+        assert count(Account) == 63
+        assert count(Transaction) == 424
+        assert {name for name in SYNTHETIC_CATEGORIES} <= set(db.session.scalars(db.select(Category.name)))
+        # Bulk inserts skip the ORM events, the generator updates the amount statistics itself
+        assert db.session.scalar(
+            db.select(func.sum(AmountStats.count)).filter_by(scope="account")
+        ) == 424
+
@@ -0,0 +1,121 @@
+import pytest
+
+from extensions.extensions import db, shards
+from models.account import Account
+from models.category import Category
+from models.transaction import Transaction
+from models.user import User
+
+# Users are on shard user_id % 3: the admin (1) on shard 1, the user (2) on shard 2 and the auditor (3) on shard 0
+ADMIN_ACCOUNT, USER_ACCOUNT, AUDITOR_ACCOUNT = 100_000_001, 200_000_001, 1
+
+
+@pytest.fixture(scope="module")
+def app_env(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("shards")
+    return {"SHARD_DATABASE_URLS": ",".join(f"sqlite:///{directory / f'shard{index}.db'}" for index in (1, 2))}
+
+
+def ids_on(app, index, model, **filters):
+    with app.app_context(), shards.on(index):
+        return sorted(db.session.scalars(db.select(model.id).filter_by(**filters)))
+
+
+def test_accounts_live_on_the_shard_of_their_user(app):
+    assert shards.count == 3
+    assert [ids_on(app, index, Account) for index in range(3)] == [[AUDITOR_ACCOUNT], [ADMIN_ACCOUNT], [USER_ACCOUNT]]
+    assert len(ids_on(app, 2, Transaction)) == 2
+    # Users and categories are on every shard
+    for index in range(3):
+        assert (ids_on(app, index, User), ids_on(app, index, Category)) == ([1, 2, 3], [1, 2])
+
+
+def test_requests_are_routed_to_the_account_shard(client, user, admin):
+    assert [account["id"] for account in client.get("/accounts/", headers=user).get_json()] == [USER_ACCOUNT]
+    assert client.get(f"/accounts/{USER_ACCOUNT}", headers=user).status_code == 200
+    assert client.get(f"/accounts/{ADMIN_ACCOUNT}", headers=user).status_code == 403
+    # Ids past the last shard don't exist anywhere
+    assert client.get("/accounts/900000001", headers=user).status_code == 404
+    body = {"amount": -5, "description": "Coffee"}
+    assert client.post(f"/accounts/{USER_ACCOUNT}/transactions/", json=body, headers=admin).status_code == 201
+
+
+def test_new_accounts_take_ids_from_their_shard_range(app, client, user):
+    response = client.post("/accounts/", json={"account_type": "Extra", "balance": 5}, headers=user)
+    assert (response.status_code, response.get_json()["id"]) == (201, USER_ACCOUNT + 1)
+    assert ids_on(app, 2, Account) == [USER_ACCOUNT, USER_ACCOUNT + 1]
+
+
+def test_auditor_reads_are_gathered_from_every_shard(client, auditor):
+    accounts = client.get("/accounts/", headers=auditor).get_json()
+    assert sorted(account["id"] for account in accounts) == [AUDITOR_ACCOUNT, ADMIN_ACCOUNT, USER_ACCOUNT]
+    total = client.get("/accounts/total_balance", headers=auditor).get_json()
+    assert float(total["total_balance"]) == pytest.approx(1234.56 + 10000 + 9876.54)
+    summary = client.get("/accounts/summary", headers=auditor).get_json()
+    assert [row["account_id"] for row in summary] == [AUDITOR_ACCOUNT, ADMIN_ACCOUNT, USER_ACCOUNT]
+    found = client.post("/accounts/search", json={"query": "i"}, headers=auditor).get_json()
+    assert sorted(transaction["description"] for transaction in found) == ["Netflix", "Spotify", "Travel Insurance"]
+    stats = client.get("/categories/1/amount_stats", headers=auditor).get_json()
+    assert stats["count"] == 3
+
+
+def test_auditor_syncs_every_shard_with_a_cursor_per_shard(client, auditor, user):
+    cursor, accounts, categories = "0", [], []
+    while True:
+        page = client.get("/sync/", query_string={"cursor": cursor, "limit": 3}, headers=auditor).get_json()
+        assert len(page["cursor"].split(".")) == 3
+        cursor = page["cursor"]
+        accounts += [account["id"] for account in page["accounts"]]
+        categories += [category["id"] for category in page["categories"]]
+        if not page["has_more"]:
+            break
+    assert sorted(accounts) == [AUDITOR_ACCOUNT, ADMIN_ACCOUNT, USER_ACCOUNT]
+    # Categories are copied to every shard, but only synced once
+    assert sorted(categories) == [1, 2]
+    assert client.get("/sync/", query_string={"cursor": "1.2"}, headers=auditor).status_code == 400
+    # Other users sync their own shard with a single cursor
+    page = client.get("/sync/", headers=user).get_json()
+    assert ([account["id"] for account in page["accounts"]], "." in str(page["cursor"])) == ([USER_ACCOUNT], False)
+
+
+def test_new_users_are_copied_to_every_shard(app, client, login):
+    body = {"username": "New", "email": "new@email.com", "password": "123456"}
+    assert client.post("/auth/register", json=body).status_code == 201
+    for index in range(3):
+        assert ids_on(app, index, User) == [1, 2, 3, 4]
+    # User 4 lives on shard 1
+    response = client.post("/accounts/", json={"account_type": "First", "balance": 1}, headers=login("new@email.com"))
+    assert response.get_json()["id"] == ADMIN_ACCOUNT + 1
+
+
+def test_failed_copy_is_retried_without_failing_the_write(app, client, admin, monkeypatch):
+    retries = []
+    original = shards.on
+
+    def on(index):
+        if index == 2 and not retries:
+            raise ConnectionError("shard 2 is down")
+        return original(index)
+
+    class Timer:
+        def __init__(self, delay, fn, args):
+            retries.append((fn, args))
+
+        def start(self):
+            pass
+
+    monkeypatch.setattr(shards, "on", on)
+    monkeypatch.setattr("extensions.shards.threading.Timer", Timer)
+    assert client.patch("/categories/1", json={"name": "Streaming"}, headers=admin).status_code == 200
+    names = [ids_on(app, index, Category, name="Streaming") for index in range(3)]
+    assert names == [[1], [1], []]
+    fn, args = retries[0]
+    fn(*args)
+    assert ids_on(app, 2, Category, name="Streaming") == [1]
+
+
+def test_deleted_user_is_removed_from_their_shard(app, client, admin):
+    assert client.delete("/auth/2", headers=admin).status_code == 200
+    assert (ids_on(app, 2, Account), ids_on(app, 2, Transaction)) == ([], [])
+    for index in range(3):
+        assert ids_on(app, index, User) == [1, 3]
@@ -0,0 +1,54 @@
+import pytest
+
+from commands.startup_commands import parse_importtime
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 | early
+phase: startup
+import time:      1500 |       1500 |     flask.json
+import time:      2500 |       4000 |   flask
+phase: first request
+import time:       300 |        300 | msgpack
+import time: not a number | 1 | broken
+"""
+
+
+def test_importtime_output_is_split_by_phase():
+    # Imports before the first phase are the interpreter's own
+    assert parse_importtime(IMPORTTIME) == [
+        ("startup", "flask.json", 0.0015, 0.0015),
+        ("startup", "flask", 0.0025, 0.004),
+        ("first request", "msgpack", 0.0003, 0.0003),
+    ]
+
+
+# The cold starts run in new processes, which create the app from the environment like the tests do
+@pytest.fixture
+def cold_start_env(app, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", app.config["SQLALCHEMY_DATABASE_URI"])
+    monkeypatch.setenv("JWT_SECRET_KEY", app.config["JWT_SECRET_KEY"])
+    monkeypatch.setenv("SHARD_DATABASE_URLS", "")
+
+
+def test_startup_profile_reports_cold_starts(app, cold_start_env):
+    args = ["startup-profile", "--runs", "1", "--limit", "3", "--target-ms", "60000"]
+    result = app.test_cli_runner().invoke(args=args)
+    assert result.exit_code == 0, result.output
+    assert "Cold starts: GET /accounts/, median of 1 runs" in result.output
+    assert "Import time per package (ms)" in result.output
+    assert "within the 60000 ms target" in result.output
+
+
+@pytest.mark.parametrize(
+    "args, output",
+    [
+        (["--target-ms", "1"], "over the 1 ms target"),
+        (["--email", ""], "GET /accounts/ returned 401"),
+        (["--email", "nobody@email.com"], "No user with email nobody@email.com"),
+    ],
+)
+def test_startup_profile_fails(app, cold_start_env, args, output):
+    result = app.test_cli_runner().invoke(args=["startup-profile", "--runs", "1", *args])
+    assert result.exit_code != 0
+    assert output in result.output
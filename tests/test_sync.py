@@ -0,0 +1,85 @@
+import pytest
+
+from extensions.extensions import db
+from models.change_log import ChangeCounter
+from models.transaction import Transaction
+
+
+def sync(client, headers, cursor=0, **query):
+    response = client.get("/sync/", query_string={"cursor": cursor, **query}, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def ids(rows):
+    return sorted(row["id"] for row in rows)
+
+
+def test_first_sync_returns_everything_the_user_can_see(client, user, auditor):
+    page = sync(client, user)
+    assert (ids(page["accounts"]), ids(page["transactions"]), len(page["categories"])) == ([2], [2, 3], 2)
+    assert page["has_more"] is False and page["cursor"] > 0
+    page = sync(client, auditor)
+    assert (ids(page["accounts"]), ids(page["transactions"])) == ([1, 2, 3], [1, 2, 3, 4])
+
+
+def test_pages_follow_the_cursor_to_the_end(client, auditor):
+    everything = sync(client, auditor)
+    cursor, pages, seen = 0, 0, {"accounts": [], "transactions": [], "categories": []}
+    while True:
+        page = sync(client, auditor, cursor, limit=2)
+        assert page["cursor"] > cursor
+        cursor, pages = page["cursor"], pages + 1
+        for kind in seen:
+            seen[kind] += page[kind]
+        if not page["has_more"]:
+            break
+    assert pages == 5
+    assert cursor == everything["cursor"]
+    for kind in seen:
+        assert ids(seen[kind]) == ids(everything[kind])
+
+
+def test_next_sync_only_returns_new_changes(client, user, admin, auditor):
+    cursor = sync(client, user)["cursor"]
+    empty = sync(client, user, cursor)
+    assert (empty["accounts"], empty["transactions"], empty["has_more"]) == ([], [], False)
+    # Without changes of its own, the user's cursor skips the other users' changes up to the watermark
+    assert empty["cursor"] == sync(client, auditor)["cursor"] > cursor
+
+    client.post("/accounts/2/transactions/", json={"amount": -5, "description": "Coffee"}, headers=user)
+    client.delete("/accounts/2/transactions/3", headers=admin)
+    page = sync(client, user, cursor)
+    # The post changed the account balance too
+    assert (ids(page["accounts"]), [row["description"] for row in page["transactions"]]) == ([2], ["Coffee"])
+    assert page["deleted"] == {"accounts": [], "transactions": [3], "categories": []}
+
+
+def test_deletions_are_only_sent_to_their_owner(client, user, admin, auditor):
+    cursors = {name: sync(client, headers)["cursor"] for name, headers in (("user", user), ("auditor", auditor))}
+    client.delete("/accounts/1/transactions/1", headers=admin)
+    assert sync(client, user, cursors["user"])["deleted"]["transactions"] == []
+    assert sync(client, auditor, cursors["auditor"])["deleted"]["transactions"] == [1]
+
+
+def test_sync_stops_at_the_watermark(app, client, user, auditor):
+    cursor = sync(client, auditor)["cursor"]
+    # A change numbered past the watermark, as if its transaction hadn't committed yet
+    with app.app_context():
+        db.session.execute(db.update(Transaction).filter_by(id=2).values(change_seq=cursor + 2))
+        db.session.commit()
+    page = sync(client, user, cursor)
+    assert (page["transactions"], page["cursor"]) == ([], cursor)
+    with app.app_context():
+        db.session.execute(db.update(ChangeCounter).filter_by(id=1).values(value=cursor + 2))
+        db.session.commit()
+    page = sync(client, user, cursor)
+    assert (ids(page["transactions"]), page["cursor"]) == ([2], cursor + 2)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [{"cursor": "abc"}, {"limit": "x"}, {"cursor": -1}, {"limit": 0}, {"cursor": "1.2"}],
+)
+def test_invalid_cursors_are_rejected(client, user, query):
+    assert client.get("/sync/", query_string=query, headers=user).status_code == 400
@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from app import reset_after_fork, resized_pool
+from extensions.extensions import db
+
+
+def test_resized_pool_keeps_the_pool_settings(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=QueuePool, pool_size=5, max_overflow=3)
+    pool = resized_pool(engine.pool, 8)
+    assert isinstance(pool, QueuePool)
+    assert (pool.size(), pool._max_overflow, pool._creator) == (8, 3, engine.pool._creator)
+    engine.pool = pool
+    with engine.connect() as connection:
+        assert connection.execute(text("select 1")).scalar() == 1
+
+
+def test_resized_pool_leaves_other_pools_alone():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    assert resized_pool(engine.pool, 8) is engine.pool
+    engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=4)
+    assert resized_pool(engine.pool, 4) is engine.pool
+
+
+@pytest.mark.parametrize("pool_size_env, expected", [(None, 7), ("5", 5)])
+def test_workers_get_one_connection_per_thread(app, client, user, monkeypatch, pool_size_env, expected):
+    if pool_size_env:
+        monkeypatch.setenv("DB_POOL_SIZE", pool_size_env)
+    else:
+        monkeypatch.delenv("DB_POOL_SIZE", raising=False)
+    with app.app_context():
+        db.engine.pool = resized_pool(db.engine.pool, 5)
+    reset_after_fork(app, workers=1, threads=7)
+    # The worker starts with an empty pool of its own
+    with app.app_context():
+        assert (db.engine.pool.size(), db.engine.pool.checkedout()) == (expected, 0)
+    assert client.get("/accounts/", headers=user).status_code == 200
@@ -0,0 +1,95 @@
+import math
+from decimal import Decimal
+
+# Amounts are counted in logarithmic bins (the DDSketch approach), so any percentile read back from the
+# bins is within RELATIVE_ERROR of the true value. Bins only hold counts, so sketches merge by adding
+# them up and a removed amount is subtracted again, which a t-digest can't do.
+RELATIVE_ERROR = 0.01
+GAMMA = (1 + RELATIVE_ERROR) / (1 - RELATIVE_ERROR)
+LOG_GAMMA = math.log(GAMMA)
+# Keeps the bins of positive amounts above 0 and those of negative amounts below it, so ordering the
+# bins orders the amounts. The smallest amount, 0.01, has a log index of about -230.
+BIN_OFFSET = 1000
+
+
+def bin_of(amount):
+    amount = float(amount)
+    if amount == 0:
+        return 0
+    index = math.ceil(math.log(abs(amount)) / LOG_GAMMA) + BIN_OFFSET
+    return index if amount > 0 else -index
+
+
+# The value a bin stands for, within RELATIVE_ERROR of every amount counted in it.
+def value_of(bin):
+    if bin == 0:
+        return 0.0
+    value = 2 * GAMMA ** (abs(bin) - BIN_OFFSET) / (GAMMA + 1)
+    return value if bin > 0 else -value
+
+
+def to_amount(value):
+    return str(Decimal(str(value)).quantize(Decimal("0.01")))
+
+
+# The count, sum, min, max and bins of a set of amounts, kept in memory.
+# Sketches are built up from single amounts or whole chunks, then added to the stored ones.
+class AmountSketch:
+    def __init__(self):
+        self.count = 0
+        self.total = Decimal("0")
+        self.min_amount = None
+        self.max_amount = None
+        self.bins = {}
+
+    def add(self, amount):
+        amount = Decimal(str(amount))
+        self.count += 1
+        self.total += amount
+        if self.min_amount is None or amount < self.min_amount:
+            self.min_amount = amount
+        if self.max_amount is None or amount > self.max_amount:
+            self.max_amount = amount
+        bin = bin_of(amount)
+        self.bins[bin] = self.bins.get(bin, 0) + 1
+
+
+# Percentile, histogram and outlier estimates from stored bins, a list of (bin, count) in bin order.
+# Bins are bounded to a few thousand however many amounts were counted, so this doesn't grow with the data.
+def quantile(bins, count, q):
+    if count <= 0:
+        return None
+    rank = q * (count - 1)
+    seen = 0
+    for bin, bin_count in bins:
+        seen += bin_count
+        if seen > rank:
+            return value_of(bin)
+    return value_of(bins[-1][0])
+
+
+# Counts per order of magnitude, e.g. -100 to -10, -10 to 0, 0 to 10 and 10 to 100.
+def histogram(bins):
+    buckets = {}
+    for bin, bin_count in bins:
+        value = value_of(bin)
+        if value == 0:
+            low = high = 0
+        else:
+            magnitude = 10 ** max(0, math.floor(math.log10(abs(value))))
+            low, high = (magnitude if magnitude > 1 else 0), magnitude * 10
+            if value < 0:
+                low, high = -high, -low
+        buckets[(low, high)] = buckets.get((low, high), 0) + bin_count
+    return [{"from": low, "to": high, "count": bucket_count} for (low, high), bucket_count in sorted(buckets.items())]
+
+
+# Amounts outside Tukey's fences, more than 1.5 interquartile ranges below the 25th or above the 75th percentile.
+def outliers(bins, count):
+    if count <= 0:
+        return {"low": 0, "high": 0}
+    p25, p75 = quantile(bins, count, 0.25), quantile(bins, count, 0.75)
+    spread = 1.5 * (p75 - p25)
+    low = sum(bin_count for bin, bin_count in bins if value_of(bin) < p25 - spread)
+    high = sum(bin_count for bin, bin_count in bins if value_of(bin) > p75 + spread)
+    return {"low": low, "high": high}
@@ -3,8 +3,11 @@ from flask import jsonify
 import functools
 
 from models.user import User
+from models.account import Account
 
-from flask_jwt_extended import get_jwt_identity
+from flask_jwt_extended import get_jwt_identity, decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import ExpiredSignatureError, InvalidTokenError
 
 
 # Check if the current user has one of the specified roles.
@@ -19,6 +22,27 @@ def is_user_in_role(roles):
     return user.role in roles if user else False
 
 
+# Load an account along with whether the current user may act on it, in a single query.
+# The current user's row is joined in, so their role is checked by the same SELECT.
+def authorized_account(account_id, roles):
+    # Parameters:
+    # - account_id: the id of the account to load.
+    # - roles: roles allowed to act on accounts they don't own.
+    user_id = get_jwt_identity()
+    allowed = db.or_(Account.user_id == user_id, User.role.in_(roles))
+    stmt = (
+        db.select(Account, allowed.label("allowed"))
+        .outerjoin(User, User.id == user_id)
+        .filter(Account.id == account_id)
+    )
+    row = db.session.execute(stmt).first()
+    # Returns:
+    # - (account, allowed), or (None, False) if the account doesn't exist.
+    if row is None:
+        return None, False
+    return row.Account, bool(row.allowed)
+
+
 def role_required(roles):
     def decorator(fn):
         @functools.wraps(fn)
@@ -37,3 +61,31 @@ def role_required(roles):
         return wrapper
 
     return decorator
+
+
+# Async version of is_user_in_role, for the async views which can't use the Flask session.
+async def async_is_user_in_role(session, user_id, roles):
+    # Parameters:
+    # - session: the AsyncSession of the current request.
+    # - user_id: the identity from the request's JWT.
+    # - roles: a list or tuple of roles to check against the user's role.
+    stmt = db.select(User.role).filter_by(id=user_id)
+    role = await session.scalar(stmt)
+    return role in roles if role else False
+
+
+# Read and verify the JWT of an async request, using the same settings as flask_jwt_extended.
+# Must be called inside the Flask app context.
+def jwt_identity_from_headers(headers):
+    # Returns:
+    # - (identity, None) for a valid token, otherwise (None, (error body, status code)).
+    auth_header = headers.get("authorization", "")
+    if not auth_header.startswith("Bearer "):
+        return None, ({"msg": "Missing Authorization Header"}, 401)
+    try:
+        decoded = decode_token(auth_header[len("Bearer "):])
+    except ExpiredSignatureError:
+        return None, ({"msg": "Token has expired"}, 401)
+    except (InvalidTokenError, JWTExtendedException) as err:
+        return None, ({"msg": str(err)}, 422)
+    return decoded["sub"], None
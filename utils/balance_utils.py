@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from extensions.extensions import db
+
+from models.account import Account
+from models.transaction import Transaction
+from models.balance_snapshot import BalanceSnapshot
+
+
+# Truncate a date to the start of its bucket, used to downsample a balance history.
+BUCKETS = {
+    "hour": lambda date: date.replace(minute=0, second=0, microsecond=0),
+    "day": lambda date: date.replace(hour=0, minute=0, second=0, microsecond=0),
+    "week": lambda date: (date - timedelta(days=date.weekday())).replace(hour=0, minute=0, second=0, microsecond=0),
+    "month": lambda date: date.replace(day=1, hour=0, minute=0, second=0, microsecond=0),
+}
+
+
+# Parse an ISO 8601 date into the naive UTC datetimes stored in the database.
+def parse_date(value):
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def sum_amounts(account_id, after, until=None):
+    # Sum of the account's transactions dated after `after`, up to and including `until`.
+    stmt = db.select(func.coalesce(func.sum(Transaction.amount), 0)).filter(
+        Transaction.account_id == account_id, Transaction.transaction_date > after
+    )
+    if until is not None:
+        stmt = stmt.filter(Transaction.transaction_date <= until)
+    return Decimal(db.session.scalar(stmt))
+
+
+# The balance of an account at a point in time.
+def balance_at(account, at):
+    # Returns:
+    # - the balance as a Decimal, or None if the account didn't exist yet.
+    if account.date_created and at < account.date_created:
+        return None
+    # Start from the latest snapshot before the date, and add the transactions made since it
+    stmt = (
+        db.select(BalanceSnapshot)
+        .filter(BalanceSnapshot.account_id == account.id, BalanceSnapshot.snapshot_date <= at)
+        .order_by(BalanceSnapshot.snapshot_date.desc())
+        .limit(1)
+    )
+    snapshot = db.session.scalar(stmt)
+    if snapshot:
+        return Decimal(snapshot.balance) + sum_amounts(account.id, snapshot.snapshot_date, at)
+    # Without an earlier snapshot, work back from the first snapshot after the date
+    stmt = (
+        db.select(BalanceSnapshot)
+        .filter(BalanceSnapshot.account_id == account.id, BalanceSnapshot.snapshot_date > at)
+        .order_by(BalanceSnapshot.snapshot_date)
+        .limit(1)
+    )
+    snapshot = db.session.scalar(stmt)
+    if snapshot:
+        return Decimal(snapshot.balance) - sum_amounts(account.id, at, snapshot.snapshot_date)
+    # The account has no snapshots yet, so work back from its current balance
+    return Decimal(account.balance) - sum_amounts(account.id, at)
+
+
+# The balance of an account after each transaction between start and end,
+# optionally downsampled to the closing balance of each hour, day, week or month.
+def balance_history(account, start, end, bucket=None):
+    balance = balance_at(account, start)
+    points = [{"date": start, "balance": balance}]
+    # The account was opened inside the range, so the history starts from its opening balance
+    if balance is None and account.date_created <= end:
+        start = account.date_created
+        balance = balance_at(account, start)
+        points.append({"date": start, "balance": balance})
+
+    stmt = (
+        db.select(Transaction.transaction_date, Transaction.amount)
+        .filter(
+            Transaction.account_id == account.id,
+            Transaction.transaction_date > start,
+            Transaction.transaction_date <= end,
+        )
+        .order_by(Transaction.transaction_date, Transaction.id)
+    )
+    # Snapshots in the range reset the running balance, which picks up balances that were set directly
+    snapshots = db.session.execute(
+        db.select(BalanceSnapshot.snapshot_date, BalanceSnapshot.balance)
+        .filter(
+            BalanceSnapshot.account_id == account.id,
+            BalanceSnapshot.snapshot_date > start,
+            BalanceSnapshot.snapshot_date <= end,
+        )
+        .order_by(BalanceSnapshot.snapshot_date)
+    ).all()
+
+    def apply_snapshots(before):
+        nonlocal balance
+        # A snapshot includes every transaction dated up to and including it
+        while snapshots and (before is None or snapshots[0].snapshot_date < before):
+            snapshot = snapshots.pop(0)
+            if snapshot.balance != balance:
+                balance = snapshot.balance
+                points.append({"date": snapshot.snapshot_date, "balance": balance})
+
+    for transaction_date, amount in db.session.execute(stmt):
+        apply_snapshots(transaction_date)
+        balance += amount
+        points.append({"date": transaction_date, "balance": balance})
+    apply_snapshots(None)
+
+    if bucket:
+        truncate = BUCKETS[bucket]
+        closing = {}
+        # Later points overwrite earlier ones, leaving the closing balance of each bucket
+        for point in points:
+            closing[truncate(point["date"])] = point["balance"]
+        points = [{"date": date, "balance": balance} for date, balance in closing.items()]
+
+    return [
+        {
+            "date": point["date"].isoformat(),
+            "balance": None if point["balance"] is None else str(point["balance"]),
+        }
+        for point in points
+    ]
+
+
+# Snapshot the balance of every account with at least `min_transactions` transactions since its last snapshot.
+# The snapshot is taken a little in the past, so transactions still being committed aren't missed.
+def create_snapshots(min_transactions=1, grace=timedelta(minutes=1)):
+    as_of = datetime.utcnow() - grace
+    last_snapshot = (
+        db.select(func.max(BalanceSnapshot.snapshot_date))
+        .filter(BalanceSnapshot.account_id == Account.id)
+        .scalar_subquery()
+    )
+    since_snapshot = (
+        db.select(func.count(Transaction.id))
+        .filter(
+            Transaction.account_id == Account.id,
+            Transaction.transaction_date > func.coalesce(last_snapshot, Account.date_created),
+            Transaction.transaction_date <= as_of,
+        )
+        .scalar_subquery()
+    )
+    after_as_of = (
+        db.select(func.coalesce(func.sum(Transaction.amount), 0))
+        .filter(Transaction.account_id == Account.id, Transaction.transaction_date > as_of)
+        .scalar_subquery()
+    )
+    stmt = db.insert(BalanceSnapshot).from_select(
+        ["account_id", "balance", "snapshot_date"],
+        db.select(Account.id, Account.balance - after_as_of, db.literal(as_of, db.DateTime))
+        .filter(Account.date_created <= as_of)
+        .filter(since_snapshot >= min_transactions),
+    )
+    created = db.session.execute(stmt).rowcount
+    db.session.commit()
+    return created
+
+
+# Record a snapshot when an account's balance is set directly rather than through a transaction,
+# so histories before and after the change both stay correct.
+def snapshot_adjustment(account, old_balance):
+    now = datetime.utcnow()
+    db.session.add_all(
+        [
+            BalanceSnapshot(account_id=account.id, balance=old_balance, snapshot_date=now - timedelta(microseconds=1)),
+            BalanceSnapshot(account_id=account.id, balance=account.balance, snapshot_date=now),
+        ]
+    )
@@ -1,6 +1,7 @@
-import bleach
-
 def sanitize_input(input_string):
+    # Imported on first use, as bleach is slow to import and only needed when a request body is loaded
+    import bleach
+
     # Use bleach to remove any harmful HTML tags
     sanitized_input = bleach.clean(input_string, strip=True)
     
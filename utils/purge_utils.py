@@ -0,0 +1,124 @@
+import threading
+
+from flask import current_app
+from sqlalchemy import func
+
+from extensions.extensions import db, cache, change_feed, jobs, shards
+from extensions.change_feed import account_deleted_event
+
+from models.user import User
+from models.account import Account
+from models.transaction import Transaction
+from models.change_log import add_tombstones
+from models.amount_stats import buffer_category_amounts, forget_transactions, remove_sketches, sketches_of
+
+
+# The ids of the transactions belonging to a user or an account.
+def owned_transactions(model, owner_id):
+    stmt = db.select(Transaction.id)
+    if model is User:
+        return stmt.join(Account).filter(Account.user_id == owner_id)
+    return stmt.filter(Transaction.account_id == owner_id)
+
+
+# The shard holding the accounts and transactions of a user or an account
+def owner_shard(model, owner_id):
+    return shards.for_user(owner_id) if model is User else shards.for_account(owner_id)
+
+
+def count_over_chunk(model, owner_id, chunk_size):
+    limited = owned_transactions(model, owner_id).limit(chunk_size + 1).subquery()
+    return db.session.scalar(db.select(func.count()).select_from(limited)) > chunk_size
+
+
+# Owners with more transactions than fit in one chunk are purged in the background, as are owners
+# already being purged so a repeat delete waits for that purge. Only counts up to the chunk size,
+# so large owners don't need a full count.
+def needs_background_purge(owner):
+    chunk_size = int(current_app.config["PURGE_CHUNK_SIZE"])
+    if purging(owner):
+        return True
+    return shards.call(owner_shard(type(owner), owner.id), count_over_chunk, type(owner), owner.id, chunk_size)
+
+
+# Delete a user's accounts, recording what the cascade removes without the ORM seeing it.
+def delete_accounts(user_id):
+    account_ids = db.session.scalars(db.select(Account.id).filter_by(user_id=user_id)).all()
+    add_tombstones(db.session.connection(), [("accounts", account_id, user_id) for account_id in account_ids])
+    tags = {"total_balance", "account_summary"}
+    tags.update(f"transaction_ranks:{account_id}" for account_id in account_ids)
+    cache.invalidate_session(db.session, tags)
+    change_feed.queue(db.session, [account_deleted_event(account_id) for account_id in account_ids])
+    # A bulk delete skips the Account events, so take the transactions out of the statistics here
+    forget_transactions(db.session.connection(), account_ids)
+    # The database cascades it to the transactions
+    db.session.execute(db.delete(Account).where(Account.user_id == user_id), execution_options={"synchronize_session": False})
+
+
+# Delete a user or account in a single statement, the database cascades it to the accounts and transactions.
+def delete_owner(owner):
+    if isinstance(owner, User):
+        shard = owner_shard(User, owner.id)
+        if shard == shards.current():
+            delete_accounts(owner.id)
+        else:
+            # Users are deleted on shard 0 and their accounts live on their own shard, delete those first
+            with shards.on(shard):
+                delete_accounts(owner.id)
+                db.session.commit()
+    db.session.delete(owner)
+
+
+# Delete chunks of the owner's transactions, committing after each, and return how many were deleted.
+def purge_transactions(model, owner_id, chunk_size):
+    deleted = 0
+    while True:
+        rows = db.session.execute(owned_transactions(model, owner_id).limit(chunk_size)).all()
+        if not rows:
+            return deleted
+        # Only the rows this statement deleted, another purge or a delete through the ORM may have taken the rest
+        deleted_rows = db.session.execute(
+            db.delete(Transaction)
+            .where(Transaction.id.in_([row.id for row in rows]))
+            .returning(Transaction.account_id, Transaction.category_id, Transaction.amount),
+            execution_options={"synchronize_session": False},
+        ).all()
+        # Bulk deletes skip the ORM events, so update the amount statistics and the cached reports here
+        amounts = [(row.account_id, row.category_id, row.amount) for row in deleted_rows]
+        remove_sketches(db.session.connection(), sketches_of(amounts, scopes=("account",)))
+        # Some of these amounts may still be waiting to be added to their category, so wait behind them
+        buffer_category_amounts(db.session.connection(), amounts, -1)
+        tags = {"account_summary"}
+        tags.update(f"transaction_ranks:{account_id}" for account_id in {row.account_id for row in deleted_rows})
+        cache.invalidate_session(db.session, tags)
+        db.session.commit()
+        deleted += len(deleted_rows)
+
+
+# Delete the owner's transactions chunk by chunk, committing after each so no transaction holds
+# locks or memory for long, then delete the owner itself. Safe to run again if interrupted.
+def purge(model, owner_id):
+    chunk_size = int(current_app.config["PURGE_CHUNK_SIZE"])
+    if db.session.get(model, owner_id) is None:
+        return
+    deleted = shards.call(owner_shard(model, owner_id), purge_transactions, model, owner_id, chunk_size)
+    owner = db.session.get(model, owner_id)
+    if owner is not None:
+        delete_owner(owner)
+        db.session.commit()
+    current_app.logger.info("Purged %s %s and %d transactions", model.__tablename__, owner_id, deleted)
+
+
+# Whether a purge of the owner is queued or running in this process
+def purging(owner):
+    return (type(owner), owner.id) in jobs.in_flight(purge)
+
+
+# Checked and submitted under one lock, so two deletes of the same owner queue a single purge
+purge_lock = threading.Lock()
+
+
+def start_purge(owner):
+    with purge_lock:
+        if not purging(owner):
+            jobs.submit(purge, type(owner), owner.id)
@@ -0,0 +1,274 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+
+from extensions.extensions import db, jobs, shards
+
+from models.user import User
+from models.account import Account
+from models.transaction import Transaction, transactions_schema
+from models.report_job import ReportJob
+
+# Rows read per query, progress is saved and cancellation checked between chunks
+CHUNK_SIZE = 1000
+
+
+# Raised to stop a job that was cancelled, or restarted by another process (see sweep_report_jobs)
+class JobCancelled(Exception):
+    pass
+
+
+# Passed to the report functions, to save progress and stop early when the job is cancelled.
+class JobContext:
+    def __init__(self, job_id, attempt=1):
+        self.job_id = job_id
+        self.attempt = attempt
+        # Reports may read other shards, the job itself is saved on the shard it was created on
+        self.shard = shards.current()
+
+    def progress(self, done, total):
+        shards.call(self.shard, self.save_progress, done, total)
+
+    def save_progress(self, done, total):
+        # Raises JobCancelled if the job was cancelled or restarted since the last chunk
+        job = db.session.execute(
+            db.select(ReportJob.status, ReportJob.attempt).filter_by(id=self.job_id)
+        ).first()
+        if job is None or job.status == "cancelled" or job.attempt != self.attempt:
+            raise JobCancelled()
+        percent = min(99, int(done * 100 / total)) if total else 0
+        db.session.execute(
+            db.update(ReportJob)
+            .filter_by(id=self.job_id)
+            .values(progress=percent, date_heartbeat=datetime.utcnow())
+        )
+        db.session.commit()
+
+
+def count_accounts():
+    return db.session.scalar(db.select(func.count(Account.id)))
+
+
+# Total amount spent per account, the same result as GET /accounts/summary.
+def account_summary_report(context, user, params):
+    total = sum(shards.scatter(count_accounts))
+    results = []
+    done = 0
+    # Each shard holds its own range of account ids, so going through them in order keeps the id order
+    for index in range(shards.count):
+        done = shards.call(index, summarise_accounts, context, results, done, total)
+    return results
+
+
+# Add the summary of the current shard's accounts to results, returning the accounts done so far.
+def summarise_accounts(context, results, done, total):
+    last_id = 0
+    # Walk the accounts in id order, one chunk at a time
+    while True:
+        account_ids = db.session.scalars(
+            db.select(Account.id).filter(Account.id > last_id).order_by(Account.id).limit(CHUNK_SIZE)
+        ).all()
+        if not account_ids:
+            break
+        rows = db.session.execute(
+            db.select(Account.id, Account.account_type, func.sum(Transaction.amount).label("total_spent"))
+            .join(Transaction)
+            .filter(Account.id.between(account_ids[0], account_ids[-1]))
+            .group_by(Account.id, Account.account_type)
+            .order_by(Account.id)
+        )
+        results.extend(
+            {"account_id": row.id, "account_type": row.account_type, "total_spent": str(row.total_spent)}
+            for row in rows
+        )
+        done += len(account_ids)
+        last_id = account_ids[-1]
+        context.progress(done, total)
+    return done
+
+
+# Transactions visible to the user filtered by the "query" and optional "account_id" params.
+def visible_transactions(user, params):
+    stmt = db.select(Transaction).join(Account)
+    if params.get("query"):
+        stmt = stmt.filter(Transaction.description.ilike(f"%{params['query']}%"))
+    if params.get("account_id"):
+        stmt = stmt.filter(Transaction.account_id == int(params["account_id"]))
+    # Auditors see all transactions, other users only the transactions of their own accounts
+    if user.role != "Auditor":
+        stmt = stmt.filter(Account.user_id == user.id)
+    return stmt
+
+
+# The shards holding the transactions visible to the user
+def visible_shards(user, params):
+    if params.get("account_id"):
+        return [shards.for_account(params["account_id"])]
+    if user.role == "Auditor":
+        return list(range(shards.count))
+    return [shards.for_user(user.id)]
+
+
+def count_rows(stmt):
+    return db.session.scalar(db.select(func.count()).select_from(stmt.subquery()))
+
+
+# Yield the transactions of stmt in chunks, from each of the shards in turn.
+def chunked(context, stmt, indexes):
+    total = sum(shards.call(index, count_rows, stmt) for index in indexes)
+    done = 0
+    for index in indexes:
+        with shards.switch(index):
+            last_id = 0
+            while True:
+                chunk = db.session.scalars(
+                    stmt.filter(Transaction.id > last_id).order_by(Transaction.id).limit(CHUNK_SIZE)
+                ).all()
+                if not chunk:
+                    break
+                yield chunk
+                done += len(chunk)
+                last_id = chunk[-1].id
+                context.progress(done, total)
+                # The chunk has been serialised, drop it from the session to keep memory flat
+                db.session.expunge_all()
+
+
+# Transactions matching a description term, the same result as POST /accounts/search.
+def search_report(context, user, params):
+    if not params.get("query"):
+        raise ValueError("Search term is required")
+    # Load the nested account, user and category of each chunk up front, instead of one query per transaction
+    stmt = visible_transactions(user, params).options(
+        selectinload(Transaction.account).selectinload(Account.user),
+        selectinload(Transaction.category),
+    )
+    results = []
+    for chunk in chunked(context, stmt, visible_shards(user, params)):
+        results.extend(transactions_schema.dump(chunk))
+    return results
+
+
+# Every visible transaction as flat rows, for spreadsheets and other tools.
+def export_report(context, user, params):
+    results = []
+    for chunk in chunked(context, visible_transactions(user, params), visible_shards(user, params)):
+        results.extend(
+            {
+                "id": transaction.id,
+                "account_id": transaction.account_id,
+                "category_id": transaction.category_id,
+                "amount": str(transaction.amount),
+                "description": transaction.description,
+                "transaction_date": transaction.transaction_date.isoformat() if transaction.transaction_date else None,
+            }
+            for transaction in chunk
+        )
+    return results
+
+
+REPORTS = {
+    "account_summary": account_summary_report,
+    "search": search_report,
+    "export": export_report,
+}
+
+# Reports that only some roles may request
+REPORT_ROLES = {
+    "account_summary": ["Auditor"],
+}
+
+
+def finish_job(job_id, attempt, **values):
+    db.session.rollback()
+    # Don't overwrite a cancellation that happened while the report was running, or a restart of the job
+    db.session.execute(
+        db.update(ReportJob)
+        .filter(ReportJob.id == job_id, ReportJob.status != "cancelled", ReportJob.attempt == attempt)
+        .values(date_completed=datetime.utcnow(), **values)
+    )
+    db.session.commit()
+
+
+# Runs on a worker thread of the job runner.
+def run_report_job(job_id):
+    # Only start jobs that are still queued, they may have been cancelled before a worker picked them up
+    started = db.session.execute(
+        db.update(ReportJob)
+        .filter_by(id=job_id, status="queued")
+        .values(status="running", date_heartbeat=datetime.utcnow())
+    )
+    db.session.commit()
+    if started.rowcount != 1:
+        return
+
+    job = db.session.get(ReportJob, job_id)
+    user = db.session.get(User, job.user_id)
+    report, params, attempt = job.report, job.params or {}, job.attempt
+    try:
+        if user is None:
+            raise ValueError("User no longer exists")
+        result = REPORTS[report](JobContext(job_id, attempt), user, params)
+    except JobCancelled:
+        return
+    except ValueError as err:
+        finish_job(job_id, attempt, status="failed", error=str(err)[:255])
+        return
+    except Exception:
+        finish_job(job_id, attempt, status="failed", error="Internal Server Error")
+        raise
+    finish_job(
+        job_id, attempt, status="completed", progress=100,
+        result=current_app.json.dumps(result, separators=(",", ":")),
+    )
+
+
+# Jobs only live in the process that enqueued them, so a worker restart or crash would leave its jobs
+# queued or running forever. Every process keeps the heartbeat of its own jobs recent, and requeues
+# the jobs whose heartbeat is older than JOB_STALE_AFTER seconds. A running job is restarted up to
+# JOB_MAX_ATTEMPTS times in all, then marked failed. Runs on every shard (see JobRunner.periodic).
+def sweep_report_jobs():
+    job_ids = [args[0] for args in jobs.in_flight(run_report_job)]
+    if job_ids:
+        db.session.execute(
+            db.update(ReportJob)
+            .filter(ReportJob.id.in_(job_ids), ReportJob.status.in_(("queued", "running")))
+            .values(date_heartbeat=datetime.utcnow())
+        )
+        db.session.commit()
+
+    stale_before = datetime.utcnow() - timedelta(seconds=float(current_app.config["JOB_STALE_AFTER"]))
+    stale = db.session.execute(
+        db.select(ReportJob.id, ReportJob.status, ReportJob.attempt, ReportJob.date_heartbeat).filter(
+            ReportJob.status.in_(("queued", "running")), ReportJob.date_heartbeat < stale_before
+        )
+    ).all()
+    for job in stale:
+        if job.status == "running" and job.attempt >= int(current_app.config["JOB_MAX_ATTEMPTS"]):
+            values = {"status": "failed", "error": "Report stopped with its worker", "date_completed": datetime.utcnow()}
+        else:
+            values = {"status": "queued", "progress": 0, "date_heartbeat": datetime.utcnow()}
+            if job.status == "running":
+                values["attempt"] = job.attempt + 1
+        # Only one process takes over a job, the first to update it
+        taken = db.session.execute(
+            db.update(ReportJob)
+            .filter_by(id=job.id, status=job.status, date_heartbeat=job.date_heartbeat)
+            .values(**values)
+        )
+        db.session.commit()
+        if taken.rowcount == 1 and values["status"] == "queued":
+            current_app.logger.warning("Requeued report job %s, its worker stopped", job.id)
+            jobs.submit(run_report_job, job.id)
+
+
+jobs.periodic(sweep_report_jobs)
+
+
+def enqueue_report_job(job):
+    db.session.add(job)
+    db.session.commit()
+    jobs.submit(run_report_job, job.id)
+    return job
@@ -0,0 +1,163 @@
+from extensions.extensions import db
+
+from models.transaction import Transaction
+from models.amount_stats import AmountStats, AmountSketchBin, AmountStatsDelta, add_sketches, remove_sketches, sketches_of
+from utils.amount_sketch import RELATIVE_ERROR, AmountSketch, histogram, outliers, quantile, to_amount, value_of
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+# Rebuild the amount statistics of every account and category from the transactions table.
+# Each chunk of transactions is sketched in memory and added to the stored sketches, so memory use
+# doesn't grow with the table. Writes wait until the rebuild commits, then apply on top of it.
+def rebuild_amount_stats(chunk_size=10000, progress=None):
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("LOCK TABLE amount_stats, amount_sketch_bins, amount_stats_deltas IN EXCLUSIVE MODE")
+    # Buffered amounts are already in the transactions table, which the rebuild counts from
+    db.session.execute(db.delete(AmountStatsDelta))
+    db.session.execute(db.delete(AmountSketchBin))
+    db.session.execute(db.delete(AmountStats))
+
+    done = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Transaction.id, Transaction.account_id, Transaction.category_id, Transaction.amount)
+            .filter(Transaction.id > last_id)
+            .order_by(Transaction.id)
+            .limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        add_sketches(connection, sketches_of((row.account_id, row.category_id, row.amount) for row in rows))
+        done += len(rows)
+        last_id = rows[-1].id
+        if progress:
+            progress(done)
+    db.session.commit()
+    return done
+
+
+# Add up to `limit` buffered category amounts to the stored statistics, returning how many were merged.
+# The amounts are deleted as they are read, so two processes merging at once never count one twice.
+def merge_amount_deltas(limit=10000):
+    deltas = AmountStatsDelta.__table__
+    oldest = db.select(deltas.c.id).order_by(deltas.c.id).limit(limit).scalar_subquery()
+    rows = db.session.execute(
+        deltas.delete().where(deltas.c.id.in_(oldest)).returning(deltas.c.key, deltas.c.amount, deltas.c.sign)
+    ).all()
+    connection = db.session.connection()
+    # Added first, so an amount added and removed in the same batch doesn't take a count below zero
+    add_sketches(connection, sketches_of(((None, row.key, row.amount) for row in rows if row.sign > 0), ("category",)))
+    remove_sketches(connection, sketches_of(((None, row.key, row.amount) for row in rows if row.sign < 0), ("category",)))
+    db.session.commit()
+    return len(rows)
+
+
+# The stored sketch of an account or category. Its min or max is None if it was cleared (see AmountStats).
+def stored_sketch(scope, key):
+    sketch = AmountSketch()
+    stats = db.session.get(AmountStats, (scope, key))
+    if stats:
+        sketch.count, sketch.total = stats.count, stats.total
+        sketch.min_amount, sketch.max_amount = stats.min_amount, stats.max_amount
+    sketch.bins = dict(
+        db.session.execute(
+            db.select(AmountSketchBin.bin, AmountSketchBin.count)
+            .filter_by(scope=scope, key=key)
+            .filter(AmountSketchBin.count > 0)
+        ).all()
+    )
+    # Include the amounts still waiting for the stats merger
+    pending = db.session.execute(
+        db.select(AmountStatsDelta.amount, AmountStatsDelta.sign).filter_by(scope=scope, key=key)
+    ).all()
+    if pending:
+        added, removed = AmountSketch(), AmountSketch()
+        for amount, sign in pending:
+            (added if sign > 0 else removed).add(amount)
+        sketch = merge_sketches([sketch, added])
+        subtract_sketch(sketch, removed)
+    return sketch
+
+
+# Take the amounts of `removed` out of a sketch, clearing the bounds they reach like remove_sketches does.
+def subtract_sketch(sketch, removed):
+    if not removed.count:
+        return
+    sketch.count -= removed.count
+    sketch.total -= removed.total
+    if sketch.min_amount is not None and sketch.min_amount >= removed.min_amount:
+        sketch.min_amount = None
+    if sketch.max_amount is not None and sketch.max_amount <= removed.max_amount:
+        sketch.max_amount = None
+    for bin, count in removed.bins.items():
+        sketch.bins[bin] = sketch.bins.get(bin, 0) - count
+    sketch.bins = {bin: count for bin, count in sketch.bins.items() if count > 0}
+
+
+# Add up the stored sketches of the same category on each shard.
+def merge_sketches(sketches):
+    merged = AmountSketch()
+    for sketch in sketches:
+        if not sketch.count:
+            continue
+        if not merged.count:
+            merged.min_amount, merged.max_amount = sketch.min_amount, sketch.max_amount
+        else:
+            # A cleared bound on any shard leaves the merged one cleared too
+            mins = (merged.min_amount, sketch.min_amount)
+            maxes = (merged.max_amount, sketch.max_amount)
+            merged.min_amount = None if None in mins else min(mins)
+            merged.max_amount = None if None in maxes else max(maxes)
+        merged.count += sketch.count
+        merged.total += sketch.total
+        for bin, count in sketch.bins.items():
+            merged.bins[bin] = merged.bins.get(bin, 0) + count
+    return merged
+
+
+# Summary of the amounts of an account or category: count, sum, min, max, mean, percentiles,
+# a histogram by order of magnitude and outlier counts.
+# Percentiles come from the sketch and are within RELATIVE_ERROR of the exact value.
+def amount_stats(scope, key, percentiles=DEFAULT_PERCENTILES, sketch=None):
+    sketch = sketch or stored_sketch(scope, key)
+    bins = sorted(sketch.bins.items())
+    count = sketch.count
+    if not count or not bins:
+        return {
+            "count": 0,
+            "sum": "0.00",
+            "min": None,
+            "max": None,
+            "mean": None,
+            "percentiles": {f"p{p:g}": None for p in percentiles},
+            "histogram": [],
+            "outliers": {"low": 0, "high": 0},
+            "relative_error": RELATIVE_ERROR,
+        }
+    # Min and max are exact, unless the transaction holding them was removed since the last rebuild
+    min_amount = sketch.min_amount if sketch.min_amount is not None else value_of(bins[0][0])
+    max_amount = sketch.max_amount if sketch.max_amount is not None else value_of(bins[-1][0])
+    return {
+        "count": count,
+        "sum": to_amount(sketch.total),
+        "min": to_amount(min_amount),
+        "max": to_amount(max_amount),
+        "mean": to_amount(sketch.total / count),
+        "percentiles": {f"p{p:g}": to_amount(quantile(bins, count, p / 100)) for p in percentiles},
+        "histogram": histogram(bins),
+        "outliers": outliers(bins, count),
+        "relative_error": RELATIVE_ERROR,
+    }
+
+
+# Parse the "percentiles" query parameter, e.g. "50,90,99.9".
+def parse_percentiles(value):
+    if not value:
+        return DEFAULT_PERCENTILES
+    percentiles = tuple(float(p) for p in value.split(","))
+    if not all(0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles must be between 0 and 100")
+    return percentiles
@@ -0,0 +1,4 @@
+from app import create_app
+
+# WSGI entry point for production servers, e.g. gunicorn (configured in gunicorn.conf.py)
+app = create_app()